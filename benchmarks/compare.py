@@ -0,0 +1,53 @@
+import argparse
+import json
+
+# Prints the change of every stage between two result files of
+# benchmarks.data_loader_benchmark:
+#
+#   python -m benchmarks.compare old.json new.json
+
+
+def load_stages(path):
+    with open(path) as results_file:
+        results = json.load(results_file)
+    return {
+        (cur_result["pair_count"], cur_stage["stage"]): cur_stage
+        for cur_result in results["results"]
+        for cur_stage in cur_result["stages"]
+    }
+
+
+def compare(old_path, new_path):
+    """Returns rows of pair_count, stage, old and new seconds and their ratio."""
+
+    old_stages = load_stages(old_path)
+    new_stages = load_stages(new_path)
+    rows = []
+    for cur_key, cur_new in new_stages.items():
+        cur_old = old_stages.get(cur_key)
+        if cur_old is None:
+            continue
+        ratio = cur_new["seconds"] / cur_old["seconds"] if cur_old["seconds"] else None
+        rows.append((*cur_key, cur_old["seconds"], cur_new["seconds"], ratio))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old")
+    parser.add_argument("new")
+    args = parser.parse_args()
+
+    print(f"{'pairs':>9} {'stage':<22} {'old s':>9} {'new s':>9} {'ratio':>6}")
+    for pair_count, stage, old_seconds, new_seconds, ratio in compare(
+        args.old, args.new
+    ):
+        ratio = f"{ratio:.2f}" if ratio is not None else "-"
+        print(
+            f"{pair_count:>9} {stage:<22} {old_seconds:>9.4f} "
+            f"{new_seconds:>9.4f} {ratio:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+import numpy as np
+from wholesale.db.models import ProductWholesale, ProductAmazon
+
+# Synthetic products for the benchmarks. Every EAN is sold by one shop and has
+# one to max_asins ASINs, so the join of both tables has pair_count rows. The
+# share of missing values in the fee columns follows the products in production,
+# where the fees of many products were never fetched.
+
+shop_names = ["berk", "gross_electronic", "nlgshop", "saraswati", "vitrex"]
+null_shares = {"fees_fba": 0.15, "fees_closing": 0.15, "fees_total": 0.4}
+
+
+def make_prices(random, scale, size, null_share=0.0):
+    prices = np.round(random.uniform(0.5, scale, size), 2)
+    return [
+        None if cur_null else float(cur_price)
+        for cur_price, cur_null in zip(prices, random.random(size) < null_share)
+    ]
+
+
+def make_timestamps(random, now, size):
+    seconds = random.integers(0, 30 * 24 * 3600, size)
+    return [now - timedelta(seconds=int(cur_seconds)) for cur_seconds in seconds]
+
+
+def make_amazon_rows(random, eans, asin_start, now):
+    size = len(eans)
+    fees = {
+        cur_column: make_prices(random, scale, size, null_shares[cur_column])
+        for cur_column, scale in [
+            ("fees_fba", 6),
+            ("fees_closing", 2),
+            ("fees_total", 40),
+        ]
+    }
+    prices = make_prices(random, 200, size, null_share=0.05)
+    sales30 = random.integers(0, 300, size)
+    offers = random.integers(1, 40, size)
+    timestamps = make_timestamps(random, now, size)
+    return [
+        {
+            "ean": cur_ean,
+            "asin": f"B{asin_start + cur_index:09d}",
+            "price": prices[cur_index],
+            "fees_fba": fees["fees_fba"][cur_index],
+            "fees_closing": fees["fees_closing"][cur_index],
+            "fees_total": fees["fees_total"][cur_index],
+            "fba_offers": int(offers[cur_index] // 2),
+            "offers": int(offers[cur_index]),
+            "has_buy_box": bool(cur_index % 3),
+            "review_count": int(sales30[cur_index] * 4),
+            "rating": 4.5,
+            "sales30": int(sales30[cur_index]),
+            "sales365": int(sales30[cur_index] * 12),
+            "category_id": f"category_{cur_index % 50}",
+            "sales_rank": int(sales30[cur_index] * 100 + 1),
+            "timestamp_updated": timestamps[cur_index],
+        }
+        for cur_index, cur_ean in enumerate(eans)
+    ]
+
+
+def make_wholesale_rows(random, eans, now):
+    size = len(eans)
+    prices = make_prices(random, 120, size)
+    age_restrictions = random.choice([0, 0, 0, 12, 16, 18], size)
+    timestamps = make_timestamps(random, now, size)
+    return [
+        {
+            "shop_name": shop_names[cur_index % len(shop_names)],
+            "name": f"product {cur_ean}",
+            "ean": cur_ean,
+            "is_available": True,
+            "price_net": prices[cur_index],
+            "age_restriction": int(age_restrictions[cur_index]),
+            "timestamp_updated": timestamps[cur_index],
+        }
+        for cur_index, cur_ean in enumerate(eans)
+    ]
+
+
+def generate_products(pair_count, seed=0, max_asins=3, chunk_size=10000):
+    """
+    Yields tuples of wholesale and Amazon rows as dicts, until the Amazon rows add
+    up to pair_count. The same seed always gives the same products.
+    """
+
+    random = np.random.default_rng(seed)
+    now = datetime.now().replace(microsecond=0)
+    ean_count = 0
+    pair_total = 0
+    while pair_total < pair_count:
+        asin_counts = random.integers(1, max_asins + 1, chunk_size)
+        # the last chunk is cut at pair_count
+        asin_counts = asin_counts[np.cumsum(asin_counts) <= pair_count - pair_total]
+        if len(asin_counts) == 0:
+            asin_counts = np.array([pair_count - pair_total])
+        eans = [
+            f"{ean_count + cur_index:013d}" for cur_index in range(len(asin_counts))
+        ]
+        amazon_eans = [
+            cur_ean
+            for cur_ean, cur_count in zip(eans, asin_counts)
+            for _ in range(cur_count)
+        ]
+        yield (
+            make_wholesale_rows(random, eans, now),
+            make_amazon_rows(random, amazon_eans, pair_total, now),
+        )
+        ean_count += len(eans)
+        pair_total += len(amazon_eans)
+
+
+def load_products(connection, pair_count, seed=0):
+    """Replaces the products in the database with pair_count synthetic pairs."""
+
+    wholesale_table = ProductWholesale.__table__
+    amazon_table = ProductAmazon.__table__
+    connection.execute(wholesale_table.delete())
+    connection.execute(amazon_table.delete())
+    for cur_wholesale_rows, cur_amazon_rows in generate_products(pair_count, seed):
+        connection.execute(wholesale_table.insert(), cur_wholesale_rows)
+        connection.execute(amazon_table.insert(), cur_amazon_rows)
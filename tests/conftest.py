@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from wholesale import settings
+from wholesale.db import models
+
+
+@pytest.fixture(autouse=True)
+def local_mirror_path(monkeypatch):
+    # tests only read from a local mirror that they set up themselves
+    monkeypatch.setattr(settings, "LOCAL_MIRROR_PATH", "")
+
+
+@pytest.fixture(autouse=True)
+def data_cache_dir(tmp_path, monkeypatch):
+    # tests must never read or write the cache of get_data() in the home directory
+    monkeypatch.setattr(settings, "DATA_CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def test_engine():
+    # imported here so that tests without a database don't need the settings
+    from tests.settings import DATABASE_MYSQL_TEST
+
+    test_connection_url = (
+        f"mysql+pymysql://{DATABASE_MYSQL_TEST['USER']}:"
+        f"{DATABASE_MYSQL_TEST['PASSWORD']}@{DATABASE_MYSQL_TEST['HOST']}/"
+        f"{DATABASE_MYSQL_TEST['DBNAME']}"
+    )
+    test_engine = create_engine(test_connection_url)
+    models.Base.metadata.create_all(test_engine)
+    return test_engine
+
+
+@pytest.fixture
+def test_session_class(test_engine):
+    return sessionmaker(bind=test_engine)
+
+
+@pytest.fixture
+def test_session(test_engine, test_session_class):
+    session = test_session_class()
+    yield session
+    session.rollback()
+    session.close()
+    models.Base.metadata.drop_all(test_engine)
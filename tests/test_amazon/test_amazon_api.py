@@ -0,0 +1,32 @@
+from wholesale.amazon import amazon_api
+
+
+def make_error_response(code):
+    return {
+        "status": {"value": "ClientError"},
+        "Id": {"value": "1234"},
+        "Error": {"Code": {"value": code}, "Message": {"value": "dummy message"}},
+    }
+
+
+def test_parse_matches_without_match():
+    parsed_response = make_error_response("InvalidParameterValue")
+
+    assert amazon_api.parse_matches(parsed_response) == ("1234", "no_match", [])
+
+
+def test_parse_matches_skips_failed_requests():
+    for cur_code in ["ServerError", "RequestThrottled"]:
+        parsed_response = make_error_response(cur_code)
+
+        assert amazon_api.parse_matches(parsed_response) == (None, None, [])
+
+
+def test_get_sales_rank():
+    parsed_response = {
+        "ASIN": {"value": "abc"},
+        "Product": {"SalesRankings": {"SalesRank": [{"Rank": {"value": "42"}}]}},
+    }
+
+    assert amazon_api.get_sales_rank(parsed_response) == {"abc": 42}
+    assert amazon_api.get_sales_rank({"ASIN": {"value": "abc"}}) is None
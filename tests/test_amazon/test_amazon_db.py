@@ -0,0 +1,49 @@
+from wholesale.db.models import ProductAmazon
+from wholesale.amazon import amazon_db
+from tests.utils import make_dummy_product_amazon
+
+
+def make_new_product_amazon():
+    product = make_dummy_product_amazon()
+    product.id = None
+    return product
+
+
+def test_write_products_inserts(test_session):
+    amazon_db.write_products(test_session, [make_new_product_amazon()])
+    test_session.commit()
+
+    product = test_session.query(ProductAmazon).one()
+    assert product == make_dummy_product_amazon()
+    assert product.content_hash is not None
+
+
+def test_write_products_updates(test_session):
+    amazon_db.write_products(test_session, [make_new_product_amazon()])
+    test_session.commit()
+
+    changed_product = make_new_product_amazon()
+    changed_product.price = 3
+    # None keeps the stored value
+    changed_product.rating = None
+    new_product = make_new_product_amazon()
+    new_product.asin = "def"
+    amazon_db.write_products(test_session, [changed_product, new_product])
+    test_session.commit()
+
+    assert test_session.query(ProductAmazon).count() == 2
+    product = test_session.query(ProductAmazon).filter_by(asin="abc").one()
+    assert product.price == 3
+    assert product.rating == 5
+
+
+def test_write_products_unchanged(test_session):
+    amazon_db.write_products(test_session, [make_new_product_amazon()])
+    test_session.commit()
+    content_hash = test_session.query(ProductAmazon.content_hash).scalar()
+
+    amazon_db.write_products(test_session, [make_new_product_amazon()])
+    test_session.commit()
+
+    assert test_session.query(ProductAmazon.content_hash).scalar() == content_hash
+    assert test_session.query(ProductAmazon).count() == 1
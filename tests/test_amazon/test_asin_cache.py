@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+from wholesale.amazon import asin_cache
+from wholesale.db.models import ProductAmazon
+
+
+def test_write_and_get_matches(test_session):
+    now = datetime(2020, 6, 1)
+    asin_cache.write_matches(
+        test_session,
+        {
+            "1": (
+                "match",
+                [
+                    ProductAmazon(ean="1", asin="A1", category_id="c1"),
+                    ProductAmazon(ean="1", asin="A2", category_id="c2"),
+                ],
+            ),
+            "2": ("no_match", []),
+        },
+        now=now,
+    )
+
+    cached = asin_cache.get_cached_matches(test_session, ["1", "2", "3"], now=now)
+    assert set(cached) == {"1", "2"}
+    status, amazon_products = cached["1"]
+    assert status == "match"
+    assert sorted(
+        (cur_product.asin, cur_product.category_id) for cur_product in amazon_products
+    ) == [("A1", "c1"), ("A2", "c2")]
+    assert cached["2"] == ("no_match", [])
+
+
+def test_write_matches_replaces_mappings(test_session):
+    now = datetime(2020, 6, 1)
+    asin_cache.write_matches(
+        test_session, {"1": ("match", [ProductAmazon(ean="1", asin="A1")])}, now=now
+    )
+    asin_cache.write_matches(test_session, {"1": ("bundle_only", [])}, now=now)
+
+    assert asin_cache.get_cached_matches(test_session, ["1"], now=now) == {
+        "1": ("bundle_only", [])
+    }
+
+
+def test_get_cached_matches_expires(test_session, monkeypatch):
+    monkeypatch.setattr(
+        asin_cache.settings,
+        "ASIN_MAPPING_TTL_DAYS",
+        {"match": 30, "bundle_only": 7, "no_match": 7},
+    )
+    checked = datetime(2020, 6, 1)
+    asin_cache.write_matches(
+        test_session,
+        {
+            "1": ("match", [ProductAmazon(ean="1", asin="A1")]),
+            "2": ("no_match", []),
+        },
+        now=checked,
+    )
+
+    # the negative entries expire first
+    cached = asin_cache.get_cached_matches(
+        test_session, ["1", "2"], now=checked + timedelta(days=10)
+    )
+    assert set(cached) == {"1"}
+    cached = asin_cache.get_cached_matches(
+        test_session, ["1", "2"], now=checked + timedelta(days=31)
+    )
+    assert cached == {}
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+import pytest
+from wholesale.amazon import amazon_api, async_client, fee_cache
+from wholesale.db.models import ProductAmazon
+from wholesale.utils import rate_limiter
+
+
+class FakeAPI:
+    """Stands in for the MWS requests and records how many run at once."""
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.running = set()
+        self.max_running_operations = 0
+
+    def run(self, operation):
+        with self.lock:
+            self.running.add(operation)
+            self.max_running_operations = max(
+                self.max_running_operations, len(self.running)
+            )
+        time.sleep(self.latency)
+        with self.lock:
+            self.running.discard(operation)
+
+    def request_matches(self, batch, marketplace_id):
+        self.run("base")
+        return {
+            cur_product.ean: (
+                "match",
+                [ProductAmazon(ean=cur_product.ean, asin=f"A{cur_product.ean}")],
+            )
+            for cur_product in batch
+        }
+
+    def request_competitive_pricing(self, batch, marketplace_id):
+        self.run("pricing")
+        for cur_product in batch:
+            cur_product.price = 10
+            cur_product.has_buy_box = True
+
+    def request_competition_details(self, batch, marketplace_id):
+        self.run("details")
+        for cur_product in batch:
+            cur_product.fba_offers = 1
+
+    def request_fees(self, batch, marketplace_id):
+        self.run("fees")
+        for cur_product in batch:
+            assert cur_product.price == 10
+            cur_product.fees_total = 2
+
+
+class FakeProduct:
+    def __init__(self, ean):
+        self.ean = ean
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    fake_api = FakeAPI()
+    for cur_name in [
+        "request_matches",
+        "request_competitive_pricing",
+        "request_competition_details",
+        "request_fees",
+    ]:
+        monkeypatch.setattr(amazon_api, cur_name, getattr(fake_api, cur_name))
+    # the requests are spaced less than the latency, so that they overlap
+    for cur_operation in async_client.batch_sizes:
+        monkeypatch.setitem(
+            rate_limiter.bucket_configs,
+            amazon_api.get_bucket_name(cur_operation),
+            (1, 200),
+        )
+    rate_limiter.reset()
+    fee_cache.reset()
+    yield fake_api
+    rate_limiter.reset()
+    fee_cache.reset()
+
+
+def make_batches(batch_count):
+    return [
+        [FakeProduct(str(cur_batch * 5 + cur_index)) for cur_index in range(5)]
+        for cur_batch in range(batch_count)
+    ]
+
+
+def test_update_products(fake_api):
+    results = []
+    matched = []
+    async_client.update_products(
+        make_batches(9),
+        results.append,
+        on_matched=lambda batch, matches: matched.append(matches),
+    )
+
+    assert len(matched) == 9
+    assert matched[0]["0"][0] == "match"
+    # the 45 matched products are sent in full batches of 20
+    assert sorted(len(cur_products) for cur_products in results) == [5, 20, 20]
+    eans = sorted(
+        cur_product.ean for cur_products in results for cur_product in cur_products
+    )
+    assert eans == sorted(str(cur_index) for cur_index in range(45))
+    assert all(
+        cur_product.fees_total == 2
+        for cur_products in results
+        for cur_product in cur_products
+    )
+    # different operations ran at the same time
+    assert fake_api.max_running_operations > 1
+
+
+def test_update_products_with_matched_products(fake_api):
+    results = []
+    matched_products = [
+        ProductAmazon(ean=str(cur_index), asin=f"A{cur_index}")
+        for cur_index in range(10, 25)
+    ]
+    async_client.update_products(
+        make_batches(2), results.append, matched_products=matched_products
+    )
+
+    # the cached products skip the matching, but get all other data
+    eans = sorted(
+        cur_product.ean for cur_products in results for cur_product in cur_products
+    )
+    assert eans == sorted(str(cur_index) for cur_index in range(25))
+    assert all(cur_product.fees_total == 2 for cur_product in matched_products)
+
+
+def test_update_products_raises(fake_api, monkeypatch):
+    def fail(batch, marketplace_id):
+        raise ValueError("request failed")
+
+    monkeypatch.setattr(amazon_api, "request_fees", fail)
+    with pytest.raises(ValueError):
+        async_client.update_products(make_batches(2), lambda products: None)
+
+
+def test_rebatch_flushes_after_timeout():
+    async def run():
+        input_queue = asyncio.Queue()
+        output_queue = asyncio.Queue()
+        task = asyncio.ensure_future(
+            async_client.rebatch(input_queue, output_queue, 3, flush_timeout=0.05)
+        )
+        for cur_item in [1, 2, 3, 4]:
+            await input_queue.put(cur_item)
+        # the full batch right away, the rest after the timeout
+        assert await output_queue.get() == [1, 2, 3]
+        assert await asyncio.wait_for(output_queue.get(), 1) == [4]
+        await input_queue.put(5)
+        await input_queue.put(async_client.end_of_stream)
+        await task
+        return [output_queue.get_nowait(), output_queue.get_nowait()]
+
+    assert asyncio.run(run()) == [[5], async_client.end_of_stream]
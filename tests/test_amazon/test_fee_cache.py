@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+import pytest
+from wholesale.amazon import amazon_api, fee_cache
+from wholesale.db.models import ProductAmazon
+
+marketplace_id = "M1"
+
+
+@pytest.fixture(autouse=True)
+def cache_settings(monkeypatch):
+    monkeypatch.setattr(
+        fee_cache.settings,
+        "FEE_CACHE",
+        {"PRICE_BAND": 0.5, "SIZE": 100, "TTL_DAYS": 30},
+    )
+    fee_cache.reset()
+    yield
+    fee_cache.reset()
+
+
+class FakeFeesAPI:
+    def __init__(self):
+        self.requested_asins = []
+
+    def request_fees(self, batch, marketplace_id):
+        for cur_product in batch:
+            self.requested_asins.append(cur_product.asin)
+            cur_product.fees_total = Decimal("3.00")
+            cur_product.fees_fba = Decimal("2.00")
+
+
+@pytest.fixture
+def fake_fees_api(monkeypatch):
+    fake_fees_api = FakeFeesAPI()
+    monkeypatch.setattr(amazon_api, "request_fees", fake_fees_api.request_fees)
+    monkeypatch.setattr(amazon_api, "wait_for_quota", lambda *args: None)
+    return fake_fees_api
+
+
+def make_product(ean, asin, price):
+    return ProductAmazon(ean=ean, asin=asin, price=Decimal(price))
+
+
+def test_get_price_band():
+    assert fee_cache.get_price_band(Decimal("10.49")) == 20
+    assert fee_cache.get_price_band(Decimal("10.50")) == 21
+    assert fee_cache.get_key(make_product("1", "A1", "10.2"), marketplace_id) == (
+        "A1",
+        marketplace_id,
+        20,
+    )
+    assert fee_cache.get_key(ProductAmazon(asin="A1"), marketplace_id) is None
+
+
+def test_add_fees_requests_duplicates_once(fake_fees_api):
+    # one ASIN matched by two EANs
+    batch = [make_product("1", "A1", "10.00"), make_product("2", "A1", "10.00")]
+    amazon_api.add_fees(batch, marketplace_id)
+
+    assert fake_fees_api.requested_asins == ["A1"]
+    assert [cur_product.fees_total for cur_product in batch] == [Decimal("3.00")] * 2
+
+
+def test_add_fees_uses_the_price_band(fake_fees_api):
+    amazon_api.add_fees([make_product("1", "A1", "10.00")], marketplace_id)
+    batch = [make_product("1", "A1", "10.40"), make_product("1", "A1", "11.00")]
+    amazon_api.add_fees(batch, marketplace_id)
+
+    # only the price that moved out of its band is requested again
+    assert fake_fees_api.requested_asins == ["A1", "A1"]
+    assert batch[0].fees_fba == Decimal("2.00")
+
+
+def test_cache_evicts_least_recently_used():
+    cache = fee_cache.FeeCache(2)
+    now = datetime(2020, 6, 1)
+    cache.put("a", {"fees_total": 1}, now)
+    cache.put("b", {"fees_total": 2}, now)
+    cache.get("a", now)
+    cache.put("c", {"fees_total": 3}, now)
+
+    assert cache.get("b", now) is None
+    assert cache.get("a", now) == {"fees_total": 1}
+    assert cache.get("a", now + timedelta(days=31)) is None
+
+
+def test_write_and_load_fees(test_session):
+    now = datetime(2020, 6, 1)
+    product = make_product("1", "A1", "10.00")
+    product.fees_total = Decimal("3.00")
+    fee_cache.add_requested_fees([product], [product], marketplace_id, now=now)
+    fee_cache.write_new_fees(test_session)
+    # nothing is written twice
+    fee_cache.write_new_fees(test_session)
+    fee_cache.reset()
+
+    fee_cache.load_fees(test_session, ["A1", "A2"], marketplace_id, now=now)
+    batch = [make_product("2", "A1", "10.20")]
+    assert fee_cache.apply_cached_fees(batch, marketplace_id, now=now) == []
+    assert batch[0].fees_total == Decimal("3.00")
+
+    fee_cache.reset()
+    fee_cache.load_fees(
+        test_session, ["A1"], marketplace_id, now=now + timedelta(days=31)
+    )
+    assert fee_cache.apply_cached_fees(batch, marketplace_id, now=now) == batch
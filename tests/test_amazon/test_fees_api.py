@@ -0,0 +1,89 @@
+from decimal import Decimal
+from urllib.parse import parse_qsl, unquote
+import base64
+import hmac
+import threading
+from wholesale.amazon.fees_api import FeesAPI, parse_fees_estimates
+
+
+def get_fee_detail(fee_type, amount, included=""):
+    return (
+        f"<FeeDetail><FeeType>{fee_type}</FeeType>"
+        f"<FeeAmount><CurrencyCode>EUR</CurrencyCode><Amount>9.99</Amount></FeeAmount>"
+        f"<FinalFee><CurrencyCode>EUR</CurrencyCode><Amount>{amount}</Amount></FinalFee>"
+        f"{included}</FeeDetail>"
+    )
+
+
+def get_result(asin, body):
+    return (
+        f"<FeesEstimateResult><Status>Success</Status>"
+        f"<FeesEstimateIdentifier><IdType>ASIN</IdType><IdValue>{asin}</IdValue>"
+        f"</FeesEstimateIdentifier>{body}</FeesEstimateResult>"
+    )
+
+
+def get_response(*results):
+    return (
+        '<?xml version="1.0"?><GetMyFeesEstimateResponse '
+        'xmlns="http://mws.amazonservices.com/schema/Products/2011-10-01">'
+        f"<GetMyFeesEstimateResult><FeesEstimateResultList>{''.join(results)}"
+        "</FeesEstimateResultList></GetMyFeesEstimateResult>"
+        "</GetMyFeesEstimateResponse>"
+    ).encode("utf-8")
+
+
+def test_parse_fees_estimates():
+    closing = get_fee_detail("VariableClosingFee", "0.81")
+    fees = (
+        "<FeesEstimate><TotalFeesEstimate><CurrencyCode>EUR</CurrencyCode>"
+        "<Amount>7.53</Amount></TotalFeesEstimate><FeeDetailList>"
+        + get_fee_detail(
+            "ReferralFee",
+            "2.25",
+            f"<IncludedFeeDetailList>{closing}</IncludedFeeDetailList>",
+        )
+        + get_fee_detail("FBAFees", "4.47")
+        + "</FeeDetailList></FeesEstimate>"
+    )
+    content = get_response(
+        get_result("A1", fees),
+        # a failed estimate has no total
+        get_result("A2", "<Error><Message>invalid</Message></Error>"),
+    )
+
+    assert parse_fees_estimates(content) == {
+        "A1": {
+            "total": Decimal("7.53"),
+            "fba": Decimal("4.47"),
+            "closing": Decimal("0.81"),
+        }
+    }
+
+
+def test_sign():
+    fees_api = FeesAPI("key id", "secret", "seller", "token")
+    body = fees_api.sign({"b": "x/y", "a": "1 2"})
+
+    unsigned_body, signature = body.split("&Signature=")
+    assert unsigned_body == "a=1%202&b=x%2Fy"
+    expected = hmac.new(
+        b"secret",
+        f"POST\n{fees_api.mws_host}\n{fees_api.mws_path}\n{unsigned_body}".encode(),
+        digestmod="SHA256",
+    ).digest()
+    assert base64.b64decode(unquote(signature)) == expected
+    assert dict(parse_qsl(body))["Signature"] == base64.b64encode(expected).decode()
+
+
+def test_http_session_per_thread():
+    fees_api = FeesAPI("key id", "secret", "seller", "token")
+    http_sessions = []
+    thread = threading.Thread(
+        target=lambda: http_sessions.append(fees_api.get_http_session())
+    )
+    thread.start()
+    thread.join()
+
+    assert fees_api.get_http_session() is fees_api.get_http_session()
+    assert fees_api.get_http_session() is not http_sessions[0]
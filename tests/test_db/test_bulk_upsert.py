@@ -0,0 +1,124 @@
+from wholesale.db.models import ProductWholesale
+from wholesale.db.bulk_upsert import upsert_products_wholesale, product_to_row
+from tests.utils import make_dummy_product_wholesale
+
+
+def make_feed_product(ean, price_net, name="dummy_name"):
+    return ProductWholesale(
+        shop_name="dummy_shop",
+        name=name,
+        ean=ean,
+        price_net=price_net,
+        age_restriction=0,
+    )
+
+
+def test_upsert_empty_feed(test_session):
+    result = upsert_products_wholesale(test_session, "dummy_shop", [])
+
+    assert result == (0, 0, 0)
+    assert test_session.query(ProductWholesale).count() == 0
+
+
+def test_upsert_inserts_new_products(test_session):
+    feed = [make_feed_product("1", 1.5), make_feed_product("2", 2.5)]
+
+    result = upsert_products_wholesale(test_session, "dummy_shop", feed)
+    test_session.commit()
+
+    assert result.inserted == 2
+    assert result.updated == 0
+    assert result.unchanged == 0
+    products = test_session.query(ProductWholesale).order_by(ProductWholesale.ean)
+    assert [cur_product.ean for cur_product in products] == ["1", "2"]
+    assert [float(cur_product.price_net) for cur_product in products] == [1.5, 2.5]
+
+
+def test_upsert_updates_changed_products(test_session):
+    test_session.add(make_dummy_product_wholesale())
+    test_session.commit()
+
+    feed = [make_feed_product("1234", 2), make_feed_product("5678", 3)]
+    result = upsert_products_wholesale(test_session, "dummy_shop", feed)
+    test_session.commit()
+
+    assert result.inserted == 1
+    assert result.updated == 1
+    assert result.unchanged == 0
+    product = test_session.query(ProductWholesale).filter_by(ean="1234").one()
+    assert product.price_net == 2
+    # is_available is not part of the feed and therefore kept
+    assert product.is_available is True
+
+
+def test_upsert_counts_unchanged_products(test_session):
+    test_session.add(make_dummy_product_wholesale())
+    test_session.commit()
+
+    feed = [make_feed_product("1234", 1.5)]
+    result = upsert_products_wholesale(test_session, "dummy_shop", feed)
+
+    assert result.inserted == 0
+    assert result.updated == 0
+    assert result.unchanged == 1
+
+
+def test_upsert_keeps_other_shops(test_session):
+    other_product = make_dummy_product_wholesale()
+    other_product.shop_name = "other_shop"
+    test_session.add(other_product)
+    test_session.commit()
+
+    feed = [make_feed_product("1234", 2)]
+    result = upsert_products_wholesale(test_session, "dummy_shop", feed)
+    test_session.commit()
+
+    assert result.inserted == 1
+    assert test_session.query(ProductWholesale).count() == 2
+    other_product = (
+        test_session.query(ProductWholesale).filter_by(shop_name="other_shop").one()
+    )
+    assert other_product.price_net == 1.5
+
+
+def test_upsert_last_duplicate_wins(test_session):
+    feed = [make_feed_product("1", 1, name="first"), make_feed_product("1", 2)]
+
+    result = upsert_products_wholesale(test_session, "dummy_shop", feed)
+    test_session.commit()
+
+    assert result.inserted == 1
+    product = test_session.query(ProductWholesale).one()
+    assert product.name == "dummy_name"
+    assert product.price_net == 2
+
+
+def test_upsert_sets_content_hash(test_session):
+    feed = [make_feed_product("1", 1.5)]
+
+    upsert_products_wholesale(test_session, "dummy_shop", feed)
+    test_session.commit()
+
+    product = test_session.query(ProductWholesale).one()
+    assert product.content_hash == product_to_row(feed[0])["content_hash"]
+
+    result = upsert_products_wholesale(test_session, "dummy_shop", feed)
+    assert result.unchanged == 1
+
+
+def test_upsert_clears_content_hash_of_merged_rows(test_session):
+    test_session.add(make_dummy_product_wholesale())
+    test_session.commit()
+
+    # is_available is kept from the database, so the hash of the feed row is wrong
+    feed = [make_feed_product("1234", 1.5)]
+    result = upsert_products_wholesale(test_session, "dummy_shop", feed)
+    assert result.unchanged == 1
+
+    feed = [make_feed_product("1234", 2)]
+    upsert_products_wholesale(test_session, "dummy_shop", feed)
+    test_session.commit()
+
+    product = test_session.query(ProductWholesale).one()
+    assert product.price_net == 2
+    assert product.content_hash is None
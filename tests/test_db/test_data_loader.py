@@ -1,41 +1,8 @@
-import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from tests.settings import DATABASE_MYSQL_TEST
-from wholesale import db
 from wholesale.db import models
 from wholesale.db import data_loader
 from tests.utils import make_dummy_product_wholesale, make_dummy_product_amazon
 
 
-@pytest.fixture
-def test_engine():
-    test_connection_url = (
-        f"mysql+pymysql://{DATABASE_MYSQL_TEST['USER']}:"
-        f"{DATABASE_MYSQL_TEST['PASSWORD']}@{DATABASE_MYSQL_TEST['HOST']}/"
-        f"{DATABASE_MYSQL_TEST['DBNAME']}"
-    )
-    test_engine = create_engine(test_connection_url)
-    models.Base.metadata.create_all(test_engine)
-    return test_engine
-
-
-@pytest.fixture
-def test_session_class(test_engine):
-    return sessionmaker(bind=test_engine)
-
-
-@pytest.fixture
-def test_session(test_session_class):
-    session = test_session_class()
-    yield session
-    session.rollback()
-    session.execute(f"drop table {models.ProductWholesale.__tablename__}")
-    session.execute(f"drop table {models.ProductAmazon.__tablename__}")
-    session.commit()
-    session.close()
-
-
 def test_db_empty(test_session):
     session = test_session
     wholesale_products = session.query(models.ProductWholesale).all()
@@ -192,3 +159,53 @@ def test_calculations(test_session):
     assert round(row["fees_total"], 6) == round(fees_total, 6)
     assert row["sales_rank"] == 1000
     assert row["category_id"] == "dummy_category"
+
+
+def test_get_raw_data_columns_selection(test_session):
+    df = data_loader.get_raw_data_from_db(test_session, columns=["ean", "asin"])
+    assert df.columns.tolist() == ["ean", "asin"]
+
+
+def test_get_data_filters(test_session):
+    cheap_product = make_dummy_product_wholesale()
+    cheap_product.price_net = 1
+    expensive_product = make_dummy_product_wholesale()
+    expensive_product.id = 2
+    expensive_product.shop_name = "other_shop"
+    expensive_product.price_net = 100
+    amazon_product = make_dummy_product_amazon()
+    amazon_product.price = 20
+    test_session.add_all([cheap_product, expensive_product, amazon_product])
+    test_session.commit()
+
+    df = data_loader.get_data(test_session, columns=["shop_name", "profit"])
+    assert df.columns.tolist() == ["shop_name", "profit"]
+    assert len(df) == 2
+
+    df = data_loader.get_data(test_session, min_profit=0)
+    assert df["shop_name"].tolist() == ["dummy_shop"]
+    df = data_loader.get_data(test_session, min_roi=1)
+    assert df["shop_name"].tolist() == ["dummy_shop"]
+    df = data_loader.get_data(test_session, shops=["other_shop"])
+    assert df["shop_name"].tolist() == ["other_shop"]
+    df = data_loader.get_data(test_session, min_profit=100)
+    assert len(df) == 0
+
+
+def test_get_data_chunks(test_session):
+    for cur_id in range(1, 6):
+        product = make_dummy_product_wholesale()
+        product.id = cur_id
+        product.shop_name = f"shop_{cur_id}"
+        test_session.add(product)
+    test_session.add(make_dummy_product_amazon())
+    test_session.commit()
+
+    chunks = list(data_loader.get_data_chunks(test_session, chunksize=2))
+    assert [len(cur_chunk) for cur_chunk in chunks] == [2, 2, 1]
+    assert chunks[0].columns.tolist() == data_loader.data_columns
+
+    chunks = data_loader.get_data_chunks(test_session, shops=["shop_1"])
+    assert sum(len(cur_chunk) for cur_chunk in chunks) == 1
+    chunks = data_loader.get_data_chunks(test_session, min_profit=0)
+    assert sum(len(cur_chunk) for cur_chunk in chunks) == 0
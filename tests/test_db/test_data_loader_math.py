@@ -0,0 +1,121 @@
+import numpy as np
+from wholesale.db import data_loader
+from wholesale.db.data_loader import (
+    fba_de_fee,
+    default_shipping,
+    default_percent,
+    vat_tax,
+    adult_check_fee,
+)
+from tests.utils import make_raw_data
+
+# The pandas implementation of the metrics before they were vectorized. The
+# vectorized functions have to give the same results.
+
+
+def reference_estimate_fees(df):
+    df["fees_percentage"] = round(
+        (df["fees_total"] - df["fees_fba_net"] - df["fees_closing_net"])
+        / df["price_amazon"],
+        2,
+    )
+    df["fees_total"] = df["fees_total"].where(
+        ~df["fees_total"].isna(),
+        df["price_amazon"] * default_percent + default_shipping,
+    )
+    df["fees_total"] = df["fees_total"].where(
+        df["age_restriction"] < 18, df["fees_total"] + adult_check_fee
+    )
+    df["fees_total"] = df["fees_total"] + fba_de_fee
+
+
+def reference_add_taxes(df):
+    df["price_shop"] = df["price_shop"] * 1.19
+    df["fees_total"] = df["fees_total"] * 1.19
+
+
+def reference_add_profit(df):
+    df["profit"] = df["price_amazon"] - df["fees_total"] - df["price_shop"]
+
+
+def reference_add_roi(df):
+    df["roi"] = df["profit"] / df["price_shop"]
+
+
+def reference_add_margin(df):
+    df["margin"] = df["profit"] / df["price_amazon"]
+
+
+def reference_add_break_even(df):
+    df["age_fee"] = 0
+    df["age_fee"].where(df["age_restriction"] < 18, adult_check_fee, inplace=True)
+    df["break_even"] = (
+        (1 + vat_tax)
+        / (1 - df["fees_percentage"] * (1 + vat_tax))
+        * (
+            df["price_shop"] / (1 + vat_tax)
+            + df["fees_closing_net"]
+            + df["fees_fba_net"]
+            + df["age_fee"]
+            + fba_de_fee
+        )
+    )
+    df["safety_percent"] = (df["price_amazon"] - df["break_even"]) / df["price_amazon"]
+
+
+def compute_reference(df):
+    # the old implementation relied on pd.read_sql to turn Decimals into floats
+    df = df.copy()
+    for cur_column in data_loader.numeric_columns:
+        if cur_column in df.columns:
+            df[cur_column] = df[cur_column].astype(float)
+    reference_estimate_fees(df)
+    reference_add_taxes(df)
+    reference_add_profit(df)
+    reference_add_roi(df)
+    reference_add_margin(df)
+    reference_add_break_even(df)
+    return df
+
+
+def compute_vectorized(df):
+    df = df.copy()
+    data_loader.coerce_numeric_columns(df)
+    data_loader.estimate_fees(df)
+    data_loader.add_taxes(df)
+    data_loader.add_profit(df)
+    data_loader.add_roi(df)
+    data_loader.add_margin(df)
+    data_loader.add_break_even(df)
+    return df
+
+
+def test_coerce_numeric_columns():
+    df = make_raw_data(row_count=10)
+    data_loader.coerce_numeric_columns(df)
+
+    for cur_column in ["price_shop", "price_amazon", "fees_total"]:
+        assert df[cur_column].dtype == np.float64
+
+
+def test_metrics_match_reference():
+    raw_data = make_raw_data()
+    expected = compute_reference(raw_data)
+    actual = compute_vectorized(raw_data)
+
+    columns = [
+        "fees_percentage",
+        "fees_total",
+        "price_shop",
+        "profit",
+        "roi",
+        "margin",
+        "break_even",
+        "safety_percent",
+    ]
+    for cur_column in columns:
+        np.testing.assert_allclose(
+            actual[cur_column].to_numpy(dtype="float64"),
+            expected[cur_column].to_numpy(dtype="float64"),
+            rtol=1e-12,
+        )
@@ -0,0 +1,72 @@
+import pytest
+from wholesale import settings
+from wholesale.db import data_loader, frame_cache
+from wholesale.db.models import ProductWholesale
+from tests.utils import make_dummy_product_wholesale, make_dummy_product_amazon
+
+pytest.importorskip("pyarrow")
+
+
+def add_dummy_products(session):
+    session.add(make_dummy_product_wholesale())
+    session.add(make_dummy_product_amazon())
+    session.commit()
+
+
+def get_cache_key(session):
+    return frame_cache.get_cache_key(session, data_loader.get_constants_fingerprint())
+
+
+def test_get_data_writes_and_reads_cache(test_session, data_cache_dir):
+    add_dummy_products(test_session)
+
+    expected = data_loader.get_data(test_session)
+    key = get_cache_key(test_session)
+    assert frame_cache.read_cached_table(key) is not None
+
+    df = data_loader.get_data(test_session, shops=["dummy_shop"], columns=["ean"])
+    assert df["ean"].tolist() == expected["ean"].tolist()
+    chunks = list(data_loader.get_data_chunks(test_session, columns=["ean"]))
+    assert sum(len(cur_chunk) for cur_chunk in chunks) == 1
+
+
+def test_cache_key_changes_on_write(test_session):
+    add_dummy_products(test_session)
+    key = get_cache_key(test_session)
+
+    test_session.add(
+        ProductWholesale(shop_name="other", name="a", ean="1", price_net=1)
+    )
+    test_session.commit()
+
+    assert get_cache_key(test_session) != key
+
+
+def test_invalidate(test_session, data_cache_dir):
+    add_dummy_products(test_session)
+    data_loader.get_data(test_session)
+    assert len(list(data_cache_dir.glob("data-*.arrow"))) == 1
+
+    frame_cache.invalidate()
+
+    assert len(list(data_cache_dir.glob("data-*.arrow"))) == 0
+
+
+def test_invalidate_disabled_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DATA_CACHE_DIR", "")
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data-1.arrow").write_bytes(b"")
+
+    frame_cache.invalidate()
+
+    assert (tmp_path / "data-1.arrow").exists()
+
+
+def test_filtered_get_data_does_not_fill_cache(test_session, data_cache_dir):
+    add_dummy_products(test_session)
+
+    df = data_loader.get_data(test_session, shops=["dummy_shop"], columns=["ean"])
+
+    assert df.columns.tolist() == ["ean"]
+    assert len(df) == 1
+    assert frame_cache.read_cached_table(get_cache_key(test_session)) is None
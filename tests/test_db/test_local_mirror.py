@@ -0,0 +1,50 @@
+from wholesale import settings
+from wholesale.db import data_loader, local_mirror
+from wholesale.db.models import ProductAmazon
+from tests.utils import make_dummy_product_wholesale, make_dummy_product_amazon
+
+
+def test_sync_mirror(test_session, tmp_path):
+    mirror_path = tmp_path / "mirror.sqlite"
+    test_session.add(make_dummy_product_wholesale())
+    test_session.add(make_dummy_product_amazon())
+    test_session.commit()
+
+    result = local_mirror.sync_mirror(test_session, path=mirror_path)
+
+    assert result == {"products_wholesale": 1, "products_amazon": 1}
+    df = local_mirror.get_data(mirror_path)
+    assert len(df) == 1
+    assert df.iloc[0]["ean"] == "1234"
+    assert df.iloc[0]["asin"] == "abc"
+
+
+def test_sync_mirror_incremental(test_session, tmp_path):
+    mirror_path = tmp_path / "mirror.sqlite"
+    test_session.add(make_dummy_product_wholesale())
+    test_session.commit()
+    local_mirror.sync_mirror(test_session, path=mirror_path)
+
+    test_session.add(make_dummy_product_amazon())
+    test_session.commit()
+    result = local_mirror.sync_mirror(test_session, path=mirror_path)
+
+    # the rows of the last second are copied again
+    assert result["products_amazon"] == 1
+    assert result["products_wholesale"] <= 1
+    assert len(local_mirror.get_data(mirror_path)) == 1
+
+
+def test_get_data_reads_enabled_mirror(test_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "LOCAL_MIRROR_PATH", str(tmp_path / "mirror.sqlite"))
+    test_session.add(make_dummy_product_wholesale())
+    test_session.add(make_dummy_product_amazon())
+    test_session.commit()
+    local_mirror.sync_mirror(test_session)
+
+    test_session.query(ProductAmazon).delete()
+    test_session.commit()
+
+    assert len(data_loader.get_data(test_session)) == 1
+    monkeypatch.setattr(settings, "LOCAL_MIRROR_PATH", "")
+    assert len(data_loader.get_data(test_session)) == 0
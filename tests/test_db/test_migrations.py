@@ -0,0 +1,119 @@
+from sqlalchemy import inspect, MetaData, Table, select, text
+from wholesale.db import migrations, profitability
+from wholesale.db.models import (
+    Base,
+    ProductWholesale,
+    ProductAmazon,
+    wholesale_update_fields,
+    amazon_update_fields,
+    compute_content_hash,
+)
+
+
+def get_index_names(engine, table_name):
+    return {cur_index["name"] for cur_index in inspect(engine).get_indexes(table_name)}
+
+
+def drop_migration_objects(engine):
+    # the view of migration 4 would outlive the test otherwise
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP VIEW IF EXISTS {profitability.view_name}"))
+    migrations.schema_version.drop(engine)
+
+
+def create_baseline_tables(engine):
+    """
+    Replaces the product tables with the ones of the baseline, without indexes
+    and content hashes.
+    """
+
+    Base.metadata.drop_all(engine)
+    metadata = MetaData()
+    tables = [
+        Table(
+            cur_table.name,
+            metadata,
+            *[
+                cur_column.copy()
+                for cur_column in cur_table.columns
+                if cur_column.name != "content_hash"
+            ],
+        )
+        for cur_table in [ProductWholesale.__table__, ProductAmazon.__table__]
+    ]
+    metadata.create_all(engine)
+    return tables
+
+
+def test_migrate(test_engine, test_session):
+    try:
+        version = migrations.migrate(test_engine)
+        assert version == migrations.migrations[-1].version
+
+        # running it again must not apply anything
+        assert migrations.migrate(test_engine) == version
+
+        index_names = get_index_names(test_engine, "products_wholesale")
+        assert "uq_products_wholesale_shop_name_ean" in index_names
+    finally:
+        drop_migration_objects(test_engine)
+
+
+def test_migrate_baseline_with_duplicates(test_engine, test_session):
+    wholesale, amazon = create_baseline_tables(test_engine)
+    with test_engine.begin() as connection:
+        connection.execute(
+            wholesale.insert(),
+            [
+                {"id": 1, "shop_name": "a", "ean": "1", "name": "old", "price_net": 1},
+                {"id": 2, "shop_name": "a", "ean": "1", "name": "new", "price_net": 2},
+                {
+                    "id": 3,
+                    "shop_name": "b",
+                    "ean": "1",
+                    "name": "other",
+                    "price_net": 3,
+                },
+            ],
+        )
+        connection.execute(
+            amazon.insert(),
+            [
+                {"id": 1, "ean": "1", "asin": "x"},
+                {"id": 2, "ean": "1", "asin": "x"},
+                {"id": 3, "ean": "1", "asin": "y"},
+            ],
+        )
+
+    try:
+        migrations.migrate(test_engine)
+
+        with test_engine.connect() as connection:
+            # only the oldest row of every duplicate is kept
+            assert connection.execute(
+                select([wholesale.c.id]).order_by(wholesale.c.id)
+            ).fetchall() == [(1,), (3,)]
+            assert connection.execute(
+                select([amazon.c.id]).order_by(amazon.c.id)
+            ).fetchall() == [(1,), (3,)]
+        assert get_index_names(test_engine, "products_wholesale") >= {
+            "uq_products_wholesale_shop_name_ean",
+            "ix_products_wholesale_ean",
+        }
+        assert get_index_names(test_engine, "products_amazon") >= {
+            "uq_products_amazon_ean_asin",
+            "ix_products_amazon_asin",
+        }
+
+        for cur_table, cur_fields in [
+            (ProductWholesale.__table__, wholesale_update_fields),
+            (ProductAmazon.__table__, amazon_update_fields),
+        ]:
+            with test_engine.connect() as connection:
+                rows = connection.execute(select([cur_table])).fetchall()
+            for cur_row in rows:
+                assert cur_row.content_hash == compute_content_hash(
+                    cur_table, cur_fields, dict(cur_row)
+                )
+    finally:
+        drop_migration_objects(test_engine)
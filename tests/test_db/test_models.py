@@ -1,4 +1,12 @@
-from wholesale.db.models import ProductWholesale, ProductWholesaleItem
+from decimal import Decimal
+from wholesale.db.models import (
+    ProductWholesale,
+    ProductWholesaleItem,
+    ProductAmazon,
+    wholesale_update_fields,
+    amazon_update_fields,
+    compute_content_hash,
+)
 from tests.utils import make_dummy_product_amazon, make_dummy_product_wholesale
 
 
@@ -13,6 +21,7 @@ def test_product_wholesale_has_attrs():
     assert dummy_attrs == {
         "__module__",
         "__tablename__",
+        "__table_args__",
         "id",
         "shop_name",
         "name",
@@ -20,6 +29,7 @@ def test_product_wholesale_has_attrs():
         "is_available",
         "price_net",
         "age_restriction",
+        "content_hash",
         "timestamp_created",
         "timestamp_updated",
         "update",
@@ -151,6 +161,67 @@ def test_product_wholesale_item():
     assert isinstance(test_item, ProductWholesale) is True
 
 
+def make_wholesale_hash(product):
+    return compute_content_hash(
+        ProductWholesale.__table__, wholesale_update_fields, product
+    )
+
+
+def test_product_wholesale_content_hash():
+    dummy = make_dummy_product_wholesale()
+    another = make_dummy_product_wholesale()
+
+    assert make_wholesale_hash(dummy) == make_wholesale_hash(another)
+
+    # the shop and the ean are not part of the content
+    another.shop_name = "test"
+    another.ean = "12"
+    assert make_wholesale_hash(dummy) == make_wholesale_hash(another)
+
+    # values from the database and from a feed are formatted the same way
+    another.price_net = Decimal("1.50")
+    assert make_wholesale_hash(dummy) == make_wholesale_hash(another)
+
+    another.price_net = 1.4
+    assert make_wholesale_hash(dummy) != make_wholesale_hash(another)
+    another.price_net = 1.5
+
+    another.is_available = False
+    assert make_wholesale_hash(dummy) != make_wholesale_hash(another)
+    another.is_available = True
+
+    # a missing age restriction is the column default
+    another.age_restriction = None
+    assert make_wholesale_hash(dummy) == make_wholesale_hash(another)
+
+
+def test_product_wholesale_content_hash_dict():
+    dummy = make_dummy_product_wholesale()
+    values = {
+        cur_field: getattr(dummy, cur_field) for cur_field in wholesale_update_fields
+    }
+
+    assert make_wholesale_hash(dummy) == make_wholesale_hash(values)
+
+
+def test_product_amazon_content_hash():
+    dummy = make_dummy_product_amazon()
+    another = make_dummy_product_amazon()
+
+    def make_hash(product):
+        return compute_content_hash(
+            ProductAmazon.__table__, amazon_update_fields, product
+        )
+
+    assert make_hash(dummy) == make_hash(another)
+
+    for cur_field in amazon_update_fields:
+        setattr(another, cur_field, None)
+        assert make_hash(dummy) != make_hash(another)
+        setattr(another, cur_field, getattr(dummy, cur_field))
+    assert make_hash(dummy) == make_hash(another)
+
+
 def test_product_amazon_table_name():
     dummy = make_dummy_product_amazon()
     assert dummy.__tablename__ == "products_amazon"
@@ -185,11 +256,13 @@ def test_product_wholesale_has_attrs():
         "__init__",
         "__eq__",
         "__tablename__",
+        "__table_args__",
         "has_buy_box",
         "fba_offers",
         "offers",
         "review_count",
         "category_id",
+        "content_hash",
     }
 
 
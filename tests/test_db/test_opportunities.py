@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+from wholesale.db import data_loader, opportunities
+from wholesale.db.models import Opportunity, ProductWholesale
+from tests.utils import make_dummy_product_wholesale, make_dummy_product_amazon
+
+
+def add_dummy_products(session):
+    session.add(make_dummy_product_wholesale())
+    session.add(make_dummy_product_amazon())
+    session.commit()
+
+
+def test_refresh_matches_get_data(test_session):
+    add_dummy_products(test_session)
+    expected = data_loader.get_data(test_session)
+
+    assert not opportunities.is_fresh(test_session)
+    assert opportunities.refresh_opportunities(test_session) == 1
+    test_session.commit()
+
+    assert opportunities.is_fresh(test_session)
+    df = data_loader.get_data(test_session)
+    assert df.columns.tolist() == data_loader.data_columns
+    assert df.iloc[0]["ean"] == expected.iloc[0]["ean"]
+    # the metrics are stored as doubles
+    assert df.iloc[0]["profit"] == expected.iloc[0]["profit"]
+    assert df.iloc[0]["roi"] == expected.iloc[0]["roi"]
+
+
+def test_refresh_is_incremental(test_session):
+    now = datetime.now()
+    amazon_product = make_dummy_product_amazon()
+    amazon_product.timestamp_updated = now - timedelta(hours=2)
+    other_product = make_dummy_product_wholesale()
+    other_product.id = 2
+    other_product.shop_name = "other_shop"
+    other_product.timestamp_updated = now - timedelta(hours=2)
+    product = make_dummy_product_wholesale()
+    product.timestamp_updated = now - timedelta(hours=1)
+    test_session.add_all([amazon_product, other_product, product])
+    test_session.commit()
+    assert opportunities.refresh_opportunities(test_session) == 2
+    test_session.commit()
+
+    product.price_net = 0.5
+    product.timestamp_updated = now
+    test_session.commit()
+    assert not opportunities.is_fresh(test_session)
+
+    assert opportunities.refresh_opportunities(test_session) == 1
+    test_session.commit()
+
+    assert test_session.query(Opportunity).count() == 2
+    opportunity = test_session.query(Opportunity).filter_by(shop_name="dummy_shop")
+    assert opportunity.one().price_shop == 0.5 * (1 + data_loader.vat_tax)
+
+
+def test_refresh_rebuilds_on_changed_constants(test_session, monkeypatch):
+    add_dummy_products(test_session)
+    opportunities.refresh_opportunities(test_session)
+    test_session.commit()
+
+    monkeypatch.setattr(data_loader, "fba_de_fee", 1)
+    assert not opportunities.is_fresh(test_session)
+    assert opportunities.refresh_opportunities(test_session) == 1
+    test_session.commit()
+
+    assert opportunities.is_fresh(test_session)
+
+
+def test_refresh_deletes_stale_opportunities(test_session):
+    add_dummy_products(test_session)
+    opportunities.refresh_opportunities(test_session)
+    test_session.commit()
+
+    test_session.query(ProductWholesale).delete()
+    test_session.commit()
+    opportunities.refresh_opportunities(test_session)
+    test_session.commit()
+
+    assert test_session.query(Opportunity).count() == 0
+
+
+def test_read_opportunities_filters(test_session):
+    add_dummy_products(test_session)
+    opportunities.refresh_opportunities(test_session)
+    test_session.commit()
+
+    df = data_loader.get_data(test_session, shops=["dummy_shop"], columns=["ean"])
+    assert df.columns.tolist() == ["ean"]
+    assert len(df) == 1
+    assert len(data_loader.get_data(test_session, shops=["other_shop"])) == 0
+    assert len(data_loader.get_data(test_session, min_profit=100)) == 0
+
+
+def add_ranked_products(session):
+    # (price_net, sales30, offers), a lower shop price gives a higher roi
+    values = [(1, 10, 2), (0.5, 10, 20), (0.8, 0, 2), (0.9, 10, 2)]
+    for cur_id, (cur_price_net, cur_sales30, cur_offers) in enumerate(values):
+        product_wholesale = make_dummy_product_wholesale()
+        product_wholesale.id = cur_id + 1
+        product_wholesale.ean = str(cur_id)
+        product_wholesale.price_net = cur_price_net
+        product_amazon = make_dummy_product_amazon()
+        product_amazon.id = cur_id + 1
+        product_amazon.ean = str(cur_id)
+        product_amazon.price = 20
+        product_amazon.sales30 = cur_sales30
+        product_amazon.offers = cur_offers
+        session.add_all([product_wholesale, product_amazon])
+    session.commit()
+
+
+def test_top_opportunities(test_session):
+    add_ranked_products(test_session)
+
+    for cur_refresh in [False, True]:
+        if cur_refresh:
+            opportunities.refresh_opportunities(test_session)
+            test_session.commit()
+        assert opportunities.is_fresh(test_session) == cur_refresh
+
+        df = data_loader.top_opportunities(test_session, k=2, columns=["ean", "roi"])
+        assert df.columns.tolist() == ["ean", "roi"]
+        assert df["ean"].tolist() == ["1", "2"]
+
+        df = data_loader.top_opportunities(
+            test_session, k=2, min_sales30=1, max_offers=5, columns=["ean"]
+        )
+        assert df["ean"].tolist() == ["3", "0"]
+        df = data_loader.top_opportunities(test_session, shops=["other_shop"])
+        assert len(df) == 0
@@ -0,0 +1,86 @@
+from datetime import date, datetime
+from wholesale.db.models import ProductWholesale, PriceHistory
+from wholesale.db.bulk_upsert import upsert_products_wholesale
+from wholesale.db import price_history
+from wholesale.amazon import amazon_db
+from tests.utils import make_dummy_product_amazon
+
+
+def make_feed_product(ean, price_net):
+    return ProductWholesale(
+        shop_name="dummy_shop",
+        name="dummy_name",
+        ean=ean,
+        price_net=price_net,
+        age_restriction=0,
+    )
+
+
+def test_upsert_records_price_changes(test_session):
+    upsert_products_wholesale(test_session, "dummy_shop", [make_feed_product("1", 1)])
+    upsert_products_wholesale(test_session, "dummy_shop", [make_feed_product("1", 1)])
+    upsert_products_wholesale(test_session, "dummy_shop", [make_feed_product("1", 2)])
+    test_session.commit()
+
+    series = price_history.get_price_series(test_session, "1", field="price_net")
+    assert [cur_row.value for cur_row in series] == [1, 2]
+    assert series[0].shop_name == "dummy_shop"
+    rows = test_session.query(PriceHistory).order_by(PriceHistory.id).all()
+    assert [cur_row.value_old for cur_row in rows] == [None, 1]
+
+
+def test_write_products_records_price_changes(test_session):
+    product = make_dummy_product_amazon()
+    product.id = None
+    amazon_db.write_products(test_session, [product])
+    test_session.commit()
+
+    changed_product = make_dummy_product_amazon()
+    changed_product.id = None
+    changed_product.price = 1
+    # not tracked
+    changed_product.rating = 4
+    amazon_db.write_products(test_session, [changed_product])
+    test_session.commit()
+
+    series = price_history.get_price_series(test_session, "1234")
+    assert [cur_row.value for cur_row in series] == [1.5, 1]
+    assert series[0].asin == "abc"
+    assert test_session.query(PriceHistory).filter_by(field="rating").count() == 0
+
+
+def test_get_price_drops(test_session):
+    history = [
+        # new product
+        ("1", None, 10),
+        ("1", 10, 8),
+        ("2", 10, 9),
+        # rose again
+        ("3", 10, 5),
+        ("3", 5, 10),
+    ]
+    for cur_ean, cur_value_old, cur_value_new in history:
+        test_session.add(
+            PriceHistory(
+                recorded_at=datetime.now(),
+                ean=cur_ean,
+                asin="abc",
+                field="price",
+                value_old=cur_value_old,
+                value_new=cur_value_new,
+            )
+        )
+        test_session.flush()
+    test_session.commit()
+
+    drops = price_history.get_price_drops(test_session, 15)
+    assert [(cur_row.ean, cur_row.value_now) for cur_row in drops] == [("1", 8)]
+
+    drops = price_history.get_price_drops(test_session, 10)
+    assert sorted(cur_row.ean for cur_row in drops) == ["1", "2"]
+
+
+def test_get_month_start():
+    assert price_history.get_month_start(date(2020, 12, 24)) == date(2020, 12, 1)
+    assert price_history.get_month_start(date(2020, 12, 24), 1) == date(2021, 1, 1)
+    assert price_history.get_partition_name(date(2021, 1, 1)) == "p202101"
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from wholesale.db import data_loader, opportunities, profitability
+from wholesale.db.models import FeeConfig
+from tests.utils import make_dummy_product_wholesale, make_dummy_product_amazon
+
+
+def add_products(session):
+    # (price_net, age_restriction, price, fees_total), the fees percentage of the
+    # last product is the tie 0.125
+    values = [(1.5, 0, 1.5, 1), (10, 18, 40, 8.5), (20, 0, 60, None), (5, 0, 8, 2)]
+    for cur_id, (cur_price_net, cur_age, cur_price, cur_fees) in enumerate(values):
+        product_wholesale = make_dummy_product_wholesale()
+        product_wholesale.id = cur_id + 1
+        product_wholesale.ean = str(cur_id)
+        product_wholesale.price_net = cur_price_net
+        product_wholesale.age_restriction = cur_age
+        product_amazon = make_dummy_product_amazon()
+        product_amazon.id = cur_id + 1
+        product_amazon.ean = str(cur_id)
+        product_amazon.price = cur_price
+        product_amazon.fees_total = cur_fees
+        session.add_all([product_wholesale, product_amazon])
+    session.commit()
+
+
+def create_view(session):
+    connection = session.connection()
+    profitability.sync_fee_config(connection)
+    profitability.create_view(connection)
+    session.commit()
+
+
+def drop_view(session):
+    session.execute(text(f"DROP VIEW IF EXISTS {profitability.view_name}"))
+    session.commit()
+
+
+def test_sync_fee_config(test_session):
+    profitability.sync_fee_config(test_session.connection())
+    profitability.sync_fee_config(test_session.connection())
+
+    config = test_session.query(FeeConfig).one()
+    assert config.vat_tax == data_loader.vat_tax
+    assert config.adult_check_fee == data_loader.adult_check_fee
+
+
+def test_view_matches_get_data(test_session):
+    add_products(test_session)
+    create_view(test_session)
+    try:
+        expected = data_loader.get_data(test_session).sort_values("ean")
+        query = test_session.query(profitability.profitability)
+        actual = pd.read_sql(query.statement, test_session.connection())
+        actual = actual.sort_values("ean")
+    finally:
+        drop_view(test_session)
+
+    assert actual.columns.tolist() == data_loader.data_columns
+    assert actual["ean"].tolist() == expected["ean"].tolist()
+    assert actual["fees_percentage"].iloc[-1] == expected["fees_percentage"].iloc[-1]
+    assert expected["fees_percentage"].iloc[-1] == 0.12
+    for cur_column in ["price_shop", "fees_total", "profit", "roi", "margin"]:
+        np.testing.assert_allclose(
+            actual[cur_column].to_numpy(dtype="float64"),
+            expected[cur_column].to_numpy(dtype="float64"),
+            rtol=1e-9,
+        )
+    for cur_column in ["fees_percentage", "break_even", "safety_percent"]:
+        np.testing.assert_allclose(
+            actual[cur_column].to_numpy(dtype="float64"),
+            expected[cur_column].to_numpy(dtype="float64"),
+            rtol=1e-9,
+            equal_nan=True,
+        )
+
+
+def test_top_by_roi(test_session):
+    add_products(test_session)
+    create_view(test_session)
+    try:
+        rows = profitability.get_top_by_roi_query(
+            test_session, "dummy_shop", limit=2, columns=["ean", "roi"]
+        ).all()
+    finally:
+        drop_view(test_session)
+
+    assert [cur_row.ean for cur_row in rows] == ["1", "2"]
+
+
+def test_top_by_roi_reads_fresh_opportunities(test_session):
+    add_products(test_session)
+    opportunities.refresh_opportunities(test_session)
+    test_session.commit()
+
+    # the view doesn't exist, so the rows can only come from the opportunities
+    rows = profitability.get_top_by_roi_query(
+        test_session, "dummy_shop", limit=2, columns=["ean", "roi"]
+    ).all()
+
+    assert [cur_row.ean for cur_row in rows] == ["1", "2"]
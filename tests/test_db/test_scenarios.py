@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+from wholesale.db import data_loader, scenarios
+from tests.utils import make_raw_data
+
+
+def compute_data():
+    data = make_raw_data()
+    data_loader.coerce_numeric_columns(data)
+    data_loader.add_metrics(data)
+    return data
+
+
+def make_product(price_amazon=100.0, price_net=40.0, fees_total=19.0):
+    data = pd.DataFrame(
+        {
+            "price_shop": [price_net],
+            "age_restriction": [0],
+            "price_amazon": [price_amazon],
+            "fees_fba_net": [3.0],
+            "fees_closing_net": [1.0],
+            "fees_total": [fees_total],
+            "amazon_updated": [pd.Timestamp("2020-01-01")],
+            "wholesale_updated": [pd.Timestamp("2020-01-01")],
+        }
+    )
+    data_loader.add_metrics(data)
+    return data
+
+
+def test_make_scenarios():
+    grid = scenarios.make_scenarios(
+        price_amazon_change=[-0.1, 0], vat_tax=[0.07, 0.19, 0.21]
+    )
+
+    assert len(grid) == 6
+    assert grid["price_shop_change"].eq(0).all()
+    with pytest.raises(ValueError):
+        scenarios.make_scenarios(price=[1])
+
+
+def test_unchanged_scenario_matches_get_data():
+    data = compute_data()
+    result = scenarios.compute_scenarios(data, scenarios.make_scenarios())
+
+    assert result.profit.shape == (1, len(data))
+    for cur_metric in ["profit", "roi", "margin"]:
+        np.testing.assert_allclose(
+            getattr(result, cur_metric)[0],
+            data[cur_metric].to_numpy(dtype="float64"),
+            rtol=1e-9,
+        )
+
+
+def test_break_even_has_no_profit():
+    data = make_product()
+    break_even = scenarios.compute_scenarios(
+        data, scenarios.make_scenarios()
+    ).break_even[0, 0]
+
+    grid = scenarios.make_scenarios(price_amazon_change=[break_even / 100 - 1])
+    result = scenarios.compute_scenarios(data, grid)
+    assert result.profit[0, 0] == pytest.approx(0, abs=1e-9)
+
+
+def test_max_buy_price_reaches_target_roi():
+    data = make_product()
+    result = scenarios.compute_scenarios(
+        data, scenarios.make_scenarios(vat_tax=[0.07, 0.19]), target_roi=0.3
+    )
+
+    for cur_index, cur_vat_tax in enumerate([0.07, 0.19]):
+        price_shop_change = result.max_buy_price[cur_index, 0] / 40 - 1
+        grid = scenarios.make_scenarios(
+            price_shop_change=[price_shop_change], vat_tax=[cur_vat_tax]
+        )
+        roi = scenarios.compute_scenarios(data, grid).roi[0, 0]
+        assert roi == pytest.approx(0.3)
+
+
+def test_get_metric_frame():
+    data = pd.concat([compute_data(), make_product()], ignore_index=True)
+    grid = scenarios.make_scenarios(price_amazon_change=np.linspace(-0.2, 0.2, 5))
+    result = scenarios.compute_scenarios(data, grid)
+
+    curves = scenarios.get_metric_frame(result, "profit", index=data.index)
+    assert curves.shape == (len(data), 5)
+    # a higher Amazon price raises the profit of the product
+    assert curves.iloc[-1].is_monotonic_increasing
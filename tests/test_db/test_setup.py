@@ -0,0 +1,31 @@
+from sqlalchemy import create_engine
+from wholesale.db import setup, Session
+from wholesale.utils import metrics
+
+
+def test_import_creates_no_engine():
+    import wholesale.db.models
+    import wholesale.db.data_loader
+
+    assert setup._engine is None
+
+
+def test_session_binds_lazily():
+    session = Session()
+
+    assert session.bind is None
+    session.close()
+
+
+def test_pool_status_without_engine():
+    assert setup.get_pool_status() == {}
+
+
+def test_timed_pool_records_checkout_wait():
+    engine = create_engine("sqlite://", poolclass=setup.TimedQueuePool)
+    before = metrics.get_timer("db.pool.checkout_wait").count
+
+    with engine.connect() as connection:
+        connection.execute("SELECT 1")
+
+    assert metrics.get_timer("db.pool.checkout_wait").count == before + 1
@@ -0,0 +1,122 @@
+import pandas as pd
+from wholesale.db.models import ProductWholesale
+from wholesale.db.snapshot_diff import (
+    diff_snapshot,
+    sync_shop_snapshot,
+    is_feed_complete,
+)
+from tests.utils import make_dummy_product_wholesale
+
+
+def test_diff_snapshot():
+    feed = pd.DataFrame({"ean": ["1", "2", "3"], "content_hash": ["a", "b", "c"]})
+    stored = pd.DataFrame(
+        {
+            "ean": ["2", "3", "4", "5", "6"],
+            "content_hash": ["b", "x", None, None, "y"],
+            "is_available": [True, True, None, False, True],
+        }
+    )
+
+    diff = diff_snapshot(feed, stored)
+
+    assert diff.added == ["1"]
+    assert diff.changed == ["3"]
+    # 5 is already unavailable
+    assert diff.removed == ["4", "6"]
+
+
+def test_diff_snapshot_empty_database():
+    feed = pd.DataFrame({"ean": ["1"], "content_hash": ["a"]})
+    stored = pd.DataFrame(columns=["ean", "content_hash", "is_available"])
+
+    diff = diff_snapshot(feed, stored)
+
+    assert diff.added == ["1"]
+    assert diff.changed == []
+    assert diff.removed == []
+
+
+def test_sync_shop_snapshot(test_session):
+    gone_product = make_dummy_product_wholesale()
+    test_session.add(gone_product)
+    test_session.commit()
+
+    feed = [
+        ProductWholesale(
+            shop_name="dummy_shop",
+            name="new",
+            ean="5678",
+            price_net=2,
+            age_restriction=0,
+        )
+    ]
+    result = sync_shop_snapshot(test_session, "dummy_shop", feed)
+    test_session.commit()
+
+    assert result.inserted == 1
+    assert result.updated == 0
+    assert result.removed == 1
+    gone_product = test_session.query(ProductWholesale).filter_by(ean="1234").one()
+    assert gone_product.is_available is False
+    new_product = test_session.query(ProductWholesale).filter_by(ean="5678").one()
+    assert new_product.is_available is True
+
+    # the product reappears
+    feed = [make_dummy_product_wholesale()]
+    feed[0].is_available = None
+    result = sync_shop_snapshot(test_session, "dummy_shop", feed)
+    test_session.commit()
+
+    assert result.updated == 1
+    assert result.removed == 1
+    test_session.expire_all()
+    gone_product = test_session.query(ProductWholesale).filter_by(ean="1234").one()
+    assert gone_product.is_available is True
+
+
+def test_is_feed_complete():
+    assert is_feed_complete(5, 10)
+    assert not is_feed_complete(4, 10)
+    assert not is_feed_complete(0, 0)
+
+
+def test_sync_shop_snapshot_keeps_products_of_partial_feed(test_session):
+    for cur_ean in ["1", "2", "3"]:
+        test_session.add(
+            ProductWholesale(
+                shop_name="dummy_shop",
+                name=cur_ean,
+                ean=cur_ean,
+                price_net=1,
+                is_available=True,
+            )
+        )
+    test_session.commit()
+
+    feed = [ProductWholesale(shop_name="dummy_shop", name="1", ean="1", price_net=1)]
+    result = sync_shop_snapshot(test_session, "dummy_shop", feed)
+    test_session.commit()
+
+    assert result.removed == 0
+    assert all(
+        cur_product.is_available for cur_product in test_session.query(ProductWholesale)
+    )
+
+
+def test_sync_shop_snapshot_keeps_stored_availability(test_session):
+    # e.g. a product that the product page check found to be unavailable
+    unavailable_product = make_dummy_product_wholesale()
+    unavailable_product.is_available = False
+    test_session.add(unavailable_product)
+    test_session.commit()
+
+    feed = [make_dummy_product_wholesale()]
+    feed[0].is_available = None
+    result = sync_shop_snapshot(test_session, "dummy_shop", feed)
+    test_session.commit()
+
+    assert result.removed == 0
+    test_session.expire_all()
+    product = test_session.query(ProductWholesale).filter_by(ean="1234").one()
+    assert product.is_available is False
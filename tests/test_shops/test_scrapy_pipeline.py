@@ -0,0 +1,166 @@
+import logging
+import pytest
+from twisted.internet import defer, task
+from wholesale.db.bulk_upsert import UpsertResult
+from wholesale.db.models import ProductWholesaleItem
+from wholesale.db.snapshot_diff import retired_content_hash
+from wholesale.shops import scrapy_pipeline
+
+
+class DummySpider:
+    logger = logging.getLogger("dummy_spider")
+
+
+class DummyPipeline(scrapy_pipeline.BufferedDatabasePipeline):
+    """Records the batches instead of writing them to the database."""
+
+    shop_name = "dummy_shop"
+
+    def __init__(self, *args, known_hashes=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.initial_hashes = known_hashes or {}
+        self.batches = []
+        self.retired_eans = []
+        self.fail_writes = False
+
+    def load_known_hashes(self):
+        return dict(self.initial_hashes)
+
+    def retire_batch(self, eans):
+        self.retired_eans.extend(eans)
+        return len(eans)
+
+    def write_batch(self, batch):
+        if self.fail_writes:
+            raise RuntimeError("database is gone")
+        self.batches.append([cur_item.ean for cur_item in batch])
+        return UpsertResult(inserted=len(batch), updated=0, unchanged=0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = task.Clock()
+
+    class ClockLoopingCall(task.LoopingCall):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.clock = clock
+
+    # the database work runs right away instead of in a thread
+    monkeypatch.setattr(
+        scrapy_pipeline.threads,
+        "deferToThread",
+        lambda function, *args: defer.maybeDeferred(function, *args),
+    )
+    monkeypatch.setattr(scrapy_pipeline.task, "LoopingCall", ClockLoopingCall)
+    return clock
+
+
+def make_item(ean, price_net=1):
+    return ProductWholesaleItem(
+        shop_name="dummy_shop",
+        name=f"product {ean}",
+        ean=ean,
+        is_available=True,
+        price_net=price_net,
+        age_restriction=0,
+    )
+
+
+def open_pipeline(flush_size=2, flush_interval=30, known_hashes=None):
+    pipeline = DummyPipeline(
+        flush_size=flush_size, flush_interval=flush_interval, known_hashes=known_hashes
+    )
+    pipeline.open_spider(DummySpider())
+    return pipeline
+
+
+def test_flush_on_size(clock):
+    pipeline = open_pipeline(flush_size=2)
+
+    pipeline.process_item(make_item("1"), DummySpider())
+    assert pipeline.batches == []
+    pipeline.process_item(make_item("2"), DummySpider())
+
+    assert pipeline.batches == [["1", "2"]]
+
+
+def test_flush_on_interval(clock):
+    pipeline = open_pipeline(flush_size=10, flush_interval=30)
+    pipeline.process_item(make_item("1"), DummySpider())
+
+    clock.advance(29)
+    assert pipeline.batches == []
+    clock.advance(1)
+
+    assert pipeline.batches == [["1"]]
+
+
+def test_close_spider_flushes(clock):
+    pipeline = open_pipeline(flush_size=10)
+    pipeline.process_item(make_item("1"), DummySpider())
+
+    pipeline.close_spider(DummySpider())
+
+    assert pipeline.batches == [["1"]]
+    assert not pipeline.flush_loop.running
+
+
+def test_unchanged_items_are_skipped(clock):
+    pipeline = open_pipeline(flush_size=1)
+    pipeline.process_item(make_item("1"), DummySpider())
+
+    pipeline.process_item(make_item("1"), DummySpider())
+    pipeline.close_spider(DummySpider())
+    assert pipeline.batches == [["1"]]
+
+    # a changed price is written again
+    pipeline.process_item(make_item("1", price_net=2), DummySpider())
+    assert pipeline.batches == [["1"], ["1"]]
+
+
+def test_failed_batch_is_not_remembered(clock):
+    pipeline = open_pipeline(flush_size=1)
+    pipeline.fail_writes = True
+    pipeline.process_item(make_item("1"), DummySpider())
+    assert pipeline.batches == []
+
+    pipeline.fail_writes = False
+    pipeline.process_item(make_item("1"), DummySpider())
+
+    assert pipeline.batches == [["1"]]
+
+
+def close_crawl(pipeline, reason="finished"):
+    pipeline.close_spider(DummySpider())
+    pipeline.spider_closed(DummySpider(), reason)
+
+
+def test_spider_closed_retires_missing_products(clock):
+    known_hashes = {"1": "a", "2": "b", "3": "c", "4": retired_content_hash}
+    pipeline = open_pipeline(known_hashes=known_hashes)
+    pipeline.process_item(make_item("1"), DummySpider())
+    pipeline.process_item(make_item("2"), DummySpider())
+
+    close_crawl(pipeline)
+
+    assert sorted(pipeline.retired_eans) == ["3", "4"]
+
+
+def test_spider_closed_keeps_products_of_partial_crawl(clock):
+    pipeline = open_pipeline(known_hashes={"1": "a", "2": "b", "3": "c"})
+    pipeline.process_item(make_item("1"), DummySpider())
+
+    close_crawl(pipeline)
+
+    assert pipeline.retired_eans == []
+
+
+def test_spider_closed_keeps_products_of_failed_crawl(clock):
+    pipeline = open_pipeline(known_hashes={"1": "a", "2": "b"})
+    pipeline.process_item(make_item("1"), DummySpider())
+    pipeline.process_item(make_item("2"), DummySpider())
+
+    close_crawl(pipeline, reason="shutdown")
+
+    assert pipeline.retired_eans == []
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from wholesale.utils import rate_limiter, retry_request
+from wholesale.utils.rate_limiter import TokenBucket
+
+
+@pytest.fixture(autouse=True)
+def reset_buckets():
+    rate_limiter.reset()
+    yield
+    rate_limiter.reset()
+
+
+def test_burst_is_free():
+    bucket = TokenBucket(3, 1)
+
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == pytest.approx(1, abs=0.01)
+    # the callers are served in order
+    assert bucket.reserve() == pytest.approx(2, abs=0.01)
+
+
+def test_partial_tokens():
+    bucket = TokenBucket(1, 2)
+    bucket.reserve()
+
+    assert bucket.reserve(0.5) == pytest.approx(0.25, abs=0.01)
+
+
+def test_update_only_lower():
+    bucket = TokenBucket(20, 1)
+
+    bucket.update(tokens=100, only_lower=True)
+    assert bucket.tokens == 20
+    bucket.update(tokens=5, only_lower=True)
+    assert bucket.tokens == 5
+
+
+def test_update_from_keepa_response():
+    rate_limiter.update_from_keepa_response(
+        "keepa", {"tokensLeft": 0, "refillIn": 5000, "refillRate": 20}
+    )
+
+    bucket = rate_limiter.get_bucket("keepa")
+    assert bucket.capacity == 1200
+    assert bucket.restore_rate == pytest.approx(20 / 60)
+    # the first token arrives with the refill
+    assert bucket.reserve() == pytest.approx(5, abs=0.01)
+
+
+def test_update_from_mws_headers():
+    name = "mws.GetMyFeesEstimate"
+    rate_limiter.update_from_mws_headers(name, {"x-mws-quota-remaining": "100"})
+    assert rate_limiter.get_bucket(name).reserve() == 0
+
+    resets_on = datetime.now(timezone.utc) + timedelta(seconds=60)
+    headers = {
+        "x-mws-quota-remaining": "0",
+        "x-mws-quota-resetsOn": resets_on.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+    }
+    rate_limiter.update_from_mws_headers(name, headers)
+    assert rate_limiter.get_bucket(name).reserve() > 55
+
+
+def test_acquire_async(monkeypatch):
+    monkeypatch.setitem(rate_limiter.bucket_configs, "test", (1, 20))
+
+    async def acquire_three():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.gather(*[rate_limiter.acquire_async("test") for _ in range(3)])
+        return loop.time() - start
+
+    assert asyncio.run(acquire_three()) >= 0.09
+
+
+def test_retry_request_acquires_again(monkeypatch):
+    acquired = []
+    monkeypatch.setattr(
+        rate_limiter, "acquire", lambda name, tokens=1: acquired.append((name, tokens))
+    )
+    attempts = []
+
+    def request():
+        attempts.append(len(attempts))
+        if len(attempts) < 3:
+            raise ValueError("failed")
+        return "ok"
+
+    assert retry_request(request, sleep_time=0, bucket="keepa", tokens=2) == "ok"
+    # the caller takes the tokens of the first attempt
+    assert acquired == [("keepa", 2), ("keepa", 2)]
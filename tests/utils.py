@@ -1,3 +1,7 @@
+from datetime import datetime
+from decimal import Decimal
+import numpy as np
+import pandas as pd
 from wholesale.db.models import ProductWholesale, ProductAmazon
 
 
@@ -34,3 +38,34 @@ def make_dummy_product_amazon():
         sales_rank=1000,
     )
     return dummy
+
+
+def make_raw_data(row_count=500, seed=0):
+    random = np.random.default_rng(seed)
+
+    def make_prices(scale, none_share=0.1):
+        return [
+            None if cur_none else Decimal(str(round(cur_value, 2)))
+            for cur_value, cur_none in zip(
+                random.uniform(0, scale, row_count),
+                random.random(row_count) < none_share,
+            )
+        ]
+
+    df = pd.DataFrame(
+        {
+            "price_shop": make_prices(100, none_share=0),
+            "age_restriction": random.choice([0, 16, 18], row_count),
+            "price_amazon": make_prices(200),
+            "fees_fba_net": make_prices(5),
+            "fees_closing_net": make_prices(2),
+            "fees_total": make_prices(40, none_share=0.3),
+            "amazon_updated": datetime(2020, 1, 1),
+            "wholesale_updated": datetime(2020, 1, 2),
+        }
+    )
+    # edge cases: free products, zero prices and missing fees
+    df.loc[0, "price_shop"] = Decimal("0.00")
+    df.loc[1, "price_amazon"] = Decimal("0.00")
+    df.loc[2, ["fees_total", "fees_fba_net", "fees_closing_net"]] = None
+    return df
@@ -1,55 +1,78 @@
 import mws
 import logging
-import time
 from wholesale import settings
+from wholesale.utils import rate_limiter, retry_request
 from wholesale.db.models import ProductAmazon
 from wholesale.amazon.fees_api import FeesAPI
+from wholesale.amazon import fee_cache
 from decimal import Decimal
 
-products_api = mws.Products(
-    settings.AMAZON_MWS["AWS_ACCESS_KEY_ID"],
-    settings.AMAZON_MWS["SECRET_KEY"],
-    settings.AMAZON_MWS["SELLER_ID"],
-    region="DE",
-    auth_token=settings.AMAZON_MWS["MWS_AUTH_TOKEN"],
-)
-
-fees_api = FeesAPI(
-    settings.AMAZON_MWS["AWS_ACCESS_KEY_ID"],
-    settings.AMAZON_MWS["SECRET_KEY"],
-    settings.AMAZON_MWS["SELLER_ID"],
-    settings.AMAZON_MWS["MWS_AUTH_TOKEN"],
-)
+_products_api = None
+_fees_api = None
+
+
+def get_products_api():
+    global _products_api
+    if _products_api is None:
+        _products_api = mws.Products(
+            settings.AMAZON_MWS["AWS_ACCESS_KEY_ID"],
+            settings.AMAZON_MWS["SECRET_KEY"],
+            settings.AMAZON_MWS["SELLER_ID"],
+            region="DE",
+            auth_token=settings.AMAZON_MWS["MWS_AUTH_TOKEN"],
+        )
+    return _products_api
+
+
+def get_fees_api():
+    global _fees_api
+    if _fees_api is None:
+        _fees_api = FeesAPI(
+            settings.AMAZON_MWS["AWS_ACCESS_KEY_ID"],
+            settings.AMAZON_MWS["SECRET_KEY"],
+            settings.AMAZON_MWS["SELLER_ID"],
+            settings.AMAZON_MWS["MWS_AUTH_TOKEN"],
+        )
+    return _fees_api
+
 
 marketplace_id_germany = "A1PA6795UKMFR9"
 
-last_matching_product_request_time = 0
-last_competitive_pricing_request_time = 0
-last_lowest_offer_listings_request_time = 0
-last_fees_estimate_request_time = 0
+# the maximum number of products per request
+matching_product_batch_size = 5
+asin_batch_size = 20
 
 
-def make_api_request(request, retry_count=5, sleep_time=2):
-    success = False
-    last_request_time = 0
-    while not success:
-        try:
-            elapsed = time.time() - last_request_time
-            if elapsed < sleep_time:
-                time.sleep(sleep_time - elapsed)
-            response = request()
-            last_request_time = time.time()
-            success = True
-        except Exception as e:
-            if retry_count > 1:
-                logging.error("An exception ocured. Trying again.")
-                logging.error(e)
-                retry_count = retry_count - 1
-                time.sleep(sleep_time)
-            else:
-                logging.critical("Maximum number of retries reached.")
-                raise e
-    return response
+def get_bucket_name(operation):
+    return f"mws.{operation}"
+
+
+def get_request_tokens(batch, batch_size):
+    """The restore rates are the ones of full batches, smaller ones cost less."""
+
+    return len(batch) / batch_size
+
+
+def wait_for_quota(operation, batch, batch_size):
+    rate_limiter.acquire(
+        get_bucket_name(operation), get_request_tokens(batch, batch_size)
+    )
+
+
+def retry_api_request(api_request, operation, batch, batch_size):
+    """Retries the request, every retry waits for the quota of the operation."""
+
+    return retry_request(
+        api_request,
+        bucket=get_bucket_name(operation),
+        tokens=get_request_tokens(batch, batch_size),
+    )
+
+
+def update_quota(operation, response):
+    rate_limiter.update_from_mws_headers(
+        get_bucket_name(operation), response.response.headers
+    )
 
 
 def check_status(parsed_response):
@@ -60,6 +83,10 @@ def check_status(parsed_response):
     return False
 
 
+# the error codes of GetMatchingProductForId for EANs without a product
+no_match_error_codes = {"InvalidParameterValue"}
+
+
 def parse_ean(parsed_response):
     # make sure it's an EAN before parsing it
     id_type = parsed_response["IdType"]["value"]
@@ -110,15 +137,34 @@ def get_response_products_list(parsed_response):
     return result
 
 
-def parse_base_data(parsed_response):
+def parse_matches(parsed_response):
+    """
+    Returns the EAN of one result together with its match status, which is
+    "match", "bundle_only" or "no_match", and the ProductAmazon objects. The EAN
+    is None if the request failed for another reason than a missing match, so
+    that it is asked again.
+    """
+
     if not check_status(parsed_response):
-        return []
+        try:
+            error_code = parsed_response["Error"]["Code"]["value"]
+        except KeyError:
+            error_code = None
+        if error_code not in no_match_error_codes:
+            # e.g. a server error or throttling
+            return None, None, []
+        try:
+            return parsed_response["Id"]["value"], "no_match", []
+        except KeyError:
+            return None, "no_match", []
 
     ean = parse_ean(parsed_response)
 
     result = []
+    has_bundles = False
     for cur_response_product in get_response_products_list(parsed_response):
         if is_bundle(cur_response_product):
+            has_bundles = True
             continue
 
         cur_product = ProductAmazon()
@@ -128,34 +174,18 @@ def parse_base_data(parsed_response):
         cur_product.sales_rank = parse_sales_rank(cur_response_product)
         result.append(cur_product)
 
-    return result
-
-
-def get_base_data(batch, marketplace_id=marketplace_id_germany):
-    """
-    Takes a batch of ProductWholesale objects as a list and returns the
-    corresponding ProductAmazon objects by making a request to the mws api.
-    The result will only contain the base data and no information about the price
-    and the fees.
-    """
-    global last_matching_product_request_time
+    if len(result) > 0:
+        return ean, "match", result
+    if has_bundles:
+        return ean, "bundle_only", result
+    return ean, "no_match", result
 
-    assert len(batch) > 0
-    assert len(batch) <= 5  # maximum of 5 products allowed per batch
 
-    ean_codes = [cur_product.ean for cur_product in batch]
-
-    def api_request():
-        return products_api.get_matching_product_for_id(
-            marketplace_id, type_="EAN", ids=ean_codes
-        )
+def parse_base_data(parsed_response):
+    return parse_matches(parsed_response)[2]
 
-    elapsed = time.time() - last_matching_product_request_time
-    if elapsed < 1:  # wait at least 1 seconds between requests
-        time.sleep(1 - elapsed)
 
-    response = make_api_request(api_request)
-    last_matching_product_request_time = time.time()
+def get_response_list(response):
     if not response.response.ok:
         raise Exception(
             f"Could not make request to MWS API. "
@@ -168,15 +198,59 @@ def get_base_data(batch, marketplace_id=marketplace_id_germany):
         response_list.extend(response.parsed)
     else:
         response_list.append(response.parsed)
+    return response_list
 
-    result_list = []
-    for cur_response in response_list:
-        cur_result = parse_base_data(cur_response)
-        result_list.extend(cur_result)
 
+def request_matches(batch, marketplace_id=marketplace_id_germany):
+    """
+    Returns {ean: (status, amazon_products)} for the batch without waiting between
+    requests, see parse_matches().
+    """
+
+    assert len(batch) > 0
+    # maximum of 5 products allowed per batch
+    assert len(batch) <= matching_product_batch_size
+
+    ean_codes = [cur_product.ean for cur_product in batch]
+
+    def api_request():
+        return get_products_api().get_matching_product_for_id(
+            marketplace_id, type_="EAN", ids=ean_codes
+        )
+
+    response = retry_api_request(
+        api_request, "GetMatchingProductForId", batch, matching_product_batch_size
+    )
+    update_quota("GetMatchingProductForId", response)
+
+    result = {}
+    for cur_response in get_response_list(response):
+        ean, status, amazon_products = parse_matches(cur_response)
+        if ean is not None:
+            result[ean] = (status, amazon_products)
+    return result
+
+
+def request_base_data(batch, marketplace_id=marketplace_id_germany):
+    """Like get_base_data(), but without waiting between requests."""
+
+    result_list = []
+    for _, cur_products in request_matches(batch, marketplace_id).values():
+        result_list.extend(cur_products)
     return result_list
 
 
+def get_base_data(batch, marketplace_id=marketplace_id_germany):
+    """
+    Takes a batch of ProductWholesale objects as a list and returns the
+    corresponding ProductAmazon objects by making a request to the mws api.
+    The result will only contain the base data and no information about the price
+    and the fees.
+    """
+    wait_for_quota("GetMatchingProductForId", batch, matching_product_batch_size)
+    return request_base_data(batch, marketplace_id)
+
+
 def get_price(parsed_response):
     """Returns a dict with a single entry {ASIN: price}"""
     try:
@@ -223,6 +297,18 @@ def get_offers(parsed_response):
     return {asin: offer_count}
 
 
+def get_sales_rank(parsed_response):
+    """Returns a dict with a single entry {ASIN: sales_rank}"""
+    try:
+        asin = parsed_response["ASIN"]["value"]
+        sales_rank = parse_sales_rank(parsed_response["Product"])
+    except KeyError:
+        return None
+    if sales_rank is None:
+        return None
+    return {asin: sales_rank}
+
+
 def get_lowest_price(parsed_response):
     """
     Returns a dict with a single entry {ASIN: price}. This is not necessarily the
@@ -272,40 +358,27 @@ def get_fba_offers(parsed_response):
     return {asin: fba_count}
 
 
-def add_competition_details(batch, marketplace_id=marketplace_id_germany):
-    global last_lowest_offer_listings_request_time
+def request_competition_details(batch, marketplace_id=marketplace_id_germany):
+    """Like add_competition_details(), but without waiting between requests."""
 
     assert len(batch) > 0
-    assert len(batch) <= 20  # Maximum of 20 products is allowed per batch
+    assert len(batch) <= asin_batch_size  # Maximum of 20 products per batch
 
     asins = [cur_product.asin for cur_product in batch]
 
     def api_request():
-        return products_api.get_lowest_offer_listings_for_asin(
+        return get_products_api().get_lowest_offer_listings_for_asin(
             marketplace_id, asins=asins, condition="New"
         )
 
-    elapsed = time.time() - last_lowest_offer_listings_request_time
-    if elapsed < 1:
-        time.sleep(1 - elapsed)
-    response = make_api_request(api_request)
-    last_lowest_offer_listings_request_time = time.time()
-    if not response.response.ok:
-        raise Exception(
-            f"Could not make request to MWS API. "
-            f"Status code: {response.response.status_code}, "
-            f"Reason: {response.response.reason}."
-        )
-
-    response_list = []
-    if isinstance(response.parsed, list):
-        response_list.extend(response.parsed)
-    else:
-        response_list.append(response.parsed)
+    response = retry_api_request(
+        api_request, "GetLowestOfferListingsForASIN", batch, asin_batch_size
+    )
+    update_quota("GetLowestOfferListingsForASIN", response)
 
     low_price_data = {}
     fba_offer_data = {}
-    for cur_response in response_list:
+    for cur_response in get_response_list(response):
         lowest_price = get_lowest_price(cur_response)
         if lowest_price is not None:
             low_price_data = {**low_price_data, **lowest_price}
@@ -319,40 +392,42 @@ def add_competition_details(batch, marketplace_id=marketplace_id_germany):
         cur_product.fba_offers = fba_offer_data.get(cur_product.asin, 0)
 
 
-def add_competition_data(batch, marketplace_id=marketplace_id_germany):
-    global last_competitive_pricing_request_time
+def add_competition_details(batch, marketplace_id=marketplace_id_germany):
+    wait_for_quota("GetLowestOfferListingsForASIN", batch, asin_batch_size)
+    request_competition_details(batch, marketplace_id)
+
+
+def request_competitive_pricing(batch, marketplace_id=marketplace_id_germany):
+    """
+    Adds the buy box price, the offer count and the sales rank to the products of
+    the batch, without waiting between requests. The sales rank of the matching
+    is cached with the ASIN, so this keeps it fresh.
+    """
 
     assert len(batch) > 0
-    assert len(batch) <= 20  # Maximum of 20 products is allowed per batch
+    assert len(batch) <= asin_batch_size  # Maximum of 20 products per batch
 
     asins = [cur_product.asin for cur_product in batch]
 
     def api_request():
-        return products_api.get_competitive_pricing_for_asin(marketplace_id, asins)
-
-    elapsed = time.time() - last_competitive_pricing_request_time
-    if elapsed < 1:
-        time.sleep(1 - elapsed)
-    response = make_api_request(api_request)
-    last_competitive_pricing_request_time = time.time()
-    if not response.response.ok:
-        raise Exception(
-            f"Could not make request to MWS API. "
-            f"Status code: {response.response.status_code}, "
-            f"Reason: {response.response.reason}."
+        return get_products_api().get_competitive_pricing_for_asin(
+            marketplace_id, asins
         )
 
-    response_list = []
-    if isinstance(response.parsed, list):
-        response_list.extend(response.parsed)
-    else:
-        response_list.append(response.parsed)
+    response = retry_api_request(
+        api_request, "GetCompetitivePricingForASIN", batch, asin_batch_size
+    )
+    update_quota("GetCompetitivePricingForASIN", response)
 
     price_data = {}
     offers_data = {}
-    for cur_response in response_list:
+    sales_rank_data = {}
+    for cur_response in get_response_list(response):
         if not check_status(cur_response):
             continue
+        cur_sales_rank_data = get_sales_rank(cur_response)
+        if cur_sales_rank_data is not None:
+            sales_rank_data = {**sales_rank_data, **cur_sales_rank_data}
         cur_price_data = get_price(cur_response)
         if cur_price_data is not None:
             price_data = {**price_data, **cur_price_data}
@@ -367,24 +442,30 @@ def add_competition_data(batch, marketplace_id=marketplace_id_germany):
         else:
             cur_product.has_buy_box = True
         cur_product.offers = offers_data.get(cur_product.asin, 0)
+        cur_product.sales_rank = sales_rank_data.get(
+            cur_product.asin, cur_product.sales_rank
+        )
+
+
+def add_competition_data(batch, marketplace_id=marketplace_id_germany):
+    wait_for_quota("GetCompetitivePricingForASIN", batch, asin_batch_size)
+    request_competitive_pricing(batch, marketplace_id)
 
     add_competition_details(batch, marketplace_id)
 
 
-def add_fees(batch, marketplace_id=marketplace_id_germany):
-    global last_fees_estimate_request_time
+def request_fees(batch, marketplace_id=marketplace_id_germany):
+    """Like add_fees(), but without waiting between requests."""
 
     assert len(batch) > 0
-    assert len(batch) <= 20  # Maximum of 20 products is allowed per batch
+    assert len(batch) <= asin_batch_size  # Maximum of 20 products per batch
 
     def api_request():
-        return fees_api.get_my_fees_estimate(marketplace_id, batch)
+        return get_fees_api().get_my_fees_estimate(marketplace_id, batch)
 
-    elapsed = time.time() - last_fees_estimate_request_time
-    if elapsed < 1:
-        time.sleep(1 - elapsed)
-    response = make_api_request(api_request)
-    last_fees_estimate_request_time = time.time()
+    response = retry_api_request(
+        api_request, "GetMyFeesEstimate", batch, asin_batch_size
+    )
 
     for cur_product in batch:
         cur_fee_response = response.get(cur_product.asin)
@@ -392,3 +473,14 @@ def add_fees(batch, marketplace_id=marketplace_id_germany):
             cur_product.fees_fba = cur_fee_response.get("fba")
             cur_product.fees_closing = cur_fee_response.get("closing")
             cur_product.fees_total = cur_fee_response.get("total")
+
+
+def add_fees(batch, marketplace_id=marketplace_id_germany):
+    """Only the products that are not in the fee cache are requested."""
+
+    requested_products = fee_cache.apply_cached_fees(batch, marketplace_id)
+    if len(requested_products) == 0:
+        return
+    wait_for_quota("GetMyFeesEstimate", requested_products, asin_batch_size)
+    request_fees(requested_products, marketplace_id)
+    fee_cache.add_requested_fees(batch, requested_products, marketplace_id)
@@ -1,57 +1,155 @@
-from wholesale.db import Session
-from wholesale.db.models import ProductWholesale, ProductAmazon
+from wholesale.db import session_scope
+from wholesale.db.models import (
+    ProductWholesale,
+    ProductAmazon,
+    amazon_update_fields,
+    compute_content_hash,
+)
+from wholesale.db.price_history import get_amazon_history_rows, write_history_rows
 from wholesale.shops import gross_electronic, saraswati, berk
-from wholesale.amazon import amazon_api
+from wholesale.amazon import amazon_api, async_client, asin_cache, fee_cache
+from sqlalchemy import tuple_
 from tqdm import tqdm
 import logging
 
 
-def update_products(batch, session):
-    amazon_products = amazon_api.get_base_data(batch)
-
-    batch_size = 20
-    cur_batch = []
-    for cur_product in amazon_products:
-        if len(cur_batch) < batch_size:
-            cur_batch.append(cur_product)
-        else:
-            amazon_api.add_competition_data(cur_batch)
-            amazon_api.add_fees(cur_batch)
-            cur_batch = [cur_product]
-    if len(cur_batch) > 0:
-        amazon_api.add_competition_data(cur_batch)
-        amazon_api.add_fees(cur_batch)
-
-    for cur_product in amazon_products:
-        old_product = (
-            session.query(ProductAmazon)
-            .filter_by(ean=cur_product.ean, asin=cur_product.asin)
-            .first()
+def get_existing_products(session, keys):
+    """Returns a dict {(ean, asin): row} of the stored products with these keys."""
+
+    query = session.query(
+        ProductAmazon.id,
+        ProductAmazon.ean,
+        ProductAmazon.asin,
+        ProductAmazon.content_hash,
+        *[getattr(ProductAmazon, cur_field) for cur_field in amazon_update_fields],
+    ).filter(tuple_(ProductAmazon.ean, ProductAmazon.asin).in_(keys))
+    return {(cur_row.ean, cur_row.asin): cur_row for cur_row in query}
+
+
+def write_products(session, amazon_products):
+    """
+    Writes the ProductAmazon objects with one query to load the stored rows, one
+    bulk insert for the new and one bulk update for the changed products. Just
+    like ProductAmazon.update(), None keeps the stored value. The changes of the
+    tracked fields are appended to the price history in one more insert.
+    """
+
+    products_by_key = {
+        (cur_product.ean, cur_product.asin): cur_product
+        for cur_product in amazon_products
+    }
+    if len(products_by_key) == 0:
+        return
+
+    table = ProductAmazon.__table__
+    existing_products = get_existing_products(session, list(products_by_key.keys()))
+    new_rows = []
+    changed_rows = []
+    history_rows = []
+    for cur_key, cur_product in products_by_key.items():
+        cur_row = {
+            cur_field: getattr(cur_product, cur_field)
+            for cur_field in amazon_update_fields
+        }
+        old_row = existing_products.get(cur_key)
+        if old_row is None:
+            cur_row["ean"], cur_row["asin"] = cur_key
+            cur_row["content_hash"] = compute_content_hash(
+                table, amazon_update_fields, cur_row
+            )
+            new_rows.append(cur_row)
+            history_rows.extend(get_amazon_history_rows(*cur_key, None, cur_row))
+            continue
+
+        for cur_field in amazon_update_fields:
+            if cur_row[cur_field] is None:
+                cur_row[cur_field] = getattr(old_row, cur_field)
+        cur_row["content_hash"] = compute_content_hash(
+            table, amazon_update_fields, cur_row
         )
-        if old_product is None:
-            session.add(cur_product)
-        elif old_product != cur_product:
-            old_product.update(cur_product)
-
-    session.commit()
-
-
-def update_database(shop_name):
-    session = Session()
-
-    batch_size = 5
-    cur_batch = []
-    query = session.query(ProductWholesale).filter_by(shop_name=shop_name)
-    for cur_product in tqdm(query, total=query.count()):
-        if len(cur_batch) < batch_size:
-            cur_batch.append(cur_product)
-        else:
-            update_products(cur_batch, session)
-            cur_batch = [cur_product]
-    if len(cur_batch) > 0:
-        update_products(cur_batch, session)
-
-    session.close()
+        if cur_row["content_hash"] != old_row.content_hash:
+            cur_row["id"] = old_row.id
+            changed_rows.append(cur_row)
+            history_rows.extend(
+                get_amazon_history_rows(*cur_key, old_row._asdict(), cur_row)
+            )
+
+    session.bulk_insert_mappings(ProductAmazon, new_rows)
+    session.bulk_update_mappings(ProductAmazon, changed_rows)
+    write_history_rows(session, history_rows)
+
+
+def update_database(shop_name, commit_every=1):
+    """
+    Refreshes the Amazon data of all available products of the shop. The products
+    are fetched by the pipeline of the async client and their writes are committed
+    every commit_every batches of up to 20 products. Only the EANs without a
+    fresh entry in the ASIN mapping cache are matched again, and only the fees
+    that are not in the fee cache are requested.
+    """
+
+    with session_scope() as session:
+        batch_size = 5
+        # products that are gone from the shop are not refreshed anymore. Only the
+        # EANs are loaded, as the requests run in other threads than the session.
+        eans = (
+            session.query(ProductWholesale.ean)
+            .filter_by(shop_name=shop_name)
+            .filter(ProductWholesale.is_available.isnot(False))
+            .all()
+        )
+        cached_matches = asin_cache.get_cached_matches(
+            session, [cur_row.ean for cur_row in eans]
+        )
+        unmatched_eans = [
+            cur_row for cur_row in eans if cur_row.ean not in cached_matches
+        ]
+        batches = [
+            unmatched_eans[start : start + batch_size]
+            for start in range(0, len(unmatched_eans), batch_size)
+        ]
+        matched_products = [
+            cur_product
+            for _, cur_products in cached_matches.values()
+            for cur_product in cur_products
+        ]
+        # the stored fees of the ASINs that the shop's EANs matched before
+        asins = (
+            session.query(ProductAmazon.asin)
+            .join(ProductWholesale, ProductWholesale.ean == ProductAmazon.ean)
+            .filter(ProductWholesale.shop_name == shop_name)
+            .distinct()
+        )
+        fee_cache.load_fees(
+            session,
+            [cur_row.asin for cur_row in asins],
+            amazon_api.marketplace_id_germany,
+        )
+        progress = tqdm(total=len(eans))
+        progress.update(len(eans) - len(unmatched_eans))
+        batch_count = 0
+
+        def on_products(amazon_products):
+            nonlocal batch_count
+            write_products(session, amazon_products)
+            fee_cache.write_new_fees(session)
+            batch_count = batch_count + 1
+            if batch_count % commit_every == 0:
+                session.commit()
+
+        def on_matched(batch, matches):
+            asin_cache.write_matches(session, matches)
+            progress.update(len(batch))
+
+        try:
+            async_client.update_products(
+                batches,
+                on_products,
+                on_matched=on_matched,
+                matched_products=matched_products,
+            )
+        finally:
+            progress.close()
 
 
 if __name__ == "__main__":
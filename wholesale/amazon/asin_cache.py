@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+from wholesale import settings
+from wholesale.db.models import AsinMapping, ProductAmazon
+
+# A persistent cache of the EAN to ASIN mappings of GetMatchingProductForId, as
+# they hardly ever change. EANs without a match or with bundles only are cached
+# as well, but for a shorter time, see settings.ASIN_MAPPING_TTL_DAYS. Failed
+# requests are not cached. The sales rank is not cached either, it is refreshed by
+# the competitive pricing of every run.
+
+
+def is_fresh(status, timestamp_checked, now):
+    ttl = timedelta(days=settings.ASIN_MAPPING_TTL_DAYS[status])
+    return timestamp_checked + ttl > now
+
+
+def get_cached_matches(session, eans, now=None, chunk_size=1000):
+    """
+    Returns {ean: (status, amazon_products)} for all EANs with a fresh mapping,
+    in the format of amazon_api.request_matches().
+    """
+
+    if now is None:
+        now = datetime.now()
+    eans = list(eans)
+    rows_by_ean = {}
+    for start in range(0, len(eans), chunk_size):
+        query = session.query(AsinMapping).filter(
+            AsinMapping.ean.in_(eans[start : start + chunk_size])
+        )
+        for cur_row in query:
+            rows_by_ean.setdefault(cur_row.ean, []).append(cur_row)
+
+    result = {}
+    for cur_ean, cur_rows in rows_by_ean.items():
+        status = cur_rows[0].status
+        if not is_fresh(status, cur_rows[0].timestamp_checked, now):
+            continue
+        amazon_products = [
+            ProductAmazon(
+                ean=cur_ean, asin=cur_row.asin, category_id=cur_row.category_id
+            )
+            for cur_row in cur_rows
+            if cur_row.asin is not None
+        ]
+        result[cur_ean] = (status, amazon_products)
+    return result
+
+
+def write_matches(session, matches, now=None):
+    """Replaces the cached mappings of the EANs with the results of the API."""
+
+    if len(matches) == 0:
+        return
+    if now is None:
+        now = datetime.now()
+    table = AsinMapping.__table__
+    session.execute(table.delete().where(table.c.ean.in_(list(matches))))
+
+    rows = []
+    for cur_ean, (cur_status, cur_products) in matches.items():
+        if len(cur_products) == 0:
+            cur_products = [ProductAmazon(ean=cur_ean)]
+        for cur_product in cur_products:
+            rows.append(
+                {
+                    "ean": cur_ean,
+                    "asin": cur_product.asin,
+                    "category_id": cur_product.category_id,
+                    "status": cur_status,
+                    "timestamp_checked": now,
+                }
+            )
+    session.execute(table.insert(), rows)
@@ -0,0 +1,204 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+from wholesale.amazon import amazon_api, fee_cache
+from wholesale.utils import rate_limiter
+
+# Fetches the Amazon data of many products as a pipeline of stages that are
+# connected by queues:
+#
+#   EAN batches -> GetMatchingProductForId -> rebatch -> GetCompetitivePricing
+#   -> GetLowestOfferListings -> GetMyFeesEstimate -> on_products
+#
+# Products whose ASIN is already known skip the first stage.
+#
+# A batch of 5 EANs only matches a few ASINs, so the matched products of many
+# batches are collected into batches of 20 for the ASIN based operations. A
+# batch that is not full is sent anyway after flush_timeout seconds. Every MWS
+# operation waits for its own rate_limiter bucket, so the stages run at the same
+# time. The blocking requests of amazon_api run in a thread pool, everything
+# else runs in the event loop thread.
+
+# the maximum number of products per request of the operations
+batch_sizes = {
+    "GetMatchingProductForId": amazon_api.matching_product_batch_size,
+    "GetCompetitivePricingForASIN": amazon_api.asin_batch_size,
+    "GetLowestOfferListingsForASIN": amazon_api.asin_batch_size,
+    "GetMyFeesEstimate": amazon_api.asin_batch_size,
+}
+
+# the queues end with this
+end_of_stream = None
+
+
+async def rebatch(input_queue, output_queue, batch_size, flush_timeout):
+    """
+    Collects the single items of input_queue into lists of batch_size. A list is
+    passed on earlier if its first item waited flush_timeout seconds.
+    """
+
+    loop = asyncio.get_running_loop()
+    batch = []
+    deadline = None
+    get_task = None
+    while True:
+        if get_task is None:
+            get_task = asyncio.ensure_future(input_queue.get())
+        timeout = None if len(batch) == 0 else max(0.0, deadline - loop.time())
+        # the pending get is kept on a timeout, so that no item gets lost
+        done, _ = await asyncio.wait({get_task}, timeout=timeout)
+        if not done:
+            await output_queue.put(batch)
+            batch = []
+            continue
+
+        item = get_task.result()
+        get_task = None
+        if item is end_of_stream:
+            if len(batch) > 0:
+                await output_queue.put(batch)
+            await output_queue.put(end_of_stream)
+            return
+        if len(batch) == 0:
+            deadline = loop.time() + flush_timeout
+        batch.append(item)
+        if len(batch) == batch_size:
+            await output_queue.put(batch)
+            batch = []
+
+
+async def run_stage(input_queue, handle, worker_count):
+    """Runs handle(batch) for every batch of the queue in worker_count workers."""
+
+    async def work():
+        while True:
+            batch = await input_queue.get()
+            if batch is end_of_stream:
+                # the other workers stop as well
+                await input_queue.put(end_of_stream)
+                return
+            await handle(batch)
+
+    await asyncio.gather(*[work() for _ in range(worker_count)])
+
+
+async def update_products_async(
+    batches,
+    on_products,
+    on_matched=None,
+    matched_products=(),
+    workers_per_stage=2,
+    flush_timeout=5,
+    marketplace_id=amazon_api.marketplace_id_germany,
+):
+    """
+    Fetches the Amazon products of all batches of up to 5 objects with an ean and
+    completes the ProductAmazon objects of matched_products, which already have
+    their ASIN. on_products(amazon_products) is called with every batch of
+    complete products and on_matched(batch, matches) with the result of
+    amazon_api.request_matches() for every EAN batch. Both are called in the
+    event loop thread, so they may use a session of that thread. The first error
+    stops the update.
+    """
+
+    loop = asyncio.get_running_loop()
+    queue_size = 2 * workers_per_stage
+    ean_queue = asyncio.Queue(queue_size)
+    product_queue = asyncio.Queue(queue_size * amazon_api.asin_batch_size)
+    pricing_queue = asyncio.Queue(queue_size)
+    details_queue = asyncio.Queue(queue_size)
+    fees_queue = asyncio.Queue(queue_size)
+
+    with ThreadPoolExecutor(max_workers=4 * workers_per_stage) as executor:
+
+        async def call(operation, function, batch):
+            await rate_limiter.acquire_async(
+                amazon_api.get_bucket_name(operation),
+                amazon_api.get_request_tokens(batch, batch_sizes[operation]),
+            )
+            return await loop.run_in_executor(executor, function, batch, marketplace_id)
+
+        async def produce():
+            for cur_batch in batches:
+                await ean_queue.put(cur_batch)
+            await ean_queue.put(end_of_stream)
+
+        async def match(batch):
+            matches = await call(
+                "GetMatchingProductForId", amazon_api.request_matches, batch
+            )
+            for _, cur_products in matches.values():
+                for cur_product in cur_products:
+                    await product_queue.put(cur_product)
+            if on_matched is not None:
+                on_matched(batch, matches)
+
+        async def match_all():
+            async def put_matched_products():
+                for cur_product in matched_products:
+                    await product_queue.put(cur_product)
+
+            await asyncio.gather(
+                run_stage(ean_queue, match, workers_per_stage), put_matched_products()
+            )
+            await product_queue.put(end_of_stream)
+
+        async def add_pricing(batch):
+            await call(
+                "GetCompetitivePricingForASIN",
+                amazon_api.request_competitive_pricing,
+                batch,
+            )
+            await details_queue.put(batch)
+
+        async def add_details(batch):
+            # the lowest offer is the price of the products without a buy box
+            await call(
+                "GetLowestOfferListingsForASIN",
+                amazon_api.request_competition_details,
+                batch,
+            )
+            await fees_queue.put(batch)
+
+        async def add_fees(batch):
+            # the fees depend on the price, only the ones that are not cached are
+            # requested
+            requested_products = fee_cache.apply_cached_fees(batch, marketplace_id)
+            if len(requested_products) > 0:
+                await call(
+                    "GetMyFeesEstimate", amazon_api.request_fees, requested_products
+                )
+                fee_cache.add_requested_fees(batch, requested_products, marketplace_id)
+            on_products(batch)
+
+        async def run_stage_then_end(input_queue, handle, output_queue):
+            await run_stage(input_queue, handle, workers_per_stage)
+            if output_queue is not None:
+                await output_queue.put(end_of_stream)
+
+        tasks = [
+            asyncio.ensure_future(cur_coroutine)
+            for cur_coroutine in [
+                produce(),
+                match_all(),
+                rebatch(
+                    product_queue,
+                    pricing_queue,
+                    amazon_api.asin_batch_size,
+                    flush_timeout,
+                ),
+                run_stage_then_end(pricing_queue, add_pricing, details_queue),
+                run_stage_then_end(details_queue, add_details, fees_queue),
+                run_stage_then_end(fees_queue, add_fees, None),
+            ]
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for cur_task in tasks:
+                cur_task.cancel()
+
+
+def update_products(batches, on_products, **kwargs):
+    """Runs update_products_async() in a new event loop."""
+
+    return asyncio.run(update_products_async(batches, on_products, **kwargs))
@@ -0,0 +1,209 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal
+import threading
+from sqlalchemy import tuple_
+from wholesale import settings
+from wholesale.db.models import FeeEstimate
+from wholesale.utils import metrics
+
+# A cache of the GetMyFeesEstimate results. The fees only depend on the ASIN, the
+# marketplace and the price, so they are cached by the ASIN, the marketplace and
+# the price band, see settings.FEE_CACHE. Products of the same key in a batch,
+# like an ASIN that several EANs match, are requested only once.
+#
+# The lookups only use the in-memory LRU cache, so they are cheap enough for the
+# event loop and safe in any thread. The fee_estimates table backs it: load_fees()
+# fills the memory before an update and write_new_fees() stores the fees that
+# were requested since, both with a session of the caller.
+
+fee_fields = ["fees_total", "fees_fba", "fees_closing"]
+
+
+class FeeCache:
+    """An LRU cache {key: (fees, timestamp_checked)} that remembers new entries."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        # the requested entries that are not in the table yet
+        self.new_entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if not is_fresh(entry[1], now):
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, fees, timestamp_checked, is_new=False):
+        with self.lock:
+            self.entries[key] = (fees, timestamp_checked)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            if is_new:
+                self.new_entries[key] = (fees, timestamp_checked)
+
+    def pop_new_entries(self):
+        with self.lock:
+            new_entries = self.new_entries
+            self.new_entries = {}
+            return new_entries
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FeeCache(settings.FEE_CACHE["SIZE"])
+        return _cache
+
+
+def reset():
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def is_fresh(timestamp_checked, now):
+    ttl = timedelta(days=settings.FEE_CACHE["TTL_DAYS"])
+    return timestamp_checked + ttl > now
+
+
+def get_price_band(price):
+    band_width = Decimal(str(settings.FEE_CACHE["PRICE_BAND"]))
+    return int(Decimal(str(price)) // band_width)
+
+
+def get_key(amazon_product, marketplace_id):
+    """Returns (asin, marketplace_id, price_band) or None without ASIN or price."""
+
+    if amazon_product.asin is None or amazon_product.price is None:
+        return None
+    return amazon_product.asin, marketplace_id, get_price_band(amazon_product.price)
+
+
+def apply_cached_fees(batch, marketplace_id, now=None):
+    """
+    Sets the cached fees of the ProductAmazon objects of batch and returns the
+    products that have to be requested, one per key.
+    """
+
+    if now is None:
+        now = datetime.now()
+    cache = get_cache()
+    missing_products = []
+    missing_keys = set()
+    hit_count = 0
+    for cur_product in batch:
+        cur_key = get_key(cur_product, marketplace_id)
+        if cur_key is None:
+            missing_products.append(cur_product)
+            continue
+        fees = cache.get(cur_key, now)
+        if fees is not None:
+            hit_count = hit_count + 1
+            for cur_field, cur_value in fees.items():
+                setattr(cur_product, cur_field, cur_value)
+        elif cur_key not in missing_keys:
+            missing_keys.add(cur_key)
+            missing_products.append(cur_product)
+    metrics.increment("mws.fees.cache_hits", hit_count)
+    metrics.increment("mws.fees.requested_products", len(missing_products))
+    return missing_products
+
+
+def add_requested_fees(batch, requested_products, marketplace_id, now=None):
+    """
+    Caches the fees of the requested products and sets them on the other
+    products of batch with the same key.
+    """
+
+    if now is None:
+        now = datetime.now()
+    cache = get_cache()
+    for cur_product in requested_products:
+        cur_key = get_key(cur_product, marketplace_id)
+        # failed estimates are requested again next time
+        if cur_key is None or cur_product.fees_total is None:
+            continue
+        fees = {cur_field: getattr(cur_product, cur_field) for cur_field in fee_fields}
+        cache.put(cur_key, fees, now, is_new=True)
+
+    # the duplicates were cache misses as well and get the fees of their key
+    requested_ids = {id(cur_product) for cur_product in requested_products}
+    for cur_product in batch:
+        if id(cur_product) in requested_ids:
+            continue
+        cur_key = get_key(cur_product, marketplace_id)
+        fees = None if cur_key is None else cache.get(cur_key, now)
+        if fees is not None:
+            for cur_field, cur_value in fees.items():
+                setattr(cur_product, cur_field, cur_value)
+
+
+def load_fees(session, asins, marketplace_id, now=None, chunk_size=1000):
+    """Fills the memory with the fresh stored fees of the ASINs."""
+
+    if now is None:
+        now = datetime.now()
+    min_timestamp = now - timedelta(days=settings.FEE_CACHE["TTL_DAYS"])
+    cache = get_cache()
+    asins = list(asins)
+    for start in range(0, len(asins), chunk_size):
+        query = (
+            session.query(FeeEstimate)
+            .filter(FeeEstimate.asin.in_(asins[start : start + chunk_size]))
+            .filter(FeeEstimate.marketplace_id == marketplace_id)
+            .filter(FeeEstimate.timestamp_checked > min_timestamp)
+        )
+        for cur_row in query:
+            fees = {cur_field: getattr(cur_row, cur_field) for cur_field in fee_fields}
+            cache.put(
+                (cur_row.asin, cur_row.marketplace_id, cur_row.price_band),
+                fees,
+                cur_row.timestamp_checked,
+            )
+
+
+def write_new_fees(session):
+    """Stores the fees that were requested since the last call."""
+
+    new_entries = get_cache().pop_new_entries()
+    if len(new_entries) == 0:
+        return
+    table = FeeEstimate.__table__
+    session.execute(
+        table.delete().where(
+            tuple_(table.c.asin, table.c.marketplace_id, table.c.price_band).in_(
+                list(new_entries)
+            )
+        )
+    )
+    session.execute(
+        table.insert(),
+        [
+            {
+                "asin": cur_asin,
+                "marketplace_id": cur_marketplace_id,
+                "price_band": cur_price_band,
+                "timestamp_checked": cur_timestamp,
+                **cur_fees,
+            }
+            for (
+                cur_asin,
+                cur_marketplace_id,
+                cur_price_band,
+            ), (cur_fees, cur_timestamp) in new_entries.items()
+        ],
+    )
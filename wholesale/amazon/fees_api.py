@@ -1,30 +1,115 @@
-import requests
+from urllib.parse import urlencode, quote
 from decimal import Decimal
+from io import BytesIO
 import hmac
 import base64
 import datetime
+import threading
+import time
+import requests
+from lxml import etree
 from wholesale import settings
 from wholesale.db import Session
 from wholesale.db.models import ProductAmazon
-from bs4 import BeautifulSoup
+from wholesale.utils import metrics, rate_limiter
 import logging
 
+# the fee types of FeeDetail whose FinalFee is returned, and their keys
+fee_types = {"FBAFees": "fba", "VariableClosingFee": "closing"}
+
+
+def get_local_name(element):
+    # the MWS responses use a default namespace
+    return etree.QName(element).localname
+
+
+def parse_fees_estimates(content):
+    """
+    Returns {asin: {"total": fee, "fba": fee, "closing": fee}} of the
+    FeesEstimateResult elements in one pass over the XML bytes. fba and closing
+    are missing if the estimate doesn't have them, results without a total are
+    left out.
+    """
+
+    result = {}
+    asin = None
+    fees = {}
+    amount = None
+    # the fee type of every open FeeDetail, they contain each other
+    fee_detail_types = []
+    for event, element in etree.iterparse(BytesIO(content), events=("start", "end")):
+        name = get_local_name(element)
+        if event == "start":
+            if name == "FeeDetail":
+                fee_detail_types.append(None)
+            continue
+
+        if name == "IdValue":
+            asin = element.text
+        elif name == "Amount":
+            amount = element.text
+        elif name == "TotalFeesEstimate":
+            fees["total"] = Decimal(amount)
+        elif name == "FeeType":
+            fee_detail_types[-1] = element.text
+        elif name == "FinalFee":
+            fee_key = fee_types.get(fee_detail_types[-1])
+            if fee_key is not None:
+                fees[fee_key] = Decimal(amount)
+        elif name == "FeeDetail":
+            fee_detail_types.pop()
+        elif name == "FeesEstimateResult":
+            if asin is not None and "total" in fees:
+                result[asin] = fees
+            asin = None
+            fees = {}
+            element.clear()
+    return result
+
 
 class FeesAPI:
     mws_endpoint = "https://mws-eu.amazonservices.com/Products/2011-10-01"
+    mws_host = "mws-eu.amazonservices.com"
+    mws_path = "/Products/2011-10-01"
 
     def __init__(self, aws_access_key_id, secret_key, seller_id, mws_auth_token):
         self.aws_access_key_id = aws_access_key_id
         self.secret_key = secret_key
         self.seller_id = seller_id
         self.mws_auth_token = mws_auth_token
+        # a requests.Session is not thread-safe, so every thread keeps the
+        # connections of its own session alive between the requests
+        self.local = threading.local()
+
+    def get_http_session(self):
+        http_session = getattr(self.local, "http_session", None)
+        if http_session is None:
+            http_session = requests.Session()
+            self.local.http_session = http_session
+        return http_session
+
+    def sign(self, data):
+        """
+        Returns the request body of the parameters with the signature. The
+        parameters are encoded once and the same string is signed and sent.
+        """
+
+        # the data has to be sorted in natural byte ordering by parameter name
+        body = urlencode(sorted(data.items()), quote_via=quote)
+        query_string = f"POST\n{self.mws_host}\n{self.mws_path}\n{body}"
+        signature = hmac.new(
+            bytes(self.secret_key, "utf-8"),
+            bytes(query_string, "utf-8"),
+            digestmod="SHA256",
+        ).digest()
+        return body + "&Signature=" + quote(base64.b64encode(signature), safe="")
 
     def get_my_fees_estimate(self, marketplace_id, products):
         assert len(products) > 0
         assert len(products) <= 20
 
         # this is the basic information that has to be sent with every request
-        data_unsorted = {
+        data = {
             "Action": "GetMyFeesEstimate",
             "AWSAccessKeyId": self.aws_access_key_id,
             "MWSAuthToken": self.mws_auth_token,
@@ -36,114 +121,32 @@ class FeesAPI:
         }
 
         # now append the products to this data
-        listindex = 1
-        for cur_product in products:
-            data_unsorted[
-                "FeesEstimateRequestList.FeesEstimateRequest."
-                + str(listindex)
-                + ".MarketplaceId"
-            ] = marketplace_id
-            data_unsorted[
-                "FeesEstimateRequestList.FeesEstimateRequest."
-                + str(listindex)
-                + ".IdType"
-            ] = "ASIN"
-            data_unsorted[
-                "FeesEstimateRequestList.FeesEstimateRequest."
-                + str(listindex)
-                + ".IdValue"
-            ] = cur_product.asin
-            data_unsorted[
-                "FeesEstimateRequestList.FeesEstimateRequest."
-                + str(listindex)
-                + ".IsAmazonFulfilled"
-            ] = "true"
-            data_unsorted[
-                "FeesEstimateRequestList.FeesEstimateRequest."
-                + str(listindex)
-                + ".Identifier"
-            ] = datetime.datetime.now().isoformat()
-            data_unsorted[
-                "FeesEstimateRequestList.FeesEstimateRequest."
-                + str(listindex)
-                + ".PriceToEstimateFees.ListingPrice.CurrencyCode"
-            ] = "EUR"
-            data_unsorted[
-                "FeesEstimateRequestList.FeesEstimateRequest."
-                + str(listindex)
-                + ".PriceToEstimateFees.ListingPrice.Amount"
-            ] = cur_product.price
-
-            listindex = listindex + 1
-
-        # the data has to be sorted in natural byte ordering by parameter name
-        data_sorted = {}
-        for cur_key in sorted(data_unsorted.keys()):
-            data_sorted[cur_key] = data_unsorted[cur_key]
-
-        # create the request signature
-        req = requests.Request("POST", url=self.mws_endpoint, data=data_sorted)
-        prepped = req.prepare()
-
-        # create the query string for the request signature
-        query_string = (
-            "POST\nmws-eu.amazonservices.com\n/Products/2011-10-01\n" + prepped.body
+        for cur_index, cur_product in enumerate(products, start=1):
+            prefix = f"FeesEstimateRequestList.FeesEstimateRequest.{cur_index}."
+            data[prefix + "MarketplaceId"] = marketplace_id
+            data[prefix + "IdType"] = "ASIN"
+            data[prefix + "IdValue"] = cur_product.asin
+            data[prefix + "IsAmazonFulfilled"] = "true"
+            data[prefix + "Identifier"] = datetime.datetime.now().isoformat()
+            data[prefix + "PriceToEstimateFees.ListingPrice.CurrencyCode"] = "EUR"
+            data[prefix + "PriceToEstimateFees.ListingPrice.Amount"] = cur_product.price
+
+        start = time.perf_counter()
+        response = self.get_http_session().post(
+            self.mws_endpoint,
+            data=self.sign(data),
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
         )
-        signature = hmac.new(
-            bytes(self.secret_key, "utf-8"),
-            bytes(query_string, "utf-8"),
-            digestmod="SHA256",
-        ).digest()
-
-        # add the signature to the request
-        data_sorted["Signature"] = base64.b64encode(signature).decode()
-
-        # create the request to send
-        req = requests.Request("POST", url=self.mws_endpoint, data=data_sorted)
-        prepped = req.prepare()
-        with requests.Session() as session:
-            response = session.send(prepped)
-
-        # now parse the response text
-        bs = BeautifulSoup(response.text, "xml")
+        metrics.observe("mws.fees.request", time.perf_counter() - start)
+        rate_limiter.update_from_mws_headers("mws.GetMyFeesEstimate", response.headers)
 
-        result = {}
+        start = time.perf_counter()
         try:
-            for cur_result in bs.find_all("FeesEstimateResult"):
-                try:
-                    cur_asin = cur_result.find("IdValue").string
-                    cur_fee = Decimal(
-                        cur_result.find("TotalFeesEstimate").Amount.string
-                    )
-                    result[cur_asin] = {"total": cur_fee}
-
-                    fba_fees_tag = cur_result.find("FeeType", string="FBAFees")
-                    if fba_fees_tag is None:
-                        continue
-
-                    fba_fee = Decimal(
-                        fba_fees_tag.next_sibling.next_sibling.find(
-                            "FinalFee"
-                        ).Amount.string
-                    )
-                    result[cur_asin]["fba"] = fba_fee
-
-                    closing_fee_tag = cur_result.find(
-                        lambda tag: tag.find(
-                            "FeeType", string="VariableClosingFee", recursive=False
-                        )
-                        is not None
-                    )
-                    if closing_fee_tag is None:
-                        continue
-                    closing_fee = Decimal(closing_fee_tag.FinalFee.Amount.string)
-                    result[cur_asin]["closing"] = closing_fee
-                except:
-                    pass
+            result = parse_fees_estimates(response.content)
         except Exception as e:
-            print("Error while requesting fees! Response:")
-            print(response.text)
+            logging.error(f"Error while requesting fees! Response: {response.text}")
             raise e
+        metrics.observe("mws.fees.parse", time.perf_counter() - start)
 
         return result
 
@@ -1 +1,12 @@
-from .setup import engine, Session
+from .setup import (
+    get_engine,
+    get_pool_status,
+    Session,
+    session_scope,
+)
+
+
+def __getattr__(name):
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
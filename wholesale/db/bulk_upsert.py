@@ -0,0 +1,203 @@
+from collections import namedtuple
+from sqlalchemy import Table, Column, MetaData, select, and_, or_, func, literal, case
+from wholesale.db.models import (
+    ProductWholesale,
+    wholesale_update_fields as update_fields,
+    compute_content_hash,
+)
+from wholesale.db.price_history import make_wholesale_history_statement
+
+UpsertResult = namedtuple("UpsertResult", ["inserted", "updated", "unchanged"])
+
+staging_table_name = "staging_products_wholesale"
+
+
+def make_staging_table(metadata):
+    """
+    Returns a temporary table that holds one feed row per EAN. The column types
+    are copied from the products_wholesale table.
+    """
+
+    wholesale = ProductWholesale.__table__
+    return Table(
+        staging_table_name,
+        metadata,
+        Column("ean", wholesale.c.ean.type, primary_key=True),
+        *[
+            Column(cur_field, wholesale.c[cur_field].type)
+            for cur_field in update_fields
+        ],
+        Column("content_hash", wholesale.c.content_hash.type),
+        prefixes=["TEMPORARY"],
+    )
+
+
+def product_to_row(product):
+    row = {"ean": product.ean}
+    for cur_field in update_fields:
+        row[cur_field] = getattr(product, cur_field)
+    row["content_hash"] = compute_content_hash(
+        ProductWholesale.__table__, update_fields, row
+    )
+    return row
+
+
+def get_content_hashes(session, shop_name):
+    """Returns a dict {ean: content_hash} of all products of the shop."""
+
+    query = session.query(
+        ProductWholesale.ean, ProductWholesale.content_hash
+    ).filter_by(shop_name=shop_name)
+    return {cur_row.ean: cur_row.content_hash for cur_row in query}
+
+
+def make_update_statement(staging, shop_name):
+    """
+    Updates all existing products that differ from their staging row. Just like
+    ProductWholesale.update(), a NULL in the feed keeps the stored value.
+
+    The content hash of the staging row is only valid for the merged row if no
+    stored value is kept. Otherwise the hash of a changed row is set to NULL, which
+    makes the next run compare the row again. Rows whose only difference is an
+    outdated hash get the staging hash.
+    """
+
+    wholesale = ProductWholesale.__table__
+    is_merged_row_equal_to_staging_row = and_(
+        *[
+            or_(staging.c[cur_field].isnot(None), wholesale.c[cur_field].is_(None))
+            for cur_field in update_fields
+        ]
+    )
+    new_content_hash = case(
+        [(is_merged_row_equal_to_staging_row, staging.c.content_hash)], else_=None
+    )
+    is_changed = or_(
+        *[
+            and_(
+                staging.c[cur_field].isnot(None),
+                staging.c[cur_field].is_distinct_from(wholesale.c[cur_field]),
+            )
+            for cur_field in update_fields
+        ],
+        and_(
+            is_merged_row_equal_to_staging_row,
+            wholesale.c.content_hash.is_distinct_from(staging.c.content_hash),
+        ),
+    )
+    new_values = {
+        wholesale.c[cur_field]: func.coalesce(
+            staging.c[cur_field], wholesale.c[cur_field]
+        )
+        for cur_field in update_fields
+    }
+    new_values[wholesale.c.content_hash] = new_content_hash
+    return (
+        wholesale.update()
+        .where(
+            and_(
+                wholesale.c.shop_name == shop_name,
+                wholesale.c.ean == staging.c.ean,
+                is_changed,
+            )
+        )
+        .values(new_values)
+    )
+
+
+def make_insert_statement(staging, shop_name):
+    """Inserts all staging rows that have no matching product yet."""
+
+    wholesale = ProductWholesale.__table__
+    new_rows = (
+        select(
+            [
+                literal(shop_name),
+                staging.c.ean,
+                staging.c.name,
+                staging.c.is_available,
+                staging.c.price_net,
+                func.coalesce(staging.c.age_restriction, 0),
+                staging.c.content_hash,
+            ]
+        )
+        .select_from(
+            staging.outerjoin(
+                wholesale,
+                and_(
+                    wholesale.c.shop_name == shop_name,
+                    wholesale.c.ean == staging.c.ean,
+                ),
+            )
+        )
+        .where(wholesale.c.id.is_(None))
+    )
+    return wholesale.insert().from_select(
+        [
+            "shop_name",
+            "ean",
+            "name",
+            "is_available",
+            "price_net",
+            "age_restriction",
+            "content_hash",
+        ],
+        new_rows,
+    )
+
+
+def upsert_products_wholesale(
+    session, shop_name, products, chunk_size=5000, compare_hashes=True
+):
+    """
+    Merges an iterable of ProductWholesale objects into the products_wholesale
+    table. The whole feed is loaded into a temporary staging table first and then
+    merged with one UPDATE and one INSERT statement. Price changes are recorded in
+    the price history on the way. If an EAN occurs more than once in the feed, the
+    last occurrence wins.
+
+    If compare_hashes is True, the content hashes of the shop are loaded first and
+    feed rows with an unchanged hash never reach the staging table. Callers that
+    already filtered out unchanged rows can skip this.
+
+    The session is not committed. Returns an UpsertResult with the number of
+    inserted, updated and unchanged products.
+    """
+
+    rows = {}
+    for cur_product in products:
+        rows[cur_product.ean] = product_to_row(cur_product)
+    row_count = len(rows)
+
+    if compare_hashes:
+        known_hashes = get_content_hashes(session, shop_name)
+        rows = [
+            cur_row
+            for cur_row in rows.values()
+            if known_hashes.get(cur_row["ean"]) != cur_row["content_hash"]
+        ]
+    else:
+        rows = list(rows.values())
+
+    if len(rows) == 0:
+        return UpsertResult(inserted=0, updated=0, unchanged=row_count)
+
+    # temporary tables only live as long as the connection, so everything has to
+    # run on the connection of the session
+    connection = session.connection()
+    staging = make_staging_table(MetaData())
+    staging.create(connection)
+    try:
+        for start in range(0, len(rows), chunk_size):
+            connection.execute(staging.insert(), rows[start : start + chunk_size])
+        connection.execute(make_wholesale_history_statement(staging, shop_name))
+        updated = connection.execute(make_update_statement(staging, shop_name)).rowcount
+        inserted = connection.execute(
+            make_insert_statement(staging, shop_name)
+        ).rowcount
+    finally:
+        staging.drop(connection)
+
+    return UpsertResult(
+        inserted=inserted, updated=updated, unchanged=row_count - inserted - updated
+    )
@@ -1,6 +1,10 @@
+import hashlib
+import numpy as np
 import pandas as pd
+from sqlalchemy import or_
 from wholesale.db import Session
 from wholesale.db.models import ProductAmazon, ProductWholesale
+from wholesale.db import frame_cache
 
 fba_de_fee = 0.5
 default_shipping = 2
@@ -8,9 +12,80 @@ default_percent = 0.15
 vat_tax = 0.19
 adult_check_fee = 5 / (1 + vat_tax)
 
+# the raw columns that the derived metrics are computed from
+computation_columns = [
+    "price_shop",
+    "age_restriction",
+    "price_amazon",
+    "fees_fba_net",
+    "fees_closing_net",
+    "fees_total",
+    "amazon_updated",
+    "wholesale_updated",
+]
 
-def get_raw_data_from_db(session):
-    query = session.query(
+# the Numeric columns, which are read as Decimal objects
+numeric_columns = [
+    "price_shop",
+    "price_amazon",
+    "fees_fba_net",
+    "fees_closing_net",
+    "fees_total",
+    "rating",
+]
+
+# the columns of get_data() in this order
+data_columns = [
+    "shop_name",
+    "name",
+    "ean",
+    "asin",
+    "is_available",
+    "age_restriction",
+    "price_shop",
+    "price_amazon",
+    "break_even",
+    "safety_percent",
+    "profit",
+    "roi",
+    "margin",
+    "sales30",
+    "sales365",
+    "offers",
+    "fba_offers",
+    "has_buy_box",
+    "review_count",
+    "rating",
+    "fees_percentage",
+    "fees_fba_net",
+    "fees_closing_net",
+    "fees_total",
+    "sales_rank",
+    "category_id",
+    "last_updated",
+]
+
+
+def get_fee_constants():
+    return {
+        "fba_de_fee": fba_de_fee,
+        "default_shipping": default_shipping,
+        "default_percent": default_percent,
+        "vat_tax": vat_tax,
+        "adult_check_fee": adult_check_fee,
+    }
+
+
+def get_constants_fingerprint():
+    """Returns a hash of the fee constants, which changes whenever one changes."""
+
+    constants = get_fee_constants().values()
+    content = "\x1f".join(repr(cur_constant) for cur_constant in constants)
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+
+def get_raw_columns():
+    return [
         ProductWholesale.shop_name,
         ProductWholesale.name,
         ProductWholesale.price_net.label("price_shop"),
@@ -33,43 +108,139 @@ def get_raw_data_from_db(session):
         ProductAmazon.sales_rank,
         ProductAmazon.timestamp_updated.label("amazon_updated"),
         ProductWholesale.timestamp_updated.label("wholesale_updated"),
-    ).join(ProductAmazon, ProductWholesale.ean == ProductAmazon.ean)
-    df = pd.read_sql(query.statement, query.session.bind)
+    ]
+
+
+def get_raw_data_query(
+    session,
+    shops=None,
+    updated_since=None,
+    columns=None,
+    min_profit=None,
+    min_roi=None,
+):
+    """
+    Returns the query of the joined products. shops and updated_since become WHERE
+    clauses and columns restricts the SELECT list to these raw columns.
+
+    profit and roi can't be computed in SQL, as the fees are estimated in pandas.
+    But as the fees are never negative, a product can only reach min_profit or
+    min_roi if its Amazon price beats the taxed shop price by that much. All
+    products that fail this bound are filtered out in SQL already.
+    """
+
+    raw_columns = get_raw_columns()
+    if columns is not None:
+        raw_columns = [
+            cur_column for cur_column in raw_columns if cur_column.key in columns
+        ]
+    query = (
+        session.query(*raw_columns)
+        .select_from(ProductWholesale)
+        .join(ProductAmazon, ProductWholesale.ean == ProductAmazon.ean)
+    )
+
+    if shops is not None:
+        query = query.filter(ProductWholesale.shop_name.in_(shops))
+    if updated_since is not None:
+        query = query.filter(
+            or_(
+                ProductWholesale.timestamp_updated >= updated_since,
+                ProductAmazon.timestamp_updated >= updated_since,
+            )
+        )
+
+    price_shop_taxed = ProductWholesale.price_net * (1 + vat_tax)
+    if min_profit is not None:
+        query = query.filter(ProductAmazon.price - price_shop_taxed > min_profit)
+    if min_roi is not None:
+        query = query.filter(
+            or_(
+                ProductWholesale.price_net <= 0,
+                ProductAmazon.price > price_shop_taxed * (1 + min_roi),
+            )
+        )
+    return query
+
+
+def get_raw_data_from_db(
+    session,
+    shops=None,
+    updated_since=None,
+    columns=None,
+    min_profit=None,
+    min_roi=None,
+):
+    query = get_raw_data_query(
+        session,
+        shops=shops,
+        updated_since=updated_since,
+        columns=columns,
+        min_profit=min_profit,
+        min_roi=min_roi,
+    )
+    df = pd.read_sql(query.statement, session.connection())
+    coerce_numeric_columns(df)
 
     return df
 
 
+def coerce_numeric_columns(df):
+    """
+    Converts the Decimal columns to float64, so that the metrics are computed with
+    vectorized NumPy operations instead of Python objects.
+    """
+
+    for cur_column in numeric_columns:
+        if cur_column in df.columns:
+            df[cur_column] = pd.to_numeric(df[cur_column]).astype("float64")
+
+
 def estimate_fees(df):
-    df["fees_percentage"] = round(
-        (df["fees_total"] - df["fees_fba_net"] - df["fees_closing_net"])
-        / df["price_amazon"],
-        2,
-    )
-    df["fees_total"] = df["fees_total"].where(
-        ~df["fees_total"].isna(),
-        df["price_amazon"] * default_percent + default_shipping,
+    price_amazon = df["price_amazon"].to_numpy(dtype="float64")
+    fees_total = df["fees_total"].to_numpy(dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["fees_percentage"] = np.round(
+            (
+                fees_total
+                - df["fees_fba_net"].to_numpy(dtype="float64")
+                - df["fees_closing_net"].to_numpy(dtype="float64")
+            )
+            / price_amazon,
+            2,
+        )
+    fees_total = np.where(
+        np.isnan(fees_total),
+        price_amazon * default_percent + default_shipping,
+        fees_total,
     )
-    df["fees_total"] = df["fees_total"].where(
-        df["age_restriction"] < 18, df["fees_total"] + adult_check_fee
+    fees_total = np.where(
+        df["age_restriction"].to_numpy() < 18, fees_total, fees_total + adult_check_fee
     )
-    df["fees_total"] = df["fees_total"] + fba_de_fee
+    df["fees_total"] = fees_total + fba_de_fee
 
 
 def add_taxes(df):
-    df["price_shop"] = df["price_shop"] * 1.19
-    df["fees_total"] = df["fees_total"] * 1.19
+    df["price_shop"] = df["price_shop"].to_numpy(dtype="float64") * 1.19
+    df["fees_total"] = df["fees_total"].to_numpy(dtype="float64") * 1.19
 
 
 def add_profit(df):
-    df["profit"] = df["price_amazon"] - df["fees_total"] - df["price_shop"]
+    df["profit"] = (
+        df["price_amazon"].to_numpy(dtype="float64")
+        - df["fees_total"].to_numpy(dtype="float64")
+        - df["price_shop"].to_numpy(dtype="float64")
+    )
 
 
 def add_roi(df):
-    df["roi"] = df["profit"] / df["price_shop"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["roi"] = df["profit"].to_numpy() / df["price_shop"].to_numpy()
 
 
 def add_margin(df):
-    df["margin"] = df["profit"] / df["price_amazon"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["margin"] = df["profit"].to_numpy() / df["price_amazon"].to_numpy()
 
 
 def add_last_updated(df):
@@ -77,59 +248,33 @@ def add_last_updated(df):
 
 
 def add_break_even(df):
-    df["age_fee"] = 0
-    df["age_fee"].where(df["age_restriction"] < 18, adult_check_fee, inplace=True)
-    df["break_even"] = (
-        (1 + vat_tax)
-        / (1 - df["fees_percentage"] * (1 + vat_tax))
-        * (
-            df["price_shop"] / (1 + vat_tax)
-            + df["fees_closing_net"]
-            + df["fees_fba_net"]
-            + df["age_fee"]
-            + fba_de_fee
+    price_amazon = df["price_amazon"].to_numpy(dtype="float64")
+    age_fee = np.where(df["age_restriction"].to_numpy() < 18, 0.0, adult_check_fee)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        break_even = (
+            (1 + vat_tax)
+            / (1 - df["fees_percentage"].to_numpy() * (1 + vat_tax))
+            * (
+                df["price_shop"].to_numpy() / (1 + vat_tax)
+                + df["fees_closing_net"].to_numpy(dtype="float64")
+                + df["fees_fba_net"].to_numpy(dtype="float64")
+                + age_fee
+                + fba_de_fee
+            )
         )
-    )
-    df["safety_percent"] = (df["price_amazon"] - df["break_even"]) / df["price_amazon"]
-
-
-def clean(df):
-    df = df[
-        [
-            "shop_name",
-            "name",
-            "ean",
-            "asin",
-            "is_available",
-            "age_restriction",
-            "price_shop",
-            "price_amazon",
-            "break_even",
-            "safety_percent",
-            "profit",
-            "roi",
-            "margin",
-            "sales30",
-            "sales365",
-            "offers",
-            "fba_offers",
-            "has_buy_box",
-            "review_count",
-            "rating",
-            "fees_percentage",
-            "fees_fba_net",
-            "fees_closing_net",
-            "fees_total",
-            "sales_rank",
-            "category_id",
-            "last_updated",
-        ]
-    ]
+        df["safety_percent"] = (price_amazon - break_even) / price_amazon
+    df["age_fee"] = age_fee
+    df["break_even"] = break_even
+
+
+def clean(df, columns=None):
+    if columns is None:
+        columns = data_columns
+    df = df[columns]
     return df
 
 
-def get_data(session):
-    data = get_raw_data_from_db(session)
+def add_metrics(data):
     estimate_fees(data)
     add_taxes(data)
     add_profit(data)
@@ -137,5 +282,281 @@ def get_data(session):
     add_margin(data)
     add_last_updated(data)
     add_break_even(data)
+
+
+def filter_metrics(data, min_profit=None, min_roi=None):
+    if min_profit is not None:
+        data = data[data["profit"] > min_profit]
+    if min_roi is not None:
+        data = data[data["roi"] > min_roi]
+    return data
+
+
+def filter_data(
+    data,
+    shops=None,
+    min_profit=None,
+    min_roi=None,
+    updated_since=None,
+    columns=None,
+):
+    """Applies the filters of get_data() to a computed dataframe."""
+
+    if shops is not None:
+        data = data[data["shop_name"].isin(shops)]
+    data = filter_metrics(data, min_profit=min_profit, min_roi=min_roi)
+    if updated_since is not None:
+        data = data[data["last_updated"] >= updated_since]
+    return clean(data, columns)
+
+
+def compute_filtered_data(data, columns, min_profit=None, min_roi=None):
+    add_metrics(data)
+    data = filter_metrics(data, min_profit=min_profit, min_roi=min_roi)
+    return clean(data, columns)
+
+
+def compute_data(data):
+    """Adds the derived metrics to the raw data and returns the cleaned dataframe."""
+
+    add_metrics(data)
     data = clean(data)
     return data
+
+
+def query_data(
+    session,
+    shops=None,
+    min_profit=None,
+    min_roi=None,
+    updated_since=None,
+    columns=None,
+):
+    # imported here, because the opportunities are computed with this module
+    from wholesale.db import opportunities
+
+    if columns is None:
+        columns = data_columns
+
+    if opportunities.is_fresh(session):
+        return opportunities.read_opportunities(
+            session,
+            shops=shops,
+            min_profit=min_profit,
+            min_roi=min_roi,
+            updated_since=updated_since,
+            columns=columns,
+        )
+
+    data = get_raw_data_from_db(
+        session,
+        shops=shops,
+        updated_since=updated_since,
+        columns=set(computation_columns) | set(columns),
+        min_profit=min_profit,
+        min_roi=min_roi,
+    )
+    return compute_filtered_data(data, columns, min_profit=min_profit, min_roi=min_roi)
+
+
+def get_data(
+    session,
+    shops=None,
+    min_profit=None,
+    min_roi=None,
+    updated_since=None,
+    columns=None,
+):
+    """
+    Returns the joined products with all derived metrics. If the local mirror is
+    enabled, they are read from the mirror instead of the database of the
+    session. If the cache is enabled, an unfiltered call caches the full frame on
+    disk until the products or the fee constants change and later calls apply
+    their filters to the cached frame. Otherwise the filters are pushed down into
+    SQL. The materialized opportunities table is used if it is fresh, otherwise
+    everything is computed.
+
+    shops limits the result to these shops, min_profit and min_roi to products
+    with a greater profit or roi and updated_since to products whose wholesale or
+    Amazon data was updated since then. columns selects and orders the returned
+    columns, by default all data_columns.
+    """
+
+    # imported here, because the mirror runs this function against its copy
+    from wholesale.db import local_mirror
+
+    if local_mirror.is_enabled() and not local_mirror.is_mirror_session(session):
+        return local_mirror.get_data(
+            shops=shops,
+            min_profit=min_profit,
+            min_roi=min_roi,
+            updated_since=updated_since,
+            columns=columns,
+        )
+
+    if frame_cache.is_enabled():
+        key = frame_cache.get_cache_key(session, get_constants_fingerprint())
+        table = frame_cache.read_cached_table(key)
+        if table is not None:
+            return filter_data(
+                table.to_pandas(),
+                shops=shops,
+                min_profit=min_profit,
+                min_roi=min_roi,
+                updated_since=updated_since,
+                columns=columns,
+            )
+        # only unfiltered calls fill the cache, so a filtered call doesn't compute
+        # the full frame
+        filters = [shops, min_profit, min_roi, updated_since, columns]
+        if all(cur_filter is None for cur_filter in filters):
+            data = query_data(session)
+            frame_cache.write_cached_data(key, data)
+            return data
+
+    return query_data(
+        session,
+        shops=shops,
+        min_profit=min_profit,
+        min_roi=min_roi,
+        updated_since=updated_since,
+        columns=columns,
+    )
+
+
+def select_top(data, k, by):
+    """
+    Returns the k rows with the highest finite value of by. nlargest only
+    partially sorts the rows, so this is faster than sorting all of them.
+    """
+
+    data = data[np.isfinite(data[by].to_numpy(dtype="float64"))]
+    return data.nlargest(k, by)
+
+
+def top_opportunities(
+    session,
+    k=10,
+    by="roi",
+    shops=None,
+    min_sales30=None,
+    max_offers=None,
+    columns=None,
+    chunksize=50000,
+):
+    """
+    Returns the k products with the highest value of by, e.g. roi or profit, in
+    descending order. shops works like in get_data(), min_sales30 and max_offers
+    keep products that sold at least or have at most that many offers. Products
+    without a finite value of by are left out.
+
+    If the opportunities table is fresh, the selection runs in SQL. Otherwise
+    the products are computed chunk by chunk as in get_data_chunks() and only the
+    best k of all chunks so far are kept.
+    """
+
+    # imported here, because the opportunities are computed with this module
+    from wholesale.db import opportunities
+
+    if columns is None:
+        columns = data_columns
+
+    if opportunities.is_fresh(session):
+        query = opportunities.get_top_opportunities_query(
+            session,
+            k,
+            by=by,
+            shops=shops,
+            min_sales30=min_sales30,
+            max_offers=max_offers,
+            columns=columns,
+        )
+        return pd.read_sql(query.statement, session.connection())
+
+    chunk_columns = list(columns) + [
+        cur_column
+        for cur_column in [by, "sales30", "offers"]
+        if cur_column not in columns
+    ]
+    best = None
+    for cur_chunk in get_data_chunks(
+        session, chunksize=chunksize, shops=shops, columns=chunk_columns
+    ):
+        if min_sales30 is not None:
+            cur_chunk = cur_chunk[cur_chunk["sales30"] >= min_sales30]
+        if max_offers is not None:
+            cur_chunk = cur_chunk[cur_chunk["offers"] <= max_offers]
+        if best is not None:
+            cur_chunk = pd.concat([best, cur_chunk])
+        best = select_top(cur_chunk, k, by)
+
+    if best is None:
+        return pd.DataFrame(columns=columns)
+    return clean(best, columns).reset_index(drop=True)
+
+
+def get_data_chunks(
+    session,
+    chunksize=10000,
+    shops=None,
+    min_profit=None,
+    min_roi=None,
+    updated_since=None,
+    columns=None,
+):
+    """
+    Like get_data(), but yields the result in dataframes of at most chunksize
+    rows. The rows are streamed from a server side cursor and the metrics are
+    computed chunk by chunk, so the memory use does not grow with the catalog.
+
+    The session can't run other queries until the generator is exhausted.
+    """
+
+    # imported here, because the opportunities are computed with this module
+    from wholesale.db import opportunities
+
+    if columns is None:
+        columns = data_columns
+
+    if frame_cache.is_enabled():
+        key = frame_cache.get_cache_key(session, get_constants_fingerprint())
+        table = frame_cache.read_cached_table(key)
+        if table is not None:
+            # the slices of the memory-mapped table are only read when converted
+            for offset in range(0, table.num_rows, chunksize):
+                yield filter_data(
+                    table.slice(offset, chunksize).to_pandas(),
+                    shops=shops,
+                    min_profit=min_profit,
+                    min_roi=min_roi,
+                    updated_since=updated_since,
+                    columns=columns,
+                )
+            return
+
+    connection = session.connection().execution_options(stream_results=True)
+    if opportunities.is_fresh(session):
+        query = opportunities.get_opportunities_query(
+            session,
+            shops=shops,
+            min_profit=min_profit,
+            min_roi=min_roi,
+            updated_since=updated_since,
+            columns=columns,
+        )
+        yield from pd.read_sql(query.statement, connection, chunksize=chunksize)
+        return
+
+    query = get_raw_data_query(
+        session,
+        shops=shops,
+        updated_since=updated_since,
+        columns=set(computation_columns) | set(columns),
+        min_profit=min_profit,
+        min_roi=min_roi,
+    )
+    for cur_chunk in pd.read_sql(query.statement, connection, chunksize=chunksize):
+        coerce_numeric_columns(cur_chunk)
+        yield compute_filtered_data(
+            cur_chunk, columns, min_profit=min_profit, min_roi=min_roi
+        )
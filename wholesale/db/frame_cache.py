@@ -0,0 +1,84 @@
+from pathlib import Path
+import hashlib
+import logging
+import os
+from sqlalchemy import func
+from wholesale import settings
+from wholesale.db.models import ProductWholesale, ProductAmazon
+
+try:
+    from pyarrow import feather
+except ImportError:
+    feather = None
+
+# An on-disk cache of the full get_data() frame in the uncompressed Arrow IPC
+# format, so that it can be memory-mapped. The key covers the newest
+# timestamp_updated and the row count of both product tables and the fee
+# constants, so every write to the tables makes the cached frame stale. The cache
+# is optional, it is only used if pyarrow is installed and
+# settings.DATA_CACHE_DIR is set.
+
+
+def is_enabled(path=None):
+    return feather is not None and bool(path or settings.DATA_CACHE_DIR)
+
+
+def get_cache_dir(path=None):
+    if path is None:
+        path = settings.DATA_CACHE_DIR
+    return Path(path).expanduser()
+
+
+def get_cache_key(session, constants_fingerprint):
+    values = []
+    for cur_model in [ProductWholesale, ProductAmazon]:
+        latest_update, row_count = session.query(
+            func.max(cur_model.timestamp_updated), func.count(cur_model.id)
+        ).one()
+        values.extend([str(latest_update), str(row_count)])
+    values.append(constants_fingerprint)
+    return hashlib.md5("\x1f".join(values).encode("utf-8")).hexdigest()
+
+
+def get_cache_file(key, path=None):
+    return get_cache_dir(path) / f"data-{key}.arrow"
+
+
+def read_cached_table(key, path=None):
+    """Returns the memory-mapped Arrow table of the key or None."""
+
+    cache_file = get_cache_file(key, path)
+    if not cache_file.exists():
+        return None
+    return feather.read_table(str(cache_file), memory_map=True)
+
+
+def invalidate(path=None):
+    """Removes all cached frames. Does nothing if the cache is disabled."""
+
+    # a disabled cache has no directory, an empty path would be the working one
+    if not is_enabled(path):
+        return
+    cache_dir = get_cache_dir(path)
+    if not cache_dir.exists():
+        return
+    for cur_file in cache_dir.glob("data-*.arrow"):
+        cur_file.unlink()
+
+
+def write_cached_data(key, data, path=None):
+    """Replaces the cached frame with data."""
+
+    cache_dir = get_cache_dir(path)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cache_file = get_cache_file(key, path)
+    temporary_file = cache_dir / f"{cache_file.name}.{os.getpid()}.tmp"
+    feather.write_feather(
+        data.reset_index(drop=True), str(temporary_file), compression="uncompressed"
+    )
+    for cur_file in cache_dir.glob("data-*.arrow"):
+        if cur_file != cache_file:
+            cur_file.unlink()
+    # readers either see the old or the complete new file
+    os.replace(str(temporary_file), str(cache_file))
+    logging.info(f"Cached {len(data)} rows in {cache_file}")
@@ -0,0 +1,136 @@
+from sqlalchemy import create_engine, event, select, func, Table, Column, MetaData
+from sqlalchemy import String, TIMESTAMP
+from sqlalchemy.orm import sessionmaker
+from wholesale import settings
+from wholesale.db import data_loader
+from wholesale.db.models import Base, ProductWholesale, ProductAmazon
+from pathlib import Path
+import logging
+
+# An optional local SQLite copy of the product tables. If settings.LOCAL_MIRROR_PATH
+# is set, the updater syncs the copy after every stage that writes products and
+# data_loader.get_data() runs against the copy without any round trips to MySQL.
+
+mirrored_tables = [ProductWholesale.__table__, ProductAmazon.__table__]
+
+sync_state = Table(
+    "mirror_sync_state",
+    MetaData(),
+    Column("table_name", String(length=100), primary_key=True),
+    Column("watermark", TIMESTAMP),
+)
+
+mirror_engines = {}
+
+
+def is_enabled(path=None):
+    return bool(path or settings.LOCAL_MIRROR_PATH)
+
+
+def is_mirror_session(session):
+    return session.get_bind() in mirror_engines.values()
+
+
+def get_mirror_engine(path=None):
+    """Returns the engine of the SQLite mirror at path, creating the file if needed."""
+
+    if path is None:
+        path = settings.LOCAL_MIRROR_PATH
+    path = str(Path(path).expanduser())
+
+    if path not in mirror_engines:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        engine = create_engine(f"sqlite:///{path}")
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            # WAL lets readers like the UI work while a sync is writing
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+        Base.metadata.create_all(engine, tables=mirrored_tables)
+        sync_state.create(engine, checkfirst=True)
+        mirror_engines[path] = engine
+
+    return mirror_engines[path]
+
+
+def get_watermark(mirror_connection, table):
+    return mirror_connection.execute(
+        select([sync_state.c.watermark]).where(sync_state.c.table_name == table.name)
+    ).scalar()
+
+
+def set_watermark(mirror_connection, table, watermark):
+    mirror_connection.execute(
+        sync_state.delete().where(sync_state.c.table_name == table.name)
+    )
+    mirror_connection.execute(
+        sync_state.insert(), table_name=table.name, watermark=watermark
+    )
+
+
+def sync_table(connection, mirror_connection, table, rebuild, chunk_size):
+    if rebuild:
+        mirror_connection.execute(table.delete())
+        watermark = None
+    else:
+        watermark = get_watermark(mirror_connection, table)
+
+    # the timestamps only have a resolution of seconds, so the rows of the last
+    # second are copied again
+    query = select([table])
+    if watermark is not None:
+        query = query.where(table.c.timestamp_updated >= watermark)
+    new_watermark = connection.execute(
+        select([func.max(table.c.timestamp_updated)])
+    ).scalar()
+
+    result = connection.execution_options(stream_results=True).execute(query)
+    replace = table.insert().prefix_with("OR REPLACE")
+    copied = 0
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if len(rows) == 0:
+            break
+        mirror_connection.execute(replace, [dict(cur_row) for cur_row in rows])
+        copied = copied + len(rows)
+
+    if new_watermark is not None:
+        set_watermark(mirror_connection, table, new_watermark)
+    return copied
+
+
+def sync_mirror(session, path=None, rebuild=False, chunk_size=5000):
+    """
+    Copies all rows of the product tables that changed since the last sync into
+    the local mirror. With rebuild=True the mirror is copied from scratch, which
+    is only needed if rows were deleted in MySQL. Returns a dict
+    {table_name: copied_rows}.
+    """
+
+    mirror_engine = get_mirror_engine(path)
+    connection = session.connection()
+    result = {}
+    with mirror_engine.begin() as mirror_connection:
+        for cur_table in mirrored_tables:
+            result[cur_table.name] = sync_table(
+                connection, mirror_connection, cur_table, rebuild, chunk_size
+            )
+            logging.info(f"Copied {result[cur_table.name]} rows of {cur_table.name}")
+    return result
+
+
+def get_data(path=None, **kwargs):
+    """
+    Runs data_loader.get_data() against the local mirror. The keyword arguments
+    are the filters of data_loader.get_data().
+    """
+
+    session = sessionmaker(bind=get_mirror_engine(path))()
+    try:
+        return data_loader.get_data(session, **kwargs)
+    finally:
+        session.close()
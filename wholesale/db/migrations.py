@@ -0,0 +1,204 @@
+# Base.metadata.create_all only creates missing tables and never alters existing
+# ones, so every change to an existing table needs a migration here. Migrations
+# have to be idempotent, because fresh databases already get the current schema
+# from create_all. Run pending migrations with: python -m wholesale.db.migrations
+
+from collections import namedtuple
+from sqlalchemy import (
+    Table,
+    Column,
+    Integer,
+    String,
+    TIMESTAMP,
+    MetaData,
+    select,
+    func,
+    inspect,
+    text,
+    bindparam,
+)
+from sqlalchemy.schema import CreateColumn
+from wholesale.db.models import (
+    ProductWholesale,
+    ProductAmazon,
+    Opportunity,
+    wholesale_update_fields,
+    amazon_update_fields,
+    compute_content_hash,
+)
+from wholesale.db import profitability
+import logging
+
+Migration = namedtuple("Migration", ["version", "description", "apply"])
+
+metadata = MetaData()
+
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(length=200), nullable=False),
+    Column(
+        "timestamp_applied",
+        TIMESTAMP,
+        server_default=func.current_timestamp(),
+        nullable=False,
+    ),
+)
+
+
+def create_missing_indexes(connection, table):
+    """Creates all indexes of the table model that don't exist in the database."""
+
+    existing = {
+        cur_index["name"] for cur_index in inspect(connection).get_indexes(table.name)
+    }
+    for cur_index in table.indexes:
+        if cur_index.name not in existing:
+            logging.info(f"Creating index {cur_index.name}")
+            cur_index.create(connection)
+
+
+def add_product_indexes(connection):
+    # the unique indexes can't be created as long as there are duplicates, so only
+    # the oldest row is kept, as this is the one the updaters used to update
+    connection.execute(
+        text(
+            "DELETE newer FROM products_wholesale newer "
+            "JOIN products_wholesale older "
+            "ON newer.shop_name = older.shop_name AND newer.ean = older.ean "
+            "AND newer.id > older.id"
+        )
+    )
+    connection.execute(
+        text(
+            "DELETE newer FROM products_amazon newer "
+            "JOIN products_amazon older "
+            "ON newer.ean = older.ean AND newer.asin = older.asin "
+            "AND newer.id > older.id"
+        )
+    )
+    create_missing_indexes(connection, ProductWholesale.__table__)
+    create_missing_indexes(connection, ProductAmazon.__table__)
+
+
+def add_missing_column(connection, table, column):
+    existing = {
+        cur_column["name"] for cur_column in inspect(connection).get_columns(table.name)
+    }
+    if column.name not in existing:
+        logging.info(f"Adding column {table.name}.{column.name}")
+        column_definition = CreateColumn(column).compile(dialect=connection.dialect)
+        connection.execute(text(f"ALTER TABLE {table.name} ADD {column_definition}"))
+
+
+def backfill_content_hashes(connection, table, fields, chunk_size=5000):
+    query = select([table.c.id, *[table.c[cur_field] for cur_field in fields]])
+    rows = connection.execute(query).fetchall()
+    statement = (
+        table.update()
+        .where(table.c.id == bindparam("row_id"))
+        .values(
+            content_hash=bindparam("new_content_hash"),
+            # a backfill is not an update of the product
+            timestamp_updated=table.c.timestamp_updated,
+        )
+    )
+    for start in range(0, len(rows), chunk_size):
+        connection.execute(
+            statement,
+            [
+                {
+                    "row_id": cur_row.id,
+                    "new_content_hash": compute_content_hash(
+                        table, fields, dict(cur_row)
+                    ),
+                }
+                for cur_row in rows[start : start + chunk_size]
+            ],
+        )
+
+
+def add_content_hashes(connection):
+    for table, fields in [
+        (ProductWholesale.__table__, wholesale_update_fields),
+        (ProductAmazon.__table__, amazon_update_fields),
+    ]:
+        add_missing_column(connection, table, table.c.content_hash)
+        backfill_content_hashes(connection, table, fields)
+
+
+def add_timestamp_indexes(connection):
+    create_missing_indexes(connection, ProductWholesale.__table__)
+    create_missing_indexes(connection, ProductAmazon.__table__)
+
+
+def add_profitability_view(connection):
+    profitability.sync_fee_config(connection)
+    profitability.create_view(connection)
+    create_missing_indexes(connection, Opportunity.__table__)
+
+
+migrations = [
+    Migration(
+        version=1,
+        description="Add unique and secondary indexes to the product tables",
+        apply=add_product_indexes,
+    ),
+    Migration(
+        version=2,
+        description="Add content hashes to the product tables",
+        apply=add_content_hashes,
+    ),
+    Migration(
+        version=3,
+        description="Add timestamp_updated indexes to the product tables",
+        apply=add_timestamp_indexes,
+    ),
+    Migration(
+        version=4,
+        description="Add the profitability view and an index for the top roi by shop",
+        apply=add_profitability_view,
+    ),
+]
+
+
+def get_current_version(connection):
+    version = connection.execute(select([func.max(schema_version.c.version)])).scalar()
+    if version is None:
+        return 0
+    return version
+
+
+def migrate(engine):
+    """Applies all pending migrations in order. Returns the new schema version."""
+
+    schema_version.create(engine, checkfirst=True)
+
+    with engine.connect() as connection:
+        current_version = get_current_version(connection)
+        for cur_migration in migrations:
+            if cur_migration.version <= current_version:
+                continue
+            logging.info(
+                f"Applying migration {cur_migration.version}: "
+                f"{cur_migration.description}"
+            )
+            with connection.begin():
+                cur_migration.apply(connection)
+                connection.execute(
+                    schema_version.insert(),
+                    version=cur_migration.version,
+                    description=cur_migration.description,
+                )
+            current_version = cur_migration.version
+
+    return current_version
+
+
+if __name__ == "__main__":
+    from wholesale.db import get_engine
+
+    logging.basicConfig(level=logging.INFO)
+    version = migrate(get_engine())
+    logging.info(f"Database is at schema version {version}.")
@@ -1,13 +1,75 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Numeric, TIMESTAMP, Boolean
+from sqlalchemy import Column, Integer, String, Numeric, TIMESTAMP, Boolean, Index
+from sqlalchemy import BigInteger, DateTime, Float, DDL, event
 from sqlalchemy.sql import func
-from wholesale.db import engine
+from decimal import Decimal
+import hashlib
 
 Base = declarative_base()
 
+# these are the fields that the update() methods of the products may overwrite
+wholesale_update_fields = ["name", "is_available", "price_net", "age_restriction"]
+amazon_update_fields = [
+    "price",
+    "fees_fba",
+    "fees_closing",
+    "fees_total",
+    "fba_offers",
+    "offers",
+    "has_buy_box",
+    "review_count",
+    "rating",
+    "sales30",
+    "sales365",
+    "category_id",
+    "sales_rank",
+]
+
+# changes of these fields are recorded in the price history
+wholesale_history_fields = ["price_net"]
+amazon_history_fields = ["price", "fees_total", "sales_rank", "fba_offers", "offers"]
+
+
+def format_hash_value(column, value):
+    """
+    Formats a value the same way no matter if it comes from a feed or from the
+    database, e.g. 1.5 and Decimal("1.50") both become "1.50".
+    """
+
+    if value is None and column.default is not None and column.default.is_scalar:
+        value = column.default.arg
+    if value is None:
+        return ""
+    if isinstance(column.type, Boolean):
+        return "1" if value else "0"
+    if isinstance(column.type, Numeric):
+        exponent = Decimal(1).scaleb(-column.type.scale)
+        return format(Decimal(str(value)).quantize(exponent), "f")
+    return str(value)
+
+
+def compute_content_hash(table, fields, values):
+    """
+    Returns the md5 hex digest over the given fields. values can be a dict or
+    any object that has the fields as attributes.
+    """
+
+    if not isinstance(values, dict):
+        values = {cur_field: getattr(values, cur_field) for cur_field in fields}
+    content = "\x1f".join(
+        format_hash_value(table.c[cur_field], values.get(cur_field))
+        for cur_field in fields
+    )
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
 
 class ProductWholesale(Base):
     __tablename__ = "products_wholesale"
+    __table_args__ = (
+        Index("uq_products_wholesale_shop_name_ean", "shop_name", "ean", unique=True),
+        Index("ix_products_wholesale_ean", "ean"),
+        Index("ix_products_wholesale_timestamp_updated", "timestamp_updated"),
+    )
 
     id = Column(Integer, primary_key=True)
     shop_name = Column(String(length=100), nullable=False)
@@ -16,6 +78,7 @@ class ProductWholesale(Base):
     is_available = Column(Boolean)
     price_net = Column(Numeric(precision=8, scale=2), nullable=False)
     age_restriction = Column(Integer, nullable=False, default=0)
+    content_hash = Column(String(length=32))
     timestamp_created = Column(
         TIMESTAMP, server_default=func.current_timestamp(), nullable=False
     )
@@ -76,6 +139,12 @@ class ProductWholesaleItem(ProductWholesale, dict):
 
 class ProductAmazon(Base):
     __tablename__ = "products_amazon"
+    __table_args__ = (
+        # also serves all lookups by ean alone
+        Index("uq_products_amazon_ean_asin", "ean", "asin", unique=True),
+        Index("ix_products_amazon_asin", "asin"),
+        Index("ix_products_amazon_timestamp_updated", "timestamp_updated"),
+    )
 
     id = Column(Integer, primary_key=True)
     ean = Column(String(length=20), nullable=False)
@@ -93,6 +162,7 @@ class ProductAmazon(Base):
     sales365 = Column(Integer)
     category_id = Column(String(length=200))
     sales_rank = Column(Integer)
+    content_hash = Column(String(length=32))
     timestamp_created = Column(
         TIMESTAMP, server_default=func.current_timestamp(), nullable=False
     )
@@ -191,4 +261,201 @@ class ProductAmazon(Base):
         return self.__repr__()
 
 
-Base.metadata.create_all(engine)
+class PriceHistory(Base):
+    """
+    One row per changed field of a product. Wholesale rows have a shop_name,
+    Amazon rows an asin. New products get a row with an empty value_old.
+    """
+
+    __tablename__ = "price_history"
+    __table_args__ = (
+        Index("ix_price_history_ean_field_recorded_at", "ean", "field", "recorded_at"),
+        Index("ix_price_history_field_recorded_at", "field", "recorded_at"),
+    )
+
+    # MySQL requires the partitioning column in the primary key
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    recorded_at = Column(
+        DateTime,
+        primary_key=True,
+        server_default=func.current_timestamp(),
+        nullable=False,
+    )
+    shop_name = Column(String(length=100))
+    ean = Column(String(length=20), nullable=False)
+    asin = Column(String(length=20))
+    field = Column(String(length=20), nullable=False)
+    value_old = Column(Numeric(precision=12, scale=2))
+    value_new = Column(Numeric(precision=12, scale=2))
+
+    def __repr__(self):
+        return (
+            f"PriceHistory("
+            f"id={self.id}, "
+            f"recorded_at={self.recorded_at}, "
+            f"shop_name='{self.shop_name}', "
+            f"ean='{self.ean}', "
+            f"asin='{self.asin}', "
+            f"field='{self.field}', "
+            f"value_old={self.value_old}, "
+            f"value_new={self.value_new})"
+        )
+
+    def __str__(self):
+        return self.__repr__()
+
+
+# the history is partitioned by month, see wholesale.db.price_history. All rows
+# start in the catch-all partition pmax until the monthly partitions are added.
+event.listen(
+    PriceHistory.__table__,
+    "after_create",
+    DDL(
+        "ALTER TABLE price_history PARTITION BY RANGE COLUMNS(recorded_at) "
+        "(PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+    ).execute_if(dialect="mysql"),
+)
+
+
+class Opportunity(Base):
+    """
+    The materialized result of data_loader.get_data(), one row per pair of a
+    wholesale and an Amazon product. See wholesale.db.opportunities.
+    """
+
+    __tablename__ = "opportunities"
+    __table_args__ = (
+        # also serves all lookups by shop_name alone
+        Index(
+            "uq_opportunities_shop_name_ean_asin",
+            "shop_name",
+            "ean",
+            "asin",
+            unique=True,
+        ),
+        Index("ix_opportunities_profit", "profit"),
+        Index("ix_opportunities_roi", "roi"),
+        # the best products of a shop
+        Index("ix_opportunities_shop_name_roi", "shop_name", "roi"),
+    )
+
+    # precision 53 makes the metrics doubles like the floats of pandas, MySQL
+    # stores a plain Float as a single precision FLOAT
+    id = Column(Integer, primary_key=True)
+    shop_name = Column(String(length=100), nullable=False)
+    name = Column(String(length=500))
+    ean = Column(String(length=20), nullable=False)
+    asin = Column(String(length=20), nullable=False)
+    is_available = Column(Boolean)
+    age_restriction = Column(Integer)
+    price_shop = Column(Float(precision=53))
+    price_amazon = Column(Float(precision=53))
+    break_even = Column(Float(precision=53))
+    safety_percent = Column(Float(precision=53))
+    profit = Column(Float(precision=53))
+    roi = Column(Float(precision=53))
+    margin = Column(Float(precision=53))
+    sales30 = Column(Integer)
+    sales365 = Column(Integer)
+    offers = Column(Integer)
+    fba_offers = Column(Integer)
+    has_buy_box = Column(Boolean)
+    review_count = Column(Integer)
+    rating = Column(Float(precision=53))
+    fees_percentage = Column(Float(precision=53))
+    fees_fba_net = Column(Float(precision=53))
+    fees_closing_net = Column(Float(precision=53))
+    fees_total = Column(Float(precision=53))
+    sales_rank = Column(Integer)
+    category_id = Column(String(length=200))
+    last_updated = Column(DateTime)
+
+
+class AsinMapping(Base):
+    """
+    The cached GetMatchingProductForId results, see wholesale.amazon.asin_cache.
+    An EAN has one row per matched ASIN or a single row without an ASIN.
+    """
+
+    __tablename__ = "asin_mappings"
+    __table_args__ = (Index("ix_asin_mappings_ean", "ean"),)
+
+    id = Column(Integer, primary_key=True)
+    ean = Column(String(length=20), nullable=False)
+    asin = Column(String(length=20))
+    category_id = Column(String(length=200))
+    # match, bundle_only or no_match
+    status = Column(String(length=20), nullable=False)
+    timestamp_checked = Column(DateTime, nullable=False)
+
+
+class FeeEstimate(Base):
+    """
+    The cached GetMyFeesEstimate results of an ASIN in a price band, see
+    wholesale.amazon.fee_cache.
+    """
+
+    __tablename__ = "fee_estimates"
+    __table_args__ = (
+        Index(
+            "ix_fee_estimates_asin_marketplace_id_price_band",
+            "asin",
+            "marketplace_id",
+            "price_band",
+            unique=True,
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    asin = Column(String(length=20), nullable=False)
+    marketplace_id = Column(String(length=20), nullable=False)
+    # the price divided by the band width, rounded down
+    price_band = Column(Integer, nullable=False)
+    fees_fba = Column(Numeric(precision=8, scale=2))
+    fees_closing = Column(Numeric(precision=8, scale=2))
+    fees_total = Column(Numeric(precision=8, scale=2), nullable=False)
+    timestamp_checked = Column(DateTime, nullable=False)
+
+
+class FeeConfig(Base):
+    """
+    The single row with the fee constants of data_loader, which the profitability
+    view computes with. See wholesale.db.profitability.
+    """
+
+    __tablename__ = "fee_config"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    # precision 53 makes them doubles like the floats of pandas
+    fba_de_fee = Column(Float(precision=53), nullable=False)
+    default_shipping = Column(Float(precision=53), nullable=False)
+    default_percent = Column(Float(precision=53), nullable=False)
+    vat_tax = Column(Float(precision=53), nullable=False)
+    adult_check_fee = Column(Float(precision=53), nullable=False)
+
+
+class OpportunityState(Base):
+    """The single row that tells up to which product update opportunities is fresh."""
+
+    __tablename__ = "opportunities_state"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    watermark = Column(DateTime)
+    constants_fingerprint = Column(String(length=32), nullable=False)
+    timestamp_refreshed = Column(DateTime, nullable=False)
+
+
+@event.listens_for(ProductWholesale, "before_insert", propagate=True)
+@event.listens_for(ProductWholesale, "before_update", propagate=True)
+def set_wholesale_content_hash(mapper, connection, target):
+    target.content_hash = compute_content_hash(
+        ProductWholesale.__table__, wholesale_update_fields, target
+    )
+
+
+@event.listens_for(ProductAmazon, "before_insert")
+@event.listens_for(ProductAmazon, "before_update")
+def set_amazon_content_hash(mapper, connection, target):
+    target.content_hash = compute_content_hash(
+        ProductAmazon.__table__, amazon_update_fields, target
+    )
@@ -0,0 +1,219 @@
+from datetime import datetime
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, and_, tuple_, exists
+from wholesale.db import data_loader
+from wholesale.db.models import (
+    ProductWholesale,
+    ProductAmazon,
+    Opportunity,
+    OpportunityState,
+)
+
+# The opportunities table holds the output of data_loader.get_data(). A refresh
+# only recomputes the rows whose wholesale or Amazon product was updated since
+# the stored watermark. If the fee constants of data_loader change, the whole
+# table is recomputed. Rows whose products left the join, e.g. because a product
+# was deleted, are deleted by every refresh.
+
+state_id = 1
+
+
+def get_latest_update(session):
+    """Returns the newest timestamp_updated of both product tables."""
+
+    timestamps = [
+        session.query(func.max(ProductWholesale.timestamp_updated)).scalar(),
+        session.query(func.max(ProductAmazon.timestamp_updated)).scalar(),
+    ]
+    timestamps = [cur_timestamp for cur_timestamp in timestamps if cur_timestamp]
+    if len(timestamps) == 0:
+        return None
+    return max(timestamps)
+
+
+def get_state(session):
+    return session.query(OpportunityState).get(state_id)
+
+
+def is_fresh(session):
+    """
+    Tells if the opportunities table reflects all product updates. The watermark
+    only has a resolution of seconds, so an update in the same second as the
+    last refresh is only noticed by the next refresh.
+    """
+
+    connection = session.connection()
+    if not connection.dialect.has_table(connection, OpportunityState.__tablename__):
+        return False
+
+    state = get_state(session)
+    if (
+        state is None
+        or state.constants_fingerprint != data_loader.get_constants_fingerprint()
+    ):
+        return False
+    latest_update = get_latest_update(session)
+    return latest_update is None or (
+        state.watermark is not None and latest_update <= state.watermark
+    )
+
+
+def to_rows(df):
+    # the database can't store infinite values, e.g. the roi of a free product
+    df = df.replace([np.inf, -np.inf], np.nan)
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict("records")
+
+
+def delete_opportunities(session, keys, chunk_size=1000):
+    table = Opportunity.__table__
+    for start in range(0, len(keys), chunk_size):
+        session.connection().execute(
+            table.delete().where(
+                tuple_(table.c.shop_name, table.c.ean, table.c.asin).in_(
+                    keys[start : start + chunk_size]
+                )
+            )
+        )
+
+
+def delete_stale_opportunities(session):
+    """Deletes the opportunities without a joined pair of products."""
+
+    table = Opportunity.__table__
+    wholesale = ProductWholesale.__table__
+    amazon = ProductAmazon.__table__
+    is_joined = exists().where(
+        and_(
+            wholesale.c.shop_name == table.c.shop_name,
+            wholesale.c.ean == table.c.ean,
+            amazon.c.ean == table.c.ean,
+            amazon.c.asin == table.c.asin,
+        )
+    )
+    return session.connection().execute(table.delete().where(~is_joined)).rowcount
+
+
+def refresh_opportunities(session, rebuild=False, chunk_size=5000):
+    """
+    Recomputes the opportunities of all products that were updated since the last
+    refresh. With rebuild=True, or if the fee constants changed, everything is
+    recomputed. The session is not committed. Returns the number of written rows.
+    """
+
+    state = get_state(session)
+    fingerprint = data_loader.get_constants_fingerprint()
+    if state is None:
+        state = OpportunityState(
+            id=state_id,
+            constants_fingerprint=fingerprint,
+            timestamp_refreshed=datetime.now(),
+        )
+        session.add(state)
+    if rebuild or state.constants_fingerprint != fingerprint:
+        state.watermark = None
+    watermark = state.watermark
+    new_watermark = get_latest_update(session)
+
+    # the rows of the last second are computed again, as the timestamps only
+    # have a resolution of seconds
+    raw_data = data_loader.get_raw_data_from_db(session, updated_since=watermark)
+    data = data_loader.compute_data(raw_data)
+
+    table = Opportunity.__table__
+    connection = session.connection()
+    if watermark is None:
+        connection.execute(table.delete())
+    else:
+        delete_opportunities(
+            session, list(data[["shop_name", "ean", "asin"]].itertuples(index=False))
+        )
+        stale_count = delete_stale_opportunities(session)
+        if stale_count > 0:
+            logging.info(f"Deleted {stale_count} stale opportunities.")
+    rows = to_rows(data)
+    for start in range(0, len(rows), chunk_size):
+        connection.execute(table.insert(), rows[start : start + chunk_size])
+
+    state.watermark = new_watermark
+    state.constants_fingerprint = fingerprint
+    state.timestamp_refreshed = datetime.now()
+    logging.info(f"Refreshed {len(rows)} opportunities.")
+    return len(rows)
+
+
+def get_opportunities_query(
+    session,
+    shops=None,
+    min_profit=None,
+    min_roi=None,
+    updated_since=None,
+    columns=None,
+):
+    """Returns the query of the opportunities with the filters of get_data()."""
+
+    if columns is None:
+        columns = data_loader.data_columns
+    query = session.query(*[getattr(Opportunity, cur_column) for cur_column in columns])
+    if shops is not None:
+        query = query.filter(Opportunity.shop_name.in_(shops))
+    if min_profit is not None:
+        query = query.filter(Opportunity.profit > min_profit)
+    if min_roi is not None:
+        query = query.filter(Opportunity.roi > min_roi)
+    if updated_since is not None:
+        query = query.filter(Opportunity.last_updated >= updated_since)
+    return query
+
+
+def read_opportunities(
+    session,
+    shops=None,
+    min_profit=None,
+    min_roi=None,
+    updated_since=None,
+    columns=None,
+):
+    query = get_opportunities_query(
+        session,
+        shops=shops,
+        min_profit=min_profit,
+        min_roi=min_roi,
+        updated_since=updated_since,
+        columns=columns,
+    )
+    return pd.read_sql(query.statement, session.connection())
+
+
+def get_top_opportunities_query(
+    session,
+    k,
+    by="roi",
+    shops=None,
+    min_sales30=None,
+    max_offers=None,
+    columns=None,
+):
+    """
+    Returns the query of the k opportunities with the highest value of by. With
+    by="roi" or by="profit", MySQL reads them in the order of the index and stops
+    after k rows.
+    """
+
+    order_column = getattr(Opportunity, by)
+    query = get_opportunities_query(session, shops=shops, columns=columns)
+    if min_sales30 is not None:
+        query = query.filter(Opportunity.sales30 >= min_sales30)
+    if max_offers is not None:
+        query = query.filter(Opportunity.offers <= max_offers)
+    return query.filter(order_column.isnot(None)).order_by(order_column.desc()).limit(k)
+
+
+if __name__ == "__main__":
+    from wholesale.db import session_scope
+
+    logging.basicConfig(level=logging.INFO)
+    with session_scope() as session:
+        refresh_opportunities(session)
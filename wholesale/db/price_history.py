@@ -0,0 +1,231 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import select, and_, func, literal, text, union_all
+from sqlalchemy.orm import aliased
+from wholesale.db.models import (
+    PriceHistory,
+    ProductWholesale,
+    ProductAmazon,
+    wholesale_history_fields,
+    amazon_history_fields,
+    format_hash_value,
+)
+import logging
+
+# The price history is append-only and only gets a row when a tracked field
+# actually changes. It is partitioned by month on recorded_at, so queries over a
+# time window only read the partitions of that window and old months can be
+# dropped as a whole.
+
+
+def make_wholesale_history_statement(staging, shop_name):
+    """
+    Records the tracked fields of all staging rows that are new or differ from the
+    stored product. Has to run before the staging rows are merged.
+    """
+
+    wholesale = ProductWholesale.__table__
+    joined = staging.outerjoin(
+        wholesale,
+        and_(wholesale.c.shop_name == shop_name, wholesale.c.ean == staging.c.ean),
+    )
+    selects = []
+    for cur_field in wholesale_history_fields:
+        selects.append(
+            select(
+                [
+                    literal(shop_name),
+                    staging.c.ean,
+                    literal(cur_field),
+                    wholesale.c[cur_field],
+                    staging.c[cur_field],
+                ]
+            )
+            .select_from(joined)
+            .where(staging.c[cur_field].isnot(None))
+            .where(staging.c[cur_field].is_distinct_from(wholesale.c[cur_field]))
+        )
+    return PriceHistory.__table__.insert().from_select(
+        ["shop_name", "ean", "field", "value_old", "value_new"], union_all(*selects)
+    )
+
+
+def get_amazon_history_rows(ean, asin, old_values, new_values):
+    """
+    Returns the history rows for the tracked fields that differ between the dicts
+    old_values and new_values. old_values is None for a new product.
+    """
+
+    table = ProductAmazon.__table__
+    rows = []
+    for cur_field in amazon_history_fields:
+        new_value = new_values.get(cur_field)
+        old_value = None if old_values is None else old_values.get(cur_field)
+        if new_value is None:
+            continue
+        if format_hash_value(table.c[cur_field], old_value) == format_hash_value(
+            table.c[cur_field], new_value
+        ):
+            continue
+        rows.append(
+            {
+                "ean": ean,
+                "asin": asin,
+                "field": cur_field,
+                "value_old": old_value,
+                "value_new": new_value,
+            }
+        )
+    return rows
+
+
+def write_history_rows(session, rows):
+    if len(rows) > 0:
+        session.connection().execute(PriceHistory.__table__.insert(), rows)
+
+
+def get_price_series(session, ean, field="price", since=None):
+    """
+    Returns the recorded values of the field for the EAN, oldest first. Amazon
+    fields have one series per asin, wholesale fields one per shop_name.
+    """
+
+    query = session.query(
+        PriceHistory.recorded_at,
+        PriceHistory.shop_name,
+        PriceHistory.asin,
+        PriceHistory.value_new.label("value"),
+    ).filter(PriceHistory.ean == ean, PriceHistory.field == field)
+    if since is not None:
+        query = query.filter(PriceHistory.recorded_at >= since)
+    return query.order_by(PriceHistory.recorded_at, PriceHistory.id).all()
+
+
+def get_price_drops(session, min_drop_percent, field="price", since=None):
+    """
+    Returns all products whose field dropped by at least min_drop_percent since
+    since, which defaults to one week ago. The value before the first change in
+    the window, or the first value of products that are new, is compared with the
+    value after the last change. Only the partitions of the window are read.
+    """
+
+    if since is None:
+        since = datetime.now() - timedelta(days=7)
+
+    window = (
+        select(
+            [
+                func.min(PriceHistory.id).label("first_id"),
+                func.max(PriceHistory.id).label("last_id"),
+            ]
+        )
+        .where(PriceHistory.field == field)
+        .where(PriceHistory.recorded_at >= since)
+        .group_by(PriceHistory.shop_name, PriceHistory.ean, PriceHistory.asin)
+        .alias("window")
+    )
+    first = aliased(PriceHistory, name="first")
+    last = aliased(PriceHistory, name="last")
+    factor = Decimal(1) - Decimal(str(min_drop_percent)) / 100
+    value_before = func.coalesce(first.value_old, first.value_new)
+    return (
+        session.query(
+            first.shop_name,
+            first.ean,
+            first.asin,
+            value_before.label("value_before"),
+            last.value_new.label("value_now"),
+        )
+        .join(
+            window,
+            and_(first.id == window.c.first_id, first.recorded_at >= since),
+        )
+        .join(last, and_(last.id == window.c.last_id, last.recorded_at >= since))
+        .filter(value_before > 0)
+        .filter(last.value_new <= value_before * factor)
+        .all()
+    )
+
+
+def get_partition_names(connection):
+    query = text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name "
+        "AND PARTITION_NAME IS NOT NULL"
+    )
+    return [
+        cur_row[0]
+        for cur_row in connection.execute(query, table_name=PriceHistory.__tablename__)
+    ]
+
+
+def get_month_start(day, months_later=0):
+    month_index = day.year * 12 + day.month - 1 + months_later
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def get_partition_name(month_start):
+    return f"p{month_start.year}{month_start.month:02d}"
+
+
+def ensure_partitions(engine, months_ahead=2):
+    """
+    Splits monthly partitions off the catch-all partition up to months_ahead
+    months into the future. Only months after the newest existing partition are
+    added. Does nothing if the database is not MySQL.
+    """
+
+    if engine.dialect.name != "mysql":
+        return []
+
+    with engine.connect() as connection:
+        existing = set(get_partition_names(connection))
+        monthly = sorted(cur_name for cur_name in existing if cur_name != "pmax")
+        this_month = get_month_start(date.today())
+        new_partitions = []
+        for cur_offset in range(months_ahead + 1):
+            month_start = get_month_start(this_month, cur_offset)
+            name = get_partition_name(month_start)
+            if name in existing or (len(monthly) > 0 and name < monthly[-1]):
+                continue
+            new_partitions.append((name, get_month_start(month_start, 1)))
+        if len(new_partitions) == 0:
+            return []
+
+        logging.info(f"Adding {len(new_partitions)} partitions to price_history")
+        definitions = [
+            f"PARTITION {cur_name} VALUES LESS THAN ('{cur_end.isoformat()}')"
+            for cur_name, cur_end in new_partitions
+        ]
+        definitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+        # ALTER TABLE commits implicitly, so it runs on its own connection
+        connection.execute(
+            text(
+                "ALTER TABLE price_history REORGANIZE PARTITION pmax INTO "
+                f"({', '.join(definitions)})"
+            )
+        )
+        return [cur_name for cur_name, cur_end in new_partitions]
+
+
+def drop_partitions_before(engine, month_start):
+    """Drops the history of all months before month_start."""
+
+    if engine.dialect.name != "mysql":
+        return []
+
+    with engine.connect() as connection:
+        old_partitions = [
+            cur_name
+            for cur_name in get_partition_names(connection)
+            if cur_name != "pmax" and cur_name < get_partition_name(month_start)
+        ]
+        if len(old_partitions) > 0:
+            logging.info(f"Dropping price_history partitions {old_partitions}")
+            connection.execute(
+                text(
+                    "ALTER TABLE price_history DROP PARTITION "
+                    f"{', '.join(old_partitions)}"
+                )
+            )
+        return old_partitions
@@ -0,0 +1,211 @@
+from sqlalchemy import Table, Column, MetaData, select, case, func, text
+from sqlalchemy import literal_column
+from sqlalchemy import String, Integer, Boolean, Float, DateTime
+from wholesale.db import data_loader, opportunities
+from wholesale.db.models import ProductWholesale, ProductAmazon, FeeConfig, Opportunity
+
+# The profitability view computes the metrics of data_loader.get_data() inside
+# the database, with the fee constants of the fee_config table. sync_fee_config()
+# copies the constants of data_loader into that table, so both stay the same.
+# A view over a join can't be indexed, so the indexed reads of the metrics are
+# served by the opportunities table, e.g. ix_opportunities_shop_name_roi. The view
+# is created by migration 4.
+
+view_name = "profitability"
+fee_config_id = 1
+
+# describes the view for queries, it is not part of Base.metadata, so create_all
+# never creates it as a table
+metadata = MetaData()
+
+profitability = Table(
+    view_name,
+    metadata,
+    Column("shop_name", String(length=100)),
+    Column("name", String(length=500)),
+    Column("ean", String(length=20)),
+    Column("asin", String(length=20)),
+    Column("is_available", Boolean),
+    Column("age_restriction", Integer),
+    Column("price_shop", Float),
+    Column("price_amazon", Float),
+    Column("break_even", Float),
+    Column("safety_percent", Float),
+    Column("profit", Float),
+    Column("roi", Float),
+    Column("margin", Float),
+    Column("sales30", Integer),
+    Column("sales365", Integer),
+    Column("offers", Integer),
+    Column("fba_offers", Integer),
+    Column("has_buy_box", Boolean),
+    Column("review_count", Integer),
+    Column("rating", Float),
+    Column("fees_percentage", Float),
+    Column("fees_fba_net", Float),
+    Column("fees_closing_net", Float),
+    Column("fees_total", Float),
+    Column("sales_rank", Integer),
+    Column("category_id", String(length=200)),
+    Column("last_updated", DateTime),
+)
+
+
+def sync_fee_config(connection):
+    """Writes the fee constants of data_loader into the fee_config table."""
+
+    table = FeeConfig.__table__
+    table.create(connection, checkfirst=True)
+    connection.execute(table.delete())
+    connection.execute(
+        table.insert(), id=fee_config_id, **data_loader.get_fee_constants()
+    )
+
+
+def round_half_even(value, digits):
+    """
+    Rounds like numpy.round(). The ROUND() of MySQL rounds exact values half away
+    from zero, so ties like 0.125 would round differently than in data_loader.
+    """
+
+    scale = 10**digits
+    scaled = value * scale
+    lower = func.floor(scaled)
+    rounded = case(
+        [(scaled - lower > 0.5, lower + 1), (scaled - lower < 0.5, lower)],
+        else_=lower + func.abs(func.mod(lower, 2)),
+    )
+    return rounded / scale
+
+
+def get_view_query():
+    """Returns the SELECT of the view, the formulas are the ones of data_loader."""
+
+    wholesale = ProductWholesale.__table__
+    amazon = ProductAmazon.__table__
+    config = FeeConfig.__table__
+
+    tax = 1 + config.c.vat_tax
+    age_fee = case(
+        [(wholesale.c.age_restriction < 18, 0)], else_=config.c.adult_check_fee
+    )
+    # the Numeric columns are multiplied by a DOUBLE literal, so the ratio is a
+    # double like the float64 of data_loader and not an exact DECIMAL
+    fees_percentage = round_half_even(
+        (amazon.c.fees_total - amazon.c.fees_fba - amazon.c.fees_closing)
+        * literal_column("1e0")
+        / amazon.c.price,
+        2,
+    )
+    fees_total = (
+        func.coalesce(
+            amazon.c.fees_total,
+            amazon.c.price * config.c.default_percent + config.c.default_shipping,
+        )
+        + age_fee
+        + config.c.fba_de_fee
+    ) * tax
+    price_shop = wholesale.c.price_net * tax
+    profit = amazon.c.price - fees_total - price_shop
+    break_even = (
+        tax
+        / (1 - fees_percentage * tax)
+        * (
+            wholesale.c.price_net
+            + amazon.c.fees_closing
+            + amazon.c.fees_fba
+            + age_fee
+            + config.c.fba_de_fee
+        )
+    )
+    last_updated = case(
+        [
+            (
+                amazon.c.timestamp_updated > wholesale.c.timestamp_updated,
+                amazon.c.timestamp_updated,
+            )
+        ],
+        else_=wholesale.c.timestamp_updated,
+    )
+
+    columns = {
+        "shop_name": wholesale.c.shop_name,
+        "name": wholesale.c.name,
+        "ean": amazon.c.ean,
+        "asin": amazon.c.asin,
+        "is_available": wholesale.c.is_available,
+        "age_restriction": wholesale.c.age_restriction,
+        "price_shop": price_shop,
+        "price_amazon": amazon.c.price,
+        "break_even": break_even,
+        "safety_percent": (amazon.c.price - break_even) / amazon.c.price,
+        "profit": profit,
+        "roi": profit / price_shop,
+        "margin": profit / amazon.c.price,
+        "sales30": amazon.c.sales30,
+        "sales365": amazon.c.sales365,
+        "offers": amazon.c.offers,
+        "fba_offers": amazon.c.fba_offers,
+        "has_buy_box": amazon.c.has_buy_box,
+        "review_count": amazon.c.review_count,
+        "rating": amazon.c.rating,
+        "fees_percentage": fees_percentage,
+        "fees_fba_net": amazon.c.fees_fba,
+        "fees_closing_net": amazon.c.fees_closing,
+        "fees_total": fees_total,
+        "sales_rank": amazon.c.sales_rank,
+        "category_id": amazon.c.category_id,
+        "last_updated": last_updated,
+    }
+    return select(
+        [
+            columns[cur_column].label(cur_column)
+            for cur_column in data_loader.data_columns
+        ]
+    ).select_from(
+        wholesale.join(amazon, wholesale.c.ean == amazon.c.ean).join(
+            config, config.c.id == fee_config_id
+        )
+    )
+
+
+def create_view(connection):
+    """(Re)creates the profitability view."""
+
+    query = get_view_query().compile(
+        dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+    )
+    connection.execute(text(f"DROP VIEW IF EXISTS {view_name}"))
+    connection.execute(text(f"CREATE VIEW {view_name} AS {query}"))
+
+
+def get_top_by_roi_query(session, shop_name, limit=10, columns=None):
+    """
+    Returns the query of the limit products of the shop with the highest roi. If
+    the opportunities table is fresh, the query reads it through
+    ix_opportunities_shop_name_roi. Otherwise it sorts the roi that the view
+    computes, which is a full scan of the products of the shop.
+    """
+
+    if columns is None:
+        columns = data_loader.data_columns
+    if opportunities.is_fresh(session):
+        source = Opportunity.__table__
+    else:
+        source = profitability
+    return (
+        session.query(*[source.c[cur_column] for cur_column in columns])
+        .filter(source.c.shop_name == shop_name)
+        .filter(source.c.roi.isnot(None))
+        .order_by(source.c.roi.desc())
+        .limit(limit)
+    )
+
+
+if __name__ == "__main__":
+    from wholesale.db import get_engine
+
+    # run after changing the fee constants of data_loader
+    with get_engine().begin() as connection:
+        sync_fee_config(connection)
+        create_view(connection)
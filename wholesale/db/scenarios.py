@@ -0,0 +1,130 @@
+from collections import namedtuple
+import itertools
+import numpy as np
+import pandas as pd
+from wholesale.db import data_loader
+
+# What-if scenarios on the output of data_loader.get_data(). A scenario changes
+# the Amazon price, the wholesale price, the referral percentage or the VAT, and
+# all scenarios are computed for all products at once as arrays of the shape
+# (scenarios, products).
+#
+# The fees of a product are split into a referral fee, which is a percentage of
+# the Amazon price, and a fixed part. The percentage is fees_percentage, or
+# default_percent for products whose fees were estimated. The fixed part is the
+# rest of the fees, so the scenario without changes gives the profit, roi and
+# margin of get_data(). Its break_even is the Amazon price at which the profit
+# is exactly zero, which differs slightly from the one of get_data(), because
+# that uses the rounded fees_percentage for the fixed fees as well.
+
+# the parameters of a scenario and the values that change nothing. A referral
+# percent of NaN keeps the percentage of every product.
+scenario_defaults = {
+    "price_amazon_change": 0.0,
+    "price_shop_change": 0.0,
+    "referral_percent": np.nan,
+    "vat_tax": data_loader.vat_tax,
+}
+
+ScenarioResult = namedtuple(
+    "ScenarioResult",
+    [
+        "scenarios",
+        "profit",
+        "roi",
+        "margin",
+        "break_even",
+        "safety_percent",
+        "max_buy_price",
+    ],
+)
+
+
+def make_scenarios(**grid):
+    """
+    Returns a dataframe with one scenario per row for every combination of the
+    given values, e.g. make_scenarios(price_amazon_change=[-0.1, 0], vat_tax=[0.19])
+    gives two scenarios. The changes are relative, -0.1 lowers a price by 10%.
+    """
+
+    unknown = set(grid) - set(scenario_defaults)
+    if unknown:
+        raise ValueError(f"Unknown scenario parameters: {sorted(unknown)}")
+    values = [
+        grid.get(cur_parameter, [cur_default])
+        for cur_parameter, cur_default in scenario_defaults.items()
+    ]
+    return pd.DataFrame(
+        list(itertools.product(*values)), columns=list(scenario_defaults), dtype=float
+    )
+
+
+def get_product_arrays(data):
+    """Takes the taxes of get_data() off and splits the fees."""
+
+    tax = 1 + data_loader.vat_tax
+    price_amazon = data["price_amazon"].to_numpy(dtype="float64")
+    referral_percent = data["fees_percentage"].to_numpy(dtype="float64")
+    referral_percent = np.where(
+        np.isnan(referral_percent), data_loader.default_percent, referral_percent
+    )
+    # includes the adult check and FBA DE fees, which don't depend on the price
+    with np.errstate(invalid="ignore"):
+        fixed_fees = data["fees_total"].to_numpy(dtype="float64") / tax
+        fixed_fees = fixed_fees - referral_percent * price_amazon
+    return {
+        "price_amazon": price_amazon,
+        "price_shop_net": data["price_shop"].to_numpy(dtype="float64") / tax,
+        "referral_percent": referral_percent,
+        "fixed_fees": fixed_fees,
+    }
+
+
+def compute_scenarios(data, scenarios, target_roi=0.0):
+    """
+    Computes all scenarios for all products of data, a frame of get_data(). Every
+    field of the result but scenarios is an array of the shape (scenarios,
+    products), with the products in the order of data. max_buy_price is the
+    highest net wholesale price that still reaches target_roi.
+
+    The result needs 6 * 8 bytes per scenario and product, so large grids of the
+    whole catalog should be computed on chunks of data.
+    """
+
+    products = get_product_arrays(data)
+
+    def get_column(parameter):
+        return scenarios[parameter].to_numpy(dtype="float64")[:, np.newaxis]
+
+    tax = 1 + get_column("vat_tax")
+    price_amazon = products["price_amazon"] * (1 + get_column("price_amazon_change"))
+    price_shop = products["price_shop_net"] * (1 + get_column("price_shop_change"))
+    referral_percent = get_column("referral_percent")
+    referral_percent = np.where(
+        np.isnan(referral_percent), products["referral_percent"], referral_percent
+    )
+    fixed_fees = products["fixed_fees"]
+
+    # free products and products without a price give inf and NaN like get_data()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fees_total = (fixed_fees + referral_percent * price_amazon) * tax
+        profit = price_amazon - fees_total - price_shop * tax
+        break_even = tax * (fixed_fees + price_shop) / (1 - referral_percent * tax)
+        return ScenarioResult(
+            scenarios=scenarios,
+            profit=profit,
+            roi=profit / (price_shop * tax),
+            margin=profit / price_amazon,
+            break_even=break_even,
+            safety_percent=(price_amazon - break_even) / price_amazon,
+            max_buy_price=(price_amazon - fees_total) / ((1 + target_roi) * tax),
+        )
+
+
+def get_metric_frame(result, metric, index=None):
+    """
+    Returns one metric of a ScenarioResult as a dataframe with one row per product
+    and one column per scenario, e.g. the break-even curves of all products.
+    """
+
+    return pd.DataFrame(getattr(result, metric).T, index=index)
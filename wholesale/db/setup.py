@@ -1,12 +1,101 @@
+from contextlib import contextmanager
+import time
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from wholesale.settings import DATABASE_MYSQL
+from sqlalchemy.orm import sessionmaker, Session as BaseSession
+from sqlalchemy.pool import QueuePool
+from wholesale import settings
+from wholesale.utils import metrics
 
-connection_url = (
-    f"mysql+pymysql://{DATABASE_MYSQL['USER']}:"
-    f"{DATABASE_MYSQL['PASSWORD']}@{DATABASE_MYSQL['HOST']}/"
-    f"{DATABASE_MYSQL['DBNAME']}"
-)
+_engine = None
 
-engine = create_engine(connection_url)
-Session = sessionmaker(bind=engine)
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long a checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe("db.pool.checkout_wait", time.perf_counter() - start)
+
+
+def get_connection_url():
+    database = settings.DATABASE_MYSQL
+    return (
+        f"mysql+pymysql://{database['USER']}:"
+        f"{database['PASSWORD']}@{database['HOST']}/"
+        f"{database['DBNAME']}"
+    )
+
+
+def get_engine():
+    """Creates the engine and the missing tables on first use."""
+
+    global _engine
+    if _engine is None:
+        pool = settings.DATABASE_POOL
+        _engine = create_engine(
+            get_connection_url(),
+            poolclass=TimedQueuePool,
+            pool_size=pool["SIZE"],
+            max_overflow=pool["MAX_OVERFLOW"],
+            pool_timeout=pool["TIMEOUT"],
+            pool_recycle=pool["RECYCLE"],
+            pool_pre_ping=pool["PRE_PING"],
+        )
+
+        # imported here, because the models import this package
+        from wholesale.db.models import Base
+
+        Base.metadata.create_all(_engine)
+    return _engine
+
+
+def get_pool_status():
+    """
+    Returns the utilization of the connection pool together with the checkout
+    wait times as a dict. Nothing is reported before the engine exists.
+    """
+
+    if _engine is None:
+        return {}
+
+    pool = _engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "checkout_wait": metrics.get_timer("db.pool.checkout_wait"),
+    }
+
+
+class LazySession(BaseSession):
+    """A session that binds to the engine only when it needs a connection."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.bind is None:
+            self.bind = get_engine()
+        return super().get_bind(mapper, clause)
+
+
+Session = sessionmaker(class_=LazySession)
+
+
+@contextmanager
+def session_scope():
+    """
+    Provides a session that is committed if the block succeeds, rolled back if
+    it raises and closed in any case.
+    """
+
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -0,0 +1,151 @@
+from collections import namedtuple
+import logging
+from sqlalchemy import or_
+from wholesale.db.models import ProductWholesale
+from wholesale.db.bulk_upsert import upsert_products_wholesale, product_to_row
+
+# pandas is imported by the functions that use it, because the updater imports
+# all shops and with them this module, but only a feed update needs pandas
+
+SnapshotDiff = namedtuple("SnapshotDiff", ["added", "changed", "removed"])
+SyncResult = namedtuple("SyncResult", ["inserted", "updated", "unchanged", "removed"])
+
+# a feed with fewer products than this share of the available stored products is
+# taken for a failed or cut short download, so no product is retired
+min_feed_share = 0.5
+
+# the content hash of retired products. It never matches the hash of a feed row,
+# so a retired product counts as changed as soon as it reappears.
+retired_content_hash = "retired"
+
+
+def is_feed_complete(feed_size, available_size, min_share=min_feed_share):
+    return feed_size > 0 and feed_size >= min_share * available_size
+
+
+def get_stored_dataframe(session, shop_name):
+    import pandas as pd
+
+    query = session.query(
+        ProductWholesale.ean,
+        ProductWholesale.is_available,
+        ProductWholesale.content_hash,
+    ).filter_by(shop_name=shop_name)
+    return pd.read_sql(query.statement, session.connection())
+
+
+def diff_snapshot(feed, stored):
+    """
+    Compares the feed with the stored products of a shop in one merge on the EAN.
+    Both dataframes need the columns ean and content_hash, stored also needs
+    is_available. Returns a SnapshotDiff with the lists of added, changed and
+    removed EANs. Products that are already unavailable are not removed again.
+    """
+
+    import pandas as pd
+
+    merged = pd.merge(
+        feed[["ean", "content_hash"]],
+        stored[["ean", "content_hash", "is_available"]],
+        on="ean",
+        how="outer",
+        suffixes=("", "_stored"),
+        indicator=True,
+    )
+    is_added = merged["_merge"] == "left_only"
+    is_changed = (merged["_merge"] == "both") & (
+        merged["content_hash"] != merged["content_hash_stored"]
+    )
+    # NULL counts as available
+    is_removed = (merged["_merge"] == "right_only") & (merged["is_available"] != False)
+    return SnapshotDiff(
+        added=merged.loc[is_added, "ean"].tolist(),
+        changed=merged.loc[is_changed, "ean"].tolist(),
+        removed=merged.loc[is_removed, "ean"].tolist(),
+    )
+
+
+def retire_products(session, shop_name, eans, chunk_size=1000):
+    """
+    Marks the products as unavailable and returns how many were still available.
+    The content hash is set to retired_content_hash, so that the product is made
+    available again as soon as it reappears in the feed.
+    """
+
+    wholesale = ProductWholesale.__table__
+    retired = 0
+    for start in range(0, len(eans), chunk_size):
+        statement = (
+            wholesale.update()
+            .where(wholesale.c.shop_name == shop_name)
+            .where(wholesale.c.ean.in_(eans[start : start + chunk_size]))
+            .where(or_(wholesale.c.is_available.is_(None), wholesale.c.is_available))
+            .values(is_available=False, content_hash=retired_content_hash)
+        )
+        retired = retired + session.connection().execute(statement).rowcount
+    return retired
+
+
+def sync_shop_snapshot(session, shop_name, products, min_share=min_feed_share):
+    """
+    Makes the stored products of the shop match the full feed: new and changed
+    products are upserted and products that are missing from the feed are marked
+    unavailable. New products and retired products that reappear in the feed are
+    available unless the feed says otherwise. For all other products a missing
+    availability keeps the stored one, e.g. the one of the product page checks of
+    Vitrex. If the feed is empty or has fewer products than min_share of the
+    available stored ones, nothing is marked unavailable.
+
+    The session is not committed. Returns a SyncResult.
+    """
+
+    import pandas as pd
+
+    stored = get_stored_dataframe(session, shop_name)
+    retired_eans = set(
+        stored.loc[stored["content_hash"] == retired_content_hash, "ean"]
+    )
+    stored_availability = {
+        cur_ean: None if pd.isna(cur_value) else bool(cur_value)
+        for cur_ean, cur_value in zip(stored["ean"], stored["is_available"])
+    }
+    products_by_ean = {}
+    for cur_product in products:
+        if cur_product.is_available is None:
+            if cur_product.ean in retired_eans:
+                cur_product.is_available = True
+            else:
+                # keeps the content hash of unchanged products equal to the stored
+                cur_product.is_available = stored_availability.get(
+                    cur_product.ean, True
+                )
+        products_by_ean[cur_product.ean] = cur_product
+
+    feed = pd.DataFrame(
+        [product_to_row(cur_product) for cur_product in products_by_ean.values()],
+        columns=["ean", "content_hash"],
+    )
+    diff = diff_snapshot(feed, stored)
+
+    upsert_result = upsert_products_wholesale(
+        session,
+        shop_name,
+        [products_by_ean[cur_ean] for cur_ean in diff.added + diff.changed],
+        compare_hashes=False,
+    )
+    available_size = int((stored["is_available"] != False).sum())
+    if is_feed_complete(len(products_by_ean), available_size, min_share):
+        removed = retire_products(session, shop_name, diff.removed)
+    else:
+        logging.warning(
+            f"The feed of {shop_name} only has {len(products_by_ean)} of "
+            f"{available_size} available products, not retiring any products."
+        )
+        removed = 0
+
+    return SyncResult(
+        inserted=upsert_result.inserted,
+        updated=upsert_result.updated,
+        unchanged=len(products_by_ean) - upsert_result.inserted - upsert_result.updated,
+        removed=removed,
+    )
@@ -2,10 +2,8 @@ import requests
 from urllib.parse import urljoin
 from wholesale import settings
 import json
-import time
-import math
 import logging
-from wholesale.utils import retry_request
+from wholesale.utils import rate_limiter, retry_request
 
 
 class KeepaAPI:
@@ -16,12 +14,10 @@ class KeepaAPI:
         "token": urljoin(base_url, "token/"),
     }
 
+    bucket_name = "keepa"
+
     def __init__(self, access_key):
         self.access_key = access_key
-        self.tokens_left = 0
-        self.refill_rate = 0
-        self.refill_in_seconds = 0
-        self.last_request_time = 0
 
         self.update_token_status()
 
@@ -31,28 +27,16 @@ class KeepaAPI:
             endpoint=KeepaAPI.endpoints["token"], params=params, min_tokens=0
         )
 
-    def wait_for_refill(self, tokens_needed):
-        refills_needed = math.ceil(
-            (tokens_needed - self.tokens_left) / self.refill_rate
-        )
-        sleep_time = max(
-            self.refill_in_seconds
-            + self.last_request_time
-            - time.time()
-            + (refills_needed - 1) * 60,
-            0,
-        )
-        time.sleep(sleep_time)
-
     def make_request(self, endpoint, params, min_tokens):
-        if self.tokens_left < min_tokens:
-            self.wait_for_refill(min_tokens)
+        # the response tells the real number of tokens left
+        rate_limiter.acquire(KeepaAPI.bucket_name, min_tokens)
 
         def request():
             return requests.get(endpoint, params=params)
 
-        response = retry_request(request)
-        self.last_request_time = time.time()
+        response = retry_request(
+            request, bucket=KeepaAPI.bucket_name, tokens=min_tokens
+        )
 
         if not response.ok:
             raise Exception(
@@ -63,9 +47,7 @@ class KeepaAPI:
             )
 
         response_dict = json.loads(response.text)
-        self.tokens_left = response_dict["tokensLeft"]
-        self.refill_in_seconds = response_dict["refillIn"] / 1000
-        self.refill_rate = response_dict["refillRate"]
+        rate_limiter.update_from_keepa_response(KeepaAPI.bucket_name, response_dict)
 
         return response_dict
 
@@ -105,8 +87,20 @@ class KeepaAPI:
         return result
 
 
-_instance = KeepaAPI(settings.KEEPA_ACCESS_KEY)
-get_rating_and_sales_info = _instance.get_rating_and_sales_info
+_instance = None
+
+
+def get_instance():
+    """The client is created on first use, as this already requests the tokens."""
+
+    global _instance
+    if _instance is None:
+        _instance = KeepaAPI(settings.KEEPA_ACCESS_KEY)
+    return _instance
+
+
+def get_rating_and_sales_info(asin, domain_id=3):
+    return get_instance().get_rating_and_sales_info(asin, domain_id)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,6 @@
 from wholesale import keepa
-from wholesale.db import Session
+from wholesale.db import session_scope
 from wholesale.db.models import ProductAmazon
-from wholesale.db.data_loader import get_data
-from wholesale.shops import vitrex, gross_electronic, berk, saraswati
 from sqlalchemy import func, asc
 from tqdm import tqdm
 
@@ -23,55 +21,67 @@ def update_rating_and_sales_info(product, session):
 
 
 def update_no_offer_products():
-    session = Session()
-
-    sum_offers = (func.sum(ProductAmazon.offers)).label("sum_offers")
-    query = (
-        session.query(ProductAmazon.ean, sum_offers)
-        .group_by(ProductAmazon.ean)
-        .having(sum_offers == 0)
-    )
-    ean_list = [cur_product.ean for cur_product in query]
-    query = session.query(ProductAmazon).filter(ProductAmazon.ean.in_(ean_list))
-    for cur_product in tqdm(query, total=query.count()):
-        update_rating_and_sales_info(cur_product, session)
-
-    session.close()
+    with session_scope() as session:
+        sum_offers = (func.sum(ProductAmazon.offers)).label("sum_offers")
+        query = (
+            session.query(ProductAmazon.ean, sum_offers)
+            .group_by(ProductAmazon.ean)
+            .having(sum_offers == 0)
+        )
+        ean_list = [cur_product.ean for cur_product in query]
+        query = session.query(ProductAmazon).filter(ProductAmazon.ean.in_(ean_list))
+        for cur_product in tqdm(query, total=query.count()):
+            update_rating_and_sales_info(cur_product, session)
 
 
 def update_profitable_products(shop_name):
-    data = get_data()
-    profitable = data[(data["profit"] > 0) & (data["shop_name"] == shop_name)]
-    profitable_ean_list = profitable["ean"]
-
-    session = Session()
-    query = session.query(ProductAmazon).filter(
-        ProductAmazon.ean.in_(profitable_ean_list)
-    )
-    for cur_product in tqdm(query, total=query.count()):
-        update_rating_and_sales_info(cur_product, session)
-    session.close()
+    # pandas is only needed for the profitable products
+    from wholesale.db.data_loader import get_data_chunks
+
+    with session_scope() as session:
+        profitable_ean_list = []
+        for cur_chunk in get_data_chunks(
+            session,
+            shops=[shop_name],
+            min_profit=0,
+            columns=["ean", "is_available"],
+        ):
+            is_available = cur_chunk["is_available"] != False
+            profitable_ean_list.extend(cur_chunk.loc[is_available, "ean"])
+
+        query = session.query(ProductAmazon).filter(
+            ProductAmazon.ean.in_(profitable_ean_list)
+        )
+        for cur_product in tqdm(query, total=query.count()):
+            update_rating_and_sales_info(cur_product, session)
 
 
 def update_profitable_unupdated_products(shop_name):
-    data = get_data()
-    profitable = data[
-        (data["review_count"].isnull())
-        & (data["profit"] > 0)
-        & (data["shop_name"] == shop_name)
-    ]
-    profitable_ean_list = profitable["ean"]
-
-    session = Session()
-    query = session.query(ProductAmazon).filter(
-        ProductAmazon.ean.in_(profitable_ean_list)
-    )
-    for cur_product in tqdm(query, total=query.count()):
-        update_rating_and_sales_info(cur_product, session)
-    session.close()
+    from wholesale.db.data_loader import get_data_chunks
+
+    with session_scope() as session:
+        profitable_ean_list = []
+        for cur_chunk in get_data_chunks(
+            session,
+            shops=[shop_name],
+            min_profit=0,
+            columns=["ean", "is_available", "review_count"],
+        ):
+            is_unupdated = (cur_chunk["review_count"].isnull()) & (
+                cur_chunk["is_available"] != False
+            )
+            profitable_ean_list.extend(cur_chunk.loc[is_unupdated, "ean"])
+
+        query = session.query(ProductAmazon).filter(
+            ProductAmazon.ean.in_(profitable_ean_list)
+        )
+        for cur_product in tqdm(query, total=query.count()):
+            update_rating_and_sales_info(cur_product, session)
 
 
 if __name__ == "__main__":
+    from wholesale.shops import vitrex, gross_electronic, berk, saraswati
+
     # update_no_offer_products()
     # update_profitable_products(vitrex.shop_name)
     # update_profitable_products(gross_electronic.shop_name)
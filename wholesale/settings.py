@@ -1,38 +1,108 @@
 import os
 
-DATABASE_MYSQL = {
-    "HOST": os.environ["WHOLESALE_MYSQL_HOST"],
-    "PORT": os.environ["WHOLESALE_MYSQL_PORT"],
-    "USER": os.environ["WHOLESALE_MYSQL_USER"],
-    "PASSWORD": os.environ["WHOLESALE_MYSQL_PASSWORD"],
-    "DBNAME": os.environ["WHOLESALE_MYSQL_DBNAME"],
+# The settings are read from the environment on first access, so importing this
+# module never fails because of a missing variable that the caller doesn't need.
+environment_variables = {
+    "DATABASE_MYSQL": {
+        "HOST": "WHOLESALE_MYSQL_HOST",
+        "PORT": "WHOLESALE_MYSQL_PORT",
+        "USER": "WHOLESALE_MYSQL_USER",
+        "PASSWORD": "WHOLESALE_MYSQL_PASSWORD",
+        "DBNAME": "WHOLESALE_MYSQL_DBNAME",
+    },
+    "AMAZON_MWS": {
+        "AWS_ACCESS_KEY_ID": "AWS_ACCESS_KEY_ID",
+        "SECRET_KEY": "AMAZON_SECRET_KEY",
+        "SELLER_ID": "AMAZON_SELLER_ID",
+        "MWS_AUTH_TOKEN": "MWS_AUTH_TOKEN",
+    },
+    "GROSS_ELECTRONIC": {
+        "USER": "WHOLESALE_GROSS_ELECTRONIC_USER",
+        "PASSWORD": "WHOLESALE_GROSS_ELECTRONIC_PASSWORD",
+    },
+    "NLG_SHOP": {
+        "USER": "WHOLESALE_NLG_SHOP_USER",
+        "PASSWORD": "WHOLESALE_NLG_SHOP_PASSWORD",
+    },
+    "VITREX": {
+        "USER": "WHOLESALE_VITREX_USER",
+        "PASSWORD": "WHOLESALE_VITREX_PASSWORD",
+    },
+    "SARASWATI": {
+        "USER": "WHOLESALE_SARASWATI_USER",
+        "PASSWORD": "WHOLESALE_SARASWATI_PASSWORD",
+    },
+    "KEEPA_ACCESS_KEY": "KEEPA_ACCESS_KEY",
 }
 
-AMAZON_MWS = {
-    "AWS_ACCESS_KEY_ID": os.environ["AWS_ACCESS_KEY_ID"],
-    "SECRET_KEY": os.environ["AMAZON_SECRET_KEY"],
-    "SELLER_ID": os.environ["AMAZON_SELLER_ID"],
-    "MWS_AUTH_TOKEN": os.environ["MWS_AUTH_TOKEN"],
-}
+# the file of the optional local SQLite mirror of the product tables, e.g.
+# ~/.wholesale/mirror.sqlite. If it is set, the updater keeps the mirror in sync
+# and get_data() reads from it. An empty value disables the mirror.
+LOCAL_MIRROR_PATH = os.environ.get("WHOLESALE_LOCAL_MIRROR_PATH", "")
 
-GROSS_ELECTRONIC = {
-    "USER": os.environ["WHOLESALE_GROSS_ELECTRONIC_USER"],
-    "PASSWORD": os.environ["WHOLESALE_GROSS_ELECTRONIC_PASSWORD"],
-}
+# the directory of the optional Arrow cache of get_data(), it needs pyarrow and is
+# disabled by default
+DATA_CACHE_DIR = os.environ.get("WHOLESALE_DATA_CACHE_DIR", "")
 
-NLG_SHOP = {
-    "USER": os.environ["WHOLESALE_NLG_SHOP_USER"],
-    "PASSWORD": os.environ["WHOLESALE_NLG_SHOP_PASSWORD"],
-}
 
-VITREX = {
-    "USER": os.environ["WHOLESALE_VITREX_USER"],
-    "PASSWORD": os.environ["WHOLESALE_VITREX_PASSWORD"],
-}
+def get_database_pool():
+    # MySQL closes connections that are idle for longer than wait_timeout (8 hours
+    # by default), so pooled connections are recycled well before that and pinged
+    # on checkout.
+    return {
+        "SIZE": int(os.environ.get("WHOLESALE_DB_POOL_SIZE", 5)),
+        "MAX_OVERFLOW": int(os.environ.get("WHOLESALE_DB_POOL_MAX_OVERFLOW", 10)),
+        "TIMEOUT": float(os.environ.get("WHOLESALE_DB_POOL_TIMEOUT", 30)),
+        "RECYCLE": int(os.environ.get("WHOLESALE_DB_POOL_RECYCLE", 3600)),
+        "PRE_PING": os.environ.get("WHOLESALE_DB_POOL_PRE_PING", "1") == "1",
+    }
+
+
+def get_asin_mapping_ttl_days():
+    # how many days the EAN to ASIN mappings of GetMatchingProductForId are
+    # reused. EANs without a match or with bundles only are asked again sooner.
+    negative_ttl_days = int(
+        os.environ.get("WHOLESALE_ASIN_MAPPING_NEGATIVE_TTL_DAYS", 7)
+    )
+    return {
+        "match": int(os.environ.get("WHOLESALE_ASIN_MAPPING_TTL_DAYS", 30)),
+        "bundle_only": negative_ttl_days,
+        "no_match": negative_ttl_days,
+    }
 
-SARASWATI = {
-    "USER": os.environ["WHOLESALE_SARASWATI_USER"],
-    "PASSWORD": os.environ["WHOLESALE_SARASWATI_PASSWORD"],
+
+def get_fee_cache():
+    # the GetMyFeesEstimate results are cached in memory and in the fee_estimates
+    # table. Prices within the same band of PRICE_BAND euros share their fees.
+    return {
+        "PRICE_BAND": float(os.environ.get("WHOLESALE_FEE_CACHE_PRICE_BAND", 0.5)),
+        "SIZE": int(os.environ.get("WHOLESALE_FEE_CACHE_SIZE", 100000)),
+        "TTL_DAYS": int(os.environ.get("WHOLESALE_FEE_CACHE_TTL_DAYS", 30)),
+    }
+
+
+# the settings with defaults that have to be parsed, they are parsed on first
+# access as well, so an invalid value only fails the code that uses it
+parsed_settings = {
+    "DATABASE_POOL": get_database_pool,
+    "ASIN_MAPPING_TTL_DAYS": get_asin_mapping_ttl_days,
+    "FEE_CACHE": get_fee_cache,
 }
 
-KEEPA_ACCESS_KEY = os.environ["KEEPA_ACCESS_KEY"]
+
+def __getattr__(name):
+    if name in parsed_settings:
+        value = parsed_settings[name]()
+        globals()[name] = value
+        return value
+    if name not in environment_variables:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    variables = environment_variables[name]
+    if isinstance(variables, dict):
+        value = {cur_key: os.environ[cur_var] for cur_key, cur_var in variables.items()}
+    else:
+        value = os.environ[variables]
+
+    globals()[name] = value
+    return value
@@ -1 +1,8 @@
-from wholesale.shops.berk.berk import shop_name, update_database
+shop_name = "berk.de"
+
+
+def update_database():
+    # pandas is only imported when updating
+    from wholesale.shops.berk import berk
+
+    berk.update_database()
@@ -3,12 +3,13 @@ import pandas as pd
 import requests
 from io import StringIO
 from wholesale.db.models import ProductWholesale
-from wholesale.db import Session
-from tqdm import tqdm
+from wholesale.db import session_scope
+from wholesale.db.snapshot_diff import sync_shop_snapshot
 import math
+import logging
 from decimal import Decimal
 
-shop_name = "berk.de"
+from wholesale.shops.berk import shop_name
 
 catalog_file_name = "Berk_Kat_2020_EAN_Preise.xlsx"
 catalog_file_path = (
@@ -73,21 +74,12 @@ def parse_product_dataframe(df):
 
 def update_database():
     df = get_product_dataframe()
-    total = sum([1 for cur_product in parse_product_dataframe(df)])
-    session = Session()
-    for cur_product in tqdm(parse_product_dataframe(df), total=total):
-        old_product = (
-            session.query(ProductWholesale)
-            .filter_by(shop_name=shop_name, ean=cur_product.ean)
-            .first()
-        )
-        if old_product is None:
-            session.add(cur_product)
-        elif cur_product != old_product:
-            old_product.name = cur_product.name
-            old_product.price_net = cur_product.price_net
-    session.commit()
-    session.close()
+    with session_scope() as session:
+        result = sync_shop_snapshot(session, shop_name, parse_product_dataframe(df))
+    logging.info(
+        f"Inserted {result.inserted}, updated {result.updated}, "
+        f"unchanged {result.unchanged}, removed {result.removed} products."
+    )
 
 
 if __name__ == "__main__":
@@ -7,9 +7,9 @@ import time
 import io
 import csv
 from decimal import Decimal
-from tqdm import tqdm
 import logging
-from wholesale.db import Session
+from wholesale.db import session_scope
+from wholesale.db.snapshot_diff import sync_shop_snapshot
 from wholesale.db.models import ProductWholesale
 from wholesale import settings
 
@@ -253,22 +253,13 @@ def update_database():
     csv_file = io.StringIO(csv_string)
 
     logging.info("Started parsing csv")
-    session = Session()
-    for cur_product in tqdm(parse_csv(csv_file)):
-        old_product = (
-            session.query(ProductWholesale)
-            .filter_by(shop_name=shop_name, ean=cur_product.ean)
-            .first()
-        )
-        if old_product is None:
-            session.add(cur_product)
-        elif cur_product != old_product:
-            old_product.name = cur_product.name
-            old_product.price_net = cur_product.price_net
-            old_product.age_restriction = cur_product.age_restriction
-    session.commit()
-    session.close()
+    with session_scope() as session:
+        result = sync_shop_snapshot(session, shop_name, parse_csv(csv_file))
     csv_file.close()
+    logging.info(
+        f"Inserted {result.inserted}, updated {result.updated}, "
+        f"unchanged {result.unchanged}, removed {result.removed} products."
+    )
     logging.info("Done.")
 
 
@@ -1,3 +1,8 @@
-from wholesale.shops.nlgshop.run_crawler import update_database
-
 shop_name = "nlgshop.de"
+
+
+def update_database():
+    # scrapy and the twisted reactor are only imported when crawling
+    from wholesale.shops.nlgshop import run_crawler
+
+    run_crawler.update_database()
@@ -8,8 +8,6 @@
 #     https://docs.scrapy.org/en/latest/topics/settings.html
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-from fake_useragent import UserAgent
-
 BOT_NAME = "nlgshop_scrapy"
 
 SPIDER_MODULES = ["wholesale.shops.nlgshop.nlgshop_scrapy.spiders"]
@@ -17,7 +15,7 @@ NEWSPIDER_MODULE = "wholesale.shops.nlgshop.nlgshop_scrapy.spiders"
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
-USER_AGENT = UserAgent().firefox
+# USER_AGENT is set by run_crawler.py, as fake_useragent may need the network
 
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = False
@@ -69,6 +67,11 @@ ITEM_PIPELINES = {
     "wholesale.shops.nlgshop.nlgshop_scrapy.pipelines.NlgDatabasePipeline": 300,
 }
 
+# The database pipeline writes the buffered items whenever this many items are
+# buffered or this many seconds have passed since the last write.
+DATABASE_PIPELINE_FLUSH_SIZE = 500
+DATABASE_PIPELINE_FLUSH_INTERVAL = 30
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 # AUTOTHROTTLE_ENABLED = True
@@ -1,3 +1,4 @@
+from fake_useragent import UserAgent
 from scrapy.crawler import CrawlerRunner
 from scrapy.settings import Settings
 from wholesale.shops.nlgshop.nlgshop_scrapy.spiders.nlgshop_spider import NlgshopSpider
@@ -7,6 +8,7 @@ from twisted.internet import reactor
 def update_database():
     settings = Settings()
     settings.setmodule("wholesale.shops.nlgshop.nlgshop_scrapy.settings")
+    settings.set("USER_AGENT", UserAgent().firefox)
 
     runner = CrawlerRunner(settings)
 
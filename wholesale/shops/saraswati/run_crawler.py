@@ -1,3 +1,4 @@
+from fake_useragent import UserAgent
 from scrapy.crawler import CrawlerRunner
 from scrapy.settings import Settings
 from twisted.internet import reactor
@@ -10,6 +11,7 @@ import logging
 def update_database():
     settings = Settings()
     settings.setmodule("wholesale.shops.saraswati.saraswati_scrapy.settings")
+    settings.set("USER_AGENT", UserAgent().firefox)
 
     runner = CrawlerRunner(settings)
 
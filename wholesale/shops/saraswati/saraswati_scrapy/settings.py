@@ -1,5 +1,3 @@
-from fake_useragent import UserAgent
-
 # -*- coding: utf-8 -*-
 
 # Scrapy settings for saraswati_scrapy project
@@ -18,7 +16,7 @@ NEWSPIDER_MODULE = "wholesale.shops.saraswati.saraswati_scrapy.spiders"
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
-USER_AGENT = UserAgent().firefox
+# USER_AGENT is set by run_crawler.py, as fake_useragent may need the network
 
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = False
@@ -70,6 +68,11 @@ ITEM_PIPELINES = {
     "wholesale.shops.saraswati.saraswati_scrapy.pipelines.SaraswatiScrapyPipeline": 300,
 }
 
+# The database pipeline writes the buffered items whenever this many items are
+# buffered or this many seconds have passed since the last write.
+DATABASE_PIPELINE_FLUSH_SIZE = 500
+DATABASE_PIPELINE_FLUSH_INTERVAL = 30
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 # AUTOTHROTTLE_ENABLED = True
@@ -0,0 +1,182 @@
+from abc import ABC, abstractmethod
+from scrapy import signals
+from twisted.internet import defer, task, threads
+from wholesale.db import session_scope
+from wholesale.db.bulk_upsert import (
+    upsert_products_wholesale,
+    get_content_hashes,
+    product_to_row,
+)
+from wholesale.db.snapshot_diff import (
+    retire_products,
+    is_feed_complete,
+    retired_content_hash,
+)
+
+
+class BufferedDatabasePipeline(ABC):
+    """
+    Item pipeline that writes ProductWholesaleItems to the database in batches.
+
+    The content hashes of all products of the shop are loaded once when the spider
+    opens. Items with an unchanged hash are dropped right away, all others are
+    buffered and merged into the database with the bulk upsert whenever
+    flush_size items are buffered or flush_interval seconds have passed. The
+    database work runs in a thread so that the crawl does not block on it.
+
+    If the crawl finishes normally, all known products that were not scraped are
+    marked unavailable.
+
+    A product is only remembered as known once its batch was written, so the
+    products of a failed batch are written again when they are scraped again.
+
+    Subclasses have to set the class attribute shop_name.
+    """
+
+    def __init__(self, flush_size=500, flush_interval=30):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.known_hashes = {}
+        self.buffer = {}
+        self.seen_eans = set()
+        self.flush_loop = None
+        self.pending_writes = defer.succeed(None)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(
+            flush_size=crawler.settings.getint("DATABASE_PIPELINE_FLUSH_SIZE", 500),
+            flush_interval=crawler.settings.getfloat(
+                "DATABASE_PIPELINE_FLUSH_INTERVAL", 30
+            ),
+        )
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    @property
+    @abstractmethod
+    def shop_name(self):
+        """The name of the shop whose products the pipeline writes."""
+
+    def load_known_hashes(self):
+        with session_scope() as session:
+            return get_content_hashes(session, self.shop_name)
+
+    def write_batch(self, batch):
+        with session_scope() as session:
+            return upsert_products_wholesale(
+                session, self.shop_name, batch, compare_hashes=False
+            )
+
+    def retire_batch(self, eans):
+        with session_scope() as session:
+            return retire_products(session, self.shop_name, eans)
+
+    def open_spider(self, spider):
+        def start(known_hashes):
+            self.known_hashes = known_hashes
+            spider.logger.info(f"Loaded {len(known_hashes)} known products.")
+            self.flush_loop = task.LoopingCall(self.flush, spider)
+            self.flush_loop.start(self.flush_interval, now=False)
+
+        d = threads.deferToThread(self.load_known_hashes)
+        d.addCallback(start)
+        return d
+
+    def process_item(self, item, spider):
+
+        if item.ean == "":
+            return item
+
+        # a scraped product is available unless the spider says otherwise
+        if item.is_available is None:
+            item.is_available = True
+
+        self.seen_eans.add(item.ean)
+        content_hash = product_to_row(item)["content_hash"]
+        if self.known_hashes.get(item.ean) != content_hash:
+            self.buffer[item.ean] = item
+            if len(self.buffer) >= self.flush_size:
+                self.flush(spider)
+
+        return item
+
+    def flush(self, spider):
+        """
+        Hands the buffered items to a database thread. Writes are chained, so only
+        one batch is written at a time. Returns a Deferred that fires when all
+        writes so far are done.
+        """
+
+        if len(self.buffer) == 0:
+            return self.pending_writes
+
+        batch = list(self.buffer.values())
+        self.buffer = {}
+
+        def write(_):
+            return threads.deferToThread(self.write_batch, batch)
+
+        def log_result(result):
+            for cur_item in batch:
+                self.known_hashes[cur_item.ean] = product_to_row(cur_item)[
+                    "content_hash"
+                ]
+            spider.logger.info(
+                f"Wrote {len(batch)} products: inserted {result.inserted}, "
+                f"updated {result.updated}, unchanged {result.unchanged}."
+            )
+
+        def log_error(failure):
+            spider.logger.error(
+                f"Could not write {len(batch)} products to the database: "
+                f"{failure.getErrorMessage()}"
+            )
+
+        self.pending_writes.addCallback(write)
+        self.pending_writes.addCallbacks(log_result, log_error)
+        return self.pending_writes
+
+    def close_spider(self, spider):
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+        return self.flush(spider)
+
+    def spider_closed(self, spider, reason):
+        """
+        Runs after close_spider, so all buffered items are written already. The
+        products are only retired after a complete crawl that scraped enough of
+        the known products.
+        """
+
+        if reason != "finished":
+            spider.logger.warning(
+                f"Crawl closed with reason {reason}, not retiring any products."
+            )
+            return
+
+        available_size = sum(
+            1
+            for cur_hash in self.known_hashes.values()
+            if cur_hash != retired_content_hash
+        )
+        if not is_feed_complete(len(self.seen_eans), available_size):
+            spider.logger.warning(
+                f"Only scraped {len(self.seen_eans)} of {available_size} known "
+                f"products, not retiring any products."
+            )
+            return
+
+        missing_eans = [
+            cur_ean for cur_ean in self.known_hashes if cur_ean not in self.seen_eans
+        ]
+
+        def retire(_):
+            return threads.deferToThread(self.retire_batch, missing_eans)
+
+        def log_result(retired):
+            spider.logger.info(f"Marked {retired} missing products as unavailable.")
+
+        self.pending_writes.addCallback(retire)
+        self.pending_writes.addCallback(log_result)
+        return self.pending_writes
@@ -8,20 +8,17 @@ from io import StringIO
 import csv
 from tqdm import tqdm
 from wholesale.db.models import ProductWholesale
-from wholesale.db import Session
+from wholesale.db import session_scope
+from wholesale.db.snapshot_diff import sync_shop_snapshot
 from decimal import Decimal
 from wholesale import settings
-from wholesale.utils import retry_request
-from wholesale.db import data_loader
-
+from wholesale.utils import rate_limiter, retry_request
 
 shop_name = "vitrex.de"
 base_url = "https://www.vitrex-shop.de/"
 login_url = urljoin(base_url, "de/login__10/")
 csv_download_url = urljoin(base_url, "ajax.php?dl_link=1")
 
-last_availability_request_time = 0
-
 
 def get_hidden_login_field_data(login_html):
     """Returns a dictionary of all the hidden fields in the login form."""
@@ -51,18 +48,12 @@ def is_login_successful(after_login_html):
 
 
 def is_available(ean):
-    global last_availability_request_time
-
     params = {"quicksearch": ean, "search_button": 1}
     headers = {"User-Agent": UserAgent().firefox}
     url = "https://www.vitrex-shop.de/de/erweiterte-suche__13/"
 
-    time_diff = time.time() - last_availability_request_time
-    if time_diff < 1:
-        time.sleep(1 - time_diff)
-
+    rate_limiter.acquire(shop_name)
     response = requests.get(url, params=params, headers=headers)
-    last_availability_request_time = time.time()
     response.raise_for_status()
 
     bs = BeautifulSoup(response.text, "html.parser")
@@ -161,20 +152,6 @@ class Vitrex:
         return csv_raw_text
 
 
-def get_product_count(csv_file):
-    reader = csv.DictReader(csv_file, delimiter=";")
-    product_count = 0
-    try:
-        for cur_record in reader:
-            if cur_record["USK"] == "indiziert" or cur_record["EAN"].strip() == "":
-                continue
-            product_count = product_count + 1
-    except csv.Error as e:
-        if str(e) != "line contains NUL":  # the last line in this .csv is NUL
-            raise e
-    return product_count
-
-
 def parse_csv(csv_file):
     reader = csv.DictReader(csv_file, delimiter=";")
     try:
@@ -207,46 +184,39 @@ def update_database():
     )
     csv_string = vitrex.get_csv_string()
     csv_file = StringIO(csv_string)
-    product_count = get_product_count(csv_file)
-    csv_file.close()
-    csv_file = StringIO(csv_string)
 
     logging.info("Started parsing csv")
-    session = Session()
-    for cur_product in tqdm(parse_csv(csv_file), total=product_count):
-        old_product = (
-            session.query(ProductWholesale)
-            .filter_by(shop_name=shop_name, ean=cur_product.ean)
-            .first()
-        )
-        if old_product is None:
-            session.add(cur_product)
-            session.commit()
-        elif cur_product != old_product:
-            old_product.update(cur_product)
-            session.commit()
-    session.close()
+    with session_scope() as session:
+        result = sync_shop_snapshot(session, shop_name, parse_csv(csv_file))
     csv_file.close()
+    logging.info(
+        f"Inserted {result.inserted}, updated {result.updated}, "
+        f"unchanged {result.unchanged}, removed {result.removed} products."
+    )
     logging.info("Done.")
 
 
 def clean_profitable_products():
-    df = data_loader.get_data()
-    df = df[(df["shop_name"] == shop_name) & (df["profit"] > 0)]
-    ean_list = df["ean"]
+    # pandas is only needed for the cleanup
+    from wholesale.db import data_loader
 
-    session = Session()
-    query = session.query(ProductWholesale).filter(ProductWholesale.ean.in_(ean_list))
-    for cur_product in tqdm(query, total=query.count()):
+    with session_scope() as session:
+        df = data_loader.get_data(
+            session, shops=[shop_name], min_profit=0, columns=["ean"]
+        )
+        ean_list = df["ean"]
 
-        def availability_check_request():
-            return is_available(cur_product.ean)
+        query = session.query(ProductWholesale).filter(
+            ProductWholesale.ean.in_(ean_list)
+        )
+        for cur_product in tqdm(query, total=query.count()):
 
-        cur_availability = retry_request(availability_check_request)
-        cur_product.is_available = cur_availability
-        session.commit()
+            def availability_check_request():
+                return is_available(cur_product.ean)
 
-    session.close()
+            cur_availability = retry_request(availability_check_request)
+            cur_product.is_available = cur_availability
+            session.commit()
 
 
 if __name__ == "__main__":
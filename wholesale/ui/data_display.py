@@ -1,9 +1,13 @@
-from wholesale.db import data_loader
-import dtale
+from wholesale.db import session_scope
 
 
 def display_data():
-    data = data_loader.get_data()
+    # imported here, because the updater imports this module on every run
+    from wholesale.db import data_loader
+    import dtale
+
+    with session_scope() as session:
+        data = data_loader.get_data(session)
     d = dtale.show(data, host="localhost", open_browser=True)
     print("Hit enter to exit.")
     input()
@@ -1,25 +1,63 @@
-from wholesale.shops import gross_electronic, nlgshop, vitrex, berk, saraswati
-from wholesale.amazon import amazon_db
-from wholesale.ui import data_display
-from wholesale import keepa
 import logging
 
 
+def sync_local_mirror():
+    # imported here, because the mirror module needs pandas
+    from wholesale.db import Session, local_mirror
+
+    if not local_mirror.is_enabled():
+        return
+    logging.info("Syncing the local mirror")
+    session = Session()
+    try:
+        local_mirror.sync_mirror(session)
+    finally:
+        session.close()
+
+
+def refresh_opportunities():
+    # imported here, because the opportunities module needs pandas
+    from wholesale.db import session_scope, opportunities
+
+    logging.info("Refreshing the opportunities")
+    with session_scope() as session:
+        opportunities.refresh_opportunities(session)
+
+
 def update_shop(shop):
+    # imported here, because the Amazon, Keepa and shop modules load their API
+    # clients and parsers, which importing the updater shouldn't pay for
+    from wholesale.amazon import amazon_db
+    from wholesale.shops import vitrex
+    from wholesale import keepa
+    from wholesale.db import get_engine, price_history, frame_cache
+
+    price_history.ensure_partitions(get_engine())
+    frame_cache.invalidate()
     shop.update_database()
     logging.info("Updating Amazon db")
     amazon_db.update_database(shop.shop_name)
+    # the cleanup and the keepa updates read get_data(), which uses the fresh
+    # opportunities or the local mirror
+    refresh_opportunities()
+    sync_local_mirror()
 
     if shop is vitrex:
         logging.info("Cleaning up the unavailable profitable products")
         shop.clean_profitable_products()
+        sync_local_mirror()
 
     logging.info("Updating un-updated profitable products keepa data")
     keepa.update_profitable_unupdated_products(shop.shop_name)
+    refresh_opportunities()
+    sync_local_mirror()
     logging.info("Done.")
 
 
 if __name__ == "__main__":
+    from wholesale.shops import gross_electronic, nlgshop, vitrex, berk, saraswati
+    from wholesale.ui import data_display
+
     logging.basicConfig(level=logging.INFO)
     # update_shop(vitrex)
     # update_shop(gross_electronic)
@@ -0,0 +1,48 @@
+from collections import namedtuple
+import threading
+
+# A tiny in-process metrics registry. Counters count events, timers collect the
+# number, sum and maximum of durations in seconds. Both are safe to use from
+# several threads.
+
+TimerStats = namedtuple("TimerStats", ["count", "total", "max"])
+
+_lock = threading.Lock()
+_counters = {}
+_timers = {}
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, seconds):
+    with _lock:
+        count, total, maximum = _timers.get(name, (0, 0.0, 0.0))
+        _timers[name] = TimerStats(count + 1, total + seconds, max(maximum, seconds))
+
+
+def get_counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def get_timer(name):
+    with _lock:
+        return _timers.get(name, TimerStats(0, 0.0, 0.0))
+
+
+def get_metrics():
+    """Returns a snapshot {name: value} of all counters and timers."""
+
+    with _lock:
+        result = dict(_counters)
+        result.update(_timers)
+        return result
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
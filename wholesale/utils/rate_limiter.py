@@ -0,0 +1,158 @@
+from datetime import datetime, timezone
+import asyncio
+import logging
+import threading
+import time
+
+# Named token buckets for all throttled external APIs. A bucket holds up to
+# capacity tokens and restores restore_rate tokens per second. A request takes
+# its tokens right away and then waits until the bucket would have had them, so
+# the callers are served in order, from threads and from coroutines alike.
+# Servers that report their quota, like MWS and Keepa, correct the buckets with
+# every response, so the requests run at the rate that is actually allowed.
+
+# capacity and restore rate per second of the buckets, the MWS restore rates are
+# the ones of requests with the maximum number of items
+bucket_configs = {
+    "mws.GetMatchingProductForId": (20, 1.0),
+    "mws.GetCompetitivePricingForASIN": (20, 0.5),
+    "mws.GetLowestOfferListingsForASIN": (20, 0.5),
+    "mws.GetMyFeesEstimate": (20, 0.5),
+    # Keepa reports its real quota with the first response
+    "keepa": (60, 1 / 60),
+    "vitrex.de": (1, 1.0),
+}
+
+_lock = threading.Lock()
+_buckets = {}
+
+
+class TokenBucket:
+    def __init__(self, capacity, restore_rate):
+        self.capacity = capacity
+        self.restore_rate = restore_rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _restore(self, now):
+        # updated_at lies in the future while the server restores nothing
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.restore_rate)
+            self.updated_at = now
+
+    def reserve(self, tokens=1):
+        """Takes the tokens and returns the seconds to wait before using them."""
+
+        with self.lock:
+            now = time.monotonic()
+            self._restore(now)
+            self.tokens = self.tokens - tokens
+            if self.tokens >= 0:
+                return 0.0
+            # the missing tokens are restored from updated_at on
+            return max(0.0, self.updated_at - now) + -self.tokens / self.restore_rate
+
+    def acquire(self, tokens=1):
+        time.sleep(self.reserve(tokens))
+
+    async def acquire_async(self, tokens=1):
+        await asyncio.sleep(self.reserve(tokens))
+
+    def update(
+        self,
+        tokens=None,
+        refill_in=None,
+        restore_rate=None,
+        capacity=None,
+        only_lower=False,
+    ):
+        """
+        Corrects the bucket with the quota that the server reported. tokens are
+        the tokens left and refill_in the seconds until the server restores the
+        next ones. If only_lower is set, tokens only lower the tokens of the
+        bucket, e.g. for a quota that restores slower than the bucket.
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            if capacity is not None:
+                self.capacity = capacity
+            if restore_rate is not None and restore_rate > 0:
+                self.restore_rate = restore_rate
+            self._restore(now)
+            if tokens is not None and not (only_lower and tokens >= self.tokens):
+                self.tokens = min(self.capacity, tokens)
+                self.updated_at = now
+            if refill_in is not None:
+                # the first whole token arrives after refill_in seconds
+                self.updated_at = now + max(0.0, refill_in - 1 / self.restore_rate)
+
+
+def get_bucket(name):
+    with _lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            bucket = TokenBucket(*bucket_configs[name])
+            _buckets[name] = bucket
+        return bucket
+
+
+def reset():
+    with _lock:
+        _buckets.clear()
+
+
+def acquire(name, tokens=1):
+    get_bucket(name).acquire(tokens)
+
+
+async def acquire_async(name, tokens=1):
+    await get_bucket(name).acquire_async(tokens)
+
+
+def parse_mws_timestamp(value):
+    # e.g. 2020-06-01T12:00:00.000Z
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ").replace(
+        tzinfo=timezone.utc
+    )
+
+
+def update_from_mws_headers(name, headers):
+    """
+    Takes the hourly quota of the x-mws-quota-* headers into account. Once it is
+    used up, no request is made until it resets.
+    """
+
+    remaining = headers.get("x-mws-quota-remaining")
+    if remaining is None:
+        return
+    try:
+        remaining = float(remaining)
+        refill_in = None
+        resets_on = headers.get("x-mws-quota-resetsOn")
+        if remaining < 1 and resets_on is not None:
+            refill_in = (
+                parse_mws_timestamp(resets_on) - datetime.now(timezone.utc)
+            ).total_seconds()
+    except ValueError:
+        logging.warning(f"Could not parse the MWS quota headers of {name}.")
+        return
+    if refill_in is not None:
+        get_bucket(name).update(tokens=remaining, refill_in=refill_in)
+    else:
+        get_bucket(name).update(tokens=remaining, only_lower=True)
+
+
+def update_from_keepa_response(name, response_dict):
+    """Takes tokensLeft, refillIn and refillRate of a Keepa response."""
+
+    refill_rate = response_dict["refillRate"]
+    get_bucket(name).update(
+        tokens=response_dict["tokensLeft"],
+        refill_in=response_dict["refillIn"] / 1000,
+        # Keepa restores refillRate tokens per minute and stores up to an hour
+        restore_rate=refill_rate / 60,
+        capacity=refill_rate * 60,
+    )
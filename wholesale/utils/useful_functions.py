@@ -1,26 +1,27 @@
 import time
 import logging
+from wholesale.utils import rate_limiter
 
 
-def retry_request(request, retry_count=5, sleep_time=2):
-    success = False
-    last_request_time = 0
-    response = None
-    while not success:
+def retry_request(request, retry_count=5, sleep_time=2, bucket=None, tokens=1):
+    """
+    Calls request until it succeeds, at most retry_count times. The waits between
+    the attempts start at sleep_time seconds and double every time. The callers
+    take the tokens of the first attempt, if bucket is given, every retry takes
+    tokens from that rate_limiter bucket again.
+    """
+
+    attempt = 0
+    while True:
         try:
-            elapsed = time.time() - last_request_time
-            if elapsed < sleep_time:
-                time.sleep(sleep_time - elapsed)
-            response = request()
-            last_request_time = time.time()
-            success = True
+            return request()
         except Exception as e:
-            if retry_count > 1:
-                logging.error("An exception ocured. Trying again.")
-                logging.error(e)
-                retry_count = retry_count - 1
-                time.sleep(sleep_time)
-            else:
+            attempt = attempt + 1
+            if attempt >= retry_count:
                 logging.critical("Maximum number of retries reached.")
                 raise e
-    return response
+            logging.error("An exception ocured. Trying again.")
+            logging.error(e)
+            time.sleep(sleep_time * 2 ** (attempt - 1))
+            if bucket is not None:
+                rate_limiter.acquire(bucket, tokens)